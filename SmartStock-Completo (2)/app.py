@@ -7,9 +7,21 @@ Hackathon OneCard 2024
 Ejecutar: python app.py
 """
 
-from flask import Flask, jsonify, request
+import hashlib
+import os
+from datetime import datetime
+from itertools import islice
+
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
 from services import DataService, MotorReglas, InventarioService, PedidosService, TrackingService, AnalyticsService
+from services.cache import CacheLRU
+from services.compresion import NIVELES, Compresor
+from services.eventos import BusEventos
+from services.listados import codificar_cursor, decodificar_cursor, proyectar
+from services.almacen_sqlite import AlmacenSQLite
+from services.journal import JournalPedidos
+from services.secuencia import SecuenciaIds
 
 # ============================================================
 # INICIALIZACIÓN
@@ -23,26 +35,289 @@ print("\n" + "=" * 60)
 print("🚀 SmartStock - Sistema de Control de Incentivos")
 print("=" * 60)
 
-data_service = DataService(data_path='data')
+# Persistencia opcional:
+#   SMARTSTOCK_DB=ruta/al/archivo.db       -> SQLite
+#   SMARTSTOCK_JOURNAL=ruta/al/directorio  -> bitácora append-only
+#   SMARTSTOCK_IDS=ruta/al/ids.db          -> secuencia de ids compartida entre
+#                                            workers (por defecto junto al almacén)
+ruta_db = os.environ.get('SMARTSTOCK_DB')
+ruta_journal = os.environ.get('SMARTSTOCK_JOURNAL')
+ruta_ids = os.environ.get('SMARTSTOCK_IDS')
+if ruta_db:
+    almacen = AlmacenSQLite(ruta_db)
+    ruta_ids = ruta_ids or os.path.splitext(ruta_db)[0] + '.ids.db'
+elif ruta_journal:
+    almacen = JournalPedidos(ruta_journal)
+    ruta_ids = ruta_ids or os.path.join(ruta_journal, 'ids.db')
+else:
+    almacen = None
+secuencia = SecuenciaIds(ruta_ids) if ruta_ids else None
+
+data_service = DataService(data_path='data', recarga_automatica=True)
 motor_reglas = MotorReglas(data_service)
 inventario_service = InventarioService(data_service)
-pedidos_service = PedidosService(data_service, motor_reglas)
-tracking_service = TrackingService(pedidos_service)
+pedidos_service = PedidosService(data_service, motor_reglas, almacen=almacen, secuencia=secuencia)
+# Cambios de estado en vivo para los endpoints SSE
+bus_eventos = BusEventos(capacidad=100, max_suscriptores=1000)
+tracking_service = TrackingService(pedidos_service, eventos=bus_eventos)
 analytics_service = AnalyticsService(data_service, motor_reglas)
 
 print("=" * 60)
 
+# Máximo de pedidos por solicitud en los endpoints de lote
+MAX_PEDIDOS_LOTE = 10000
+
+# Compresión de respuestas (gzip; brotli/zstd si están instaladas):
+#   SMARTSTOCK_COMPRESION_MINIMO=bytes        -> tamaño mínimo a comprimir
+#   SMARTSTOCK_NIVEL_GZIP / _BR / _ZSTD=nivel -> nivel de cada codificación
+compresor = Compresor(
+    minimo_bytes=int(os.environ.get('SMARTSTOCK_COMPRESION_MINIMO', 1024)),
+    niveles={
+        codificacion: int(os.environ[f'SMARTSTOCK_NIVEL_{codificacion.upper()}'])
+        for codificacion in NIVELES
+        if f'SMARTSTOCK_NIVEL_{codificacion.upper()}' in os.environ
+    }
+)
+
+# ============================================================
+# CACHE DE RESPUESTAS
+# ============================================================
+# Los listados completos solo cambian cuando cambia alguna de sus tablas
+# (un pedido confirmado, una recarga). Se guardan ya serializados, con la
+# versión de esas tablas como sello y un ETag fuerte del contenido; un
+# If-None-Match que coincide se responde con 304 sin cuerpo. Los bytes
+# comprimidos de cada codificación se guardan junto al cuerpo la primera
+# vez que se piden, así no se comprime de nuevo en cada solicitud.
+
+respuestas_cache = CacheLRU(capacidad=32)
+
+def respuesta_cacheada(nombre, tablas, construir, con_reglas=False):
+    """
+    Devuelve la respuesta JSON de un listado desde la cache.
+    nombre: clave de la respuesta; tablas: tablas de las que depende;
+    construir: función que arma el payload si hay que regenerarlo;
+    con_reglas: si aplica las reglas configurables (maximo_pedido).
+    """
+    # El sello se lee antes de construir: un cambio en medio deja la
+    # entrada con la versión vieja y la siguiente solicitud la regenera
+    sello = tuple(data_service.version_tabla(tabla) for tabla in tablas)
+    if con_reglas:
+        # Las reglas por temporada cambian el resultado al cambiar el mes
+        sello += (motor_reglas.sello_temporada(),)
+    entrada = respuestas_cache.obtener(nombre, sello)
+    if entrada is None:
+        respuesta = jsonify(construir())
+        cuerpo = respuesta.get_data()
+        entrada = (cuerpo, respuesta.mimetype, hashlib.sha256(cuerpo).hexdigest()[:32], {})
+        respuestas_cache.guardar(nombre, sello, entrada)
+    
+    cuerpo, mimetype, etag, comprimidos = entrada
+    codificacion = compresor.elegir(request.accept_encodings, len(cuerpo))
+    if codificacion is None:
+        respuesta = Response(cuerpo, mimetype=mimetype)
+    else:
+        comprimido = comprimidos.get(codificacion)
+        if comprimido is None:
+            comprimido = comprimidos[codificacion] = compresor.comprimir(cuerpo, codificacion)
+        else:
+            compresor.reutilizado(codificacion)
+        respuesta = Response(comprimido, mimetype=mimetype)
+        respuesta.headers['Content-Encoding'] = codificacion
+        # Un ETag fuerte distinto por codificación (son bytes distintos)
+        etag = f'{etag}-{codificacion}'
+    respuesta.vary.add('Accept-Encoding')
+    respuesta.set_etag(etag)
+    # El navegador puede guardarla, pero debe revalidar con el ETag
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    return respuesta.make_conditional(request)
+
+# ============================================================
+# LISTADOS: FILTROS, CURSOR Y PROYECCIÓN
+# ============================================================
+# ?cliente_id=1,2&producto_id=3&estado_envio=en_camino&desde=2024-01-01
+#  &hasta=2024-01-31&limit=50&cursor=<siguiente>&fields=id,tracking
+# Los filtros se resuelven con índices en los servicios; sin ninguno de
+# estos parámetros los listados responden completos, como siempre.
+
+PARAMETROS_LISTADO = ('cliente_id', 'producto_id', 'estado_envio', 'desde', 'hasta', 'limit', 'cursor', 'fields')
+MAX_LIMITE_LISTADO = 1000
+FILTROS_PEDIDOS = {'cliente_id': int, 'producto_id': int, 'estado_envio': str}
+# Listado sin filtros ni paginación (lo que equivale a no enviar parámetros)
+LISTADO_COMPLETO = {'filtros': {}, 'desde': None, 'hasta': None, 'cursor': None, 'limite': None, 'campos': None}
+
+def leer_listado(filtros_validos, cursor_valido, con_fechas=True):
+    """
+    Lee de la query los parámetros de un listado.
+    filtros_validos: parámetro -> conversión de cada valor (separados por coma)
+    cursor_valido: comprueba la clave que trae el cursor
+    con_fechas: si el listado acepta desde/hasta
+    Devuelve None si la solicitud no usa ninguno (listado completo), o un
+    dict con filtros, desde, hasta, cursor, limite y campos.
+    Lanza ValueError con el mensaje para responder 400.
+    """
+    if not any(parametro in request.args for parametro in PARAMETROS_LISTADO):
+        return None
+    
+    # Un filtro que el listado no admite se rechaza en lugar de ignorarlo
+    admitidos = set(filtros_validos) | {'limit', 'cursor', 'fields'}
+    if con_fechas:
+        admitidos.update(('desde', 'hasta'))
+    no_admitidos = [parametro for parametro in PARAMETROS_LISTADO if parametro in request.args and parametro not in admitidos]
+    if no_admitidos:
+        raise ValueError(f'{", ".join(no_admitidos)} no se admite en este listado')
+    
+    filtros = {}
+    for parametro, convertir in filtros_validos.items():
+        texto = request.args.get(parametro)
+        if texto:
+            try:
+                filtros[parametro] = tuple(convertir(valor) for valor in texto.split(','))
+            except ValueError:
+                raise ValueError(f'{parametro} inválido: {texto}')
+    
+    fechas = {}
+    for parametro in ('desde', 'hasta'):
+        texto = request.args.get(parametro) or None
+        if texto:
+            try:
+                datetime.strptime(texto, '%Y-%m-%d')
+            except ValueError:
+                raise ValueError(f'{parametro} debe tener el formato YYYY-MM-DD')
+        fechas[parametro] = texto
+    
+    limite = request.args.get('limit')
+    if limite is not None:
+        if not limite.isdigit() or not 0 < int(limite) <= MAX_LIMITE_LISTADO:
+            raise ValueError(f'limit debe estar entre 1 y {MAX_LIMITE_LISTADO}')
+        limite = int(limite)
+    
+    cursor = request.args.get('cursor') or None
+    if cursor is not None:
+        cursor = decodificar_cursor(cursor)
+        if not cursor_valido(cursor):
+            raise ValueError('cursor inválido')
+    
+    campos = tuple(campo for campo in request.args.get('fields', '').split(',') if campo)
+    
+    return {
+        'filtros': filtros,
+        'desde': fechas['desde'],
+        'hasta': fechas['hasta'],
+        'cursor': cursor,
+        'limite': limite,
+        'campos': campos or None
+    }
+
+def _cursor_entero(cursor):
+    return isinstance(cursor, int) and not isinstance(cursor, bool)
+
+def respuesta_listado(nombre, filas, siguiente, listado):
+    """Página de un listado: filas proyectadas y cursor de la siguiente (o None)"""
+    return jsonify({
+        nombre: proyectar(filas, listado['campos']),
+        'siguiente': codificar_cursor(siguiente)
+    })
+
+# ============================================================
+# EXPORTACIÓN EN STREAMING (NDJSON)
+# ============================================================
+# ?formato=ndjson (o Accept: application/x-ndjson) responde una fila JSON
+# por línea a medida que se generan: la memoria no crece con el historial
+# y el cliente empieza a leer de inmediato. Acepta los filtros y fields
+# de los listados; limit y cursor no aplican (se exporta todo).
+
+MIMETYPE_NDJSON = 'application/x-ndjson'
+FILAS_POR_BLOQUE = 200
+
+def quiere_ndjson():
+    return (
+        request.args.get('formato') == 'ndjson' or
+        request.accept_mimetypes.best == MIMETYPE_NDJSON
+    )
+
+def respuesta_ndjson(filas, campos=None):
+    """Respuesta NDJSON que serializa `filas` (un iterable) por bloques"""
+    filas = iter(filas)
+    
+    def generar():
+        while True:
+            bloque = proyectar(list(islice(filas, FILAS_POR_BLOQUE)), campos)
+            if not bloque:
+                return
+            yield ''.join(app.json.dumps(fila) + '\n' for fila in bloque)
+    return Response(generar(), mimetype=MIMETYPE_NDJSON)
+
+# ============================================================
+# EVENTOS EN VIVO (SSE)
+# ============================================================
+# Los portales se suscriben a los cambios de estado en lugar de consultar
+# periódicamente. Cada conexión recibe `event: estado` por cambio; si su
+# cola se llenó (consumidor lento) recibe `event: desfase` y debe volver
+# a consultar el estado completo. Sin eventos se envía un comentario de
+# latido para mantener la conexión y detectar clientes desconectados.
+
+LATIDO_SSE = 15  # segundos
+
+def evento_sse(tipo, datos, evento_id=None):
+    linea_id = f'id: {evento_id}\n' if evento_id is not None else ''
+    return f'{linea_id}event: {tipo}\ndata: {app.json.dumps(datos)}\n\n'
+
+def respuesta_sse(suscripcion, inicial=None):
+    """Respuesta text/event-stream que entrega los eventos de la suscripción"""
+    def generar():
+        yield 'retry: 3000\n\n'
+        if inicial is not None:
+            yield evento_sse('estado', inicial)
+        while suscripcion.activa:
+            eventos, perdidos = bus_eventos.esperar(suscripcion, LATIDO_SSE)
+            if perdidos:
+                yield evento_sse('desfase', {'perdidos': perdidos})
+            if eventos:
+                yield ''.join(evento_sse('estado', evento, evento_id) for evento_id, evento in eventos)
+            else:
+                yield ': latido\n\n'
+    
+    respuesta = Response(generar(), mimetype='text/event-stream')
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    respuesta.headers['X-Accel-Buffering'] = 'no'  # sin buffer en proxies (nginx)
+    # Al cerrarse la conexión (incluso sin llegar a iterar) se libera la suscripción
+    respuesta.call_on_close(lambda: bus_eventos.cancelar(suscripcion))
+    return respuesta
+
 # ============================================================
 # MIDDLEWARE
 # ============================================================
 
 @app.after_request
 def after_request(response):
-    """Agrega headers de seguridad y CORS"""
+    """Agrega headers de seguridad y CORS, y comprime si corresponde"""
     response.headers['X-Content-Type-Options'] = 'nosniff'
     response.headers['X-Frame-Options'] = 'DENY'
+    comprimir_respuesta(response)
     return response
 
+def comprimir_respuesta(response):
+    """
+    Comprime el cuerpo JSON/texto según Accept-Encoding. Se omiten las
+    respuestas en streaming, las ya comprimidas (cache) y las de error.
+    """
+    if (
+        response.status_code != 200 or
+        response.is_streamed or
+        response.direct_passthrough or
+        'Content-Encoding' in response.headers or
+        not (response.mimetype == 'application/json' or response.mimetype.startswith('text/'))
+    ):
+        return
+    
+    cuerpo = response.get_data()
+    response.vary.add('Accept-Encoding')
+    codificacion = compresor.elegir(request.accept_encodings, len(cuerpo))
+    if codificacion is None:
+        return
+    response.set_data(compresor.comprimir(cuerpo, codificacion))
+    response.headers['Content-Encoding'] = codificacion
+
 # ============================================================
 # ENDPOINTS - SISTEMA
 # ============================================================
@@ -74,8 +349,8 @@ def estadisticas():
 @app.route('/api/clientes', methods=['GET'])
 def clientes():
     """Lista de todos los clientes"""
-    return jsonify({
-        'clientes': data_service.obtener_clientes()
+    return respuesta_cacheada('clientes', ('clientes',), lambda: {
+        'clientes': [c.a_dict() for c in data_service.obtener_clientes()]
     })
 
 @app.route('/api/cliente/<int:cliente_id>', methods=['GET'])
@@ -84,7 +359,7 @@ def cliente(cliente_id):
     cliente = data_service.obtener_cliente(cliente_id)
     if not cliente:
         return jsonify({'error': 'Cliente no encontrado'}), 404
-    return jsonify(cliente)
+    return jsonify(cliente.a_dict())
 
 @app.route('/api/cliente/<int:cliente_id>/contratos', methods=['GET'])
 def cliente_contratos(cliente_id):
@@ -102,8 +377,8 @@ def cliente_contratos(cliente_id):
 @app.route('/api/productos', methods=['GET'])
 def productos():
     """Lista de todos los productos"""
-    return jsonify({
-        'productos': data_service.obtener_productos()
+    return respuesta_cacheada('productos', ('productos',), lambda: {
+        'productos': [p.a_dict() for p in data_service.obtener_productos()]
     })
 
 @app.route('/api/producto/<int:producto_id>', methods=['GET'])
@@ -112,7 +387,7 @@ def producto(producto_id):
     producto = data_service.obtener_producto(producto_id)
     if not producto:
         return jsonify({'error': 'Producto no encontrado'}), 404
-    return jsonify(producto)
+    return jsonify(producto.a_dict())
 
 # ============================================================
 # ENDPOINTS - INVENTARIO
@@ -121,7 +396,7 @@ def producto(producto_id):
 @app.route('/api/inventario', methods=['GET'])
 def inventario():
     """Estado completo del inventario"""
-    return jsonify(inventario_service.obtener_estado_inventario())
+    return respuesta_cacheada('inventario', ('productos',), inventario_service.obtener_estado_inventario)
 
 @app.route('/api/inventario/alertas', methods=['GET'])
 def inventario_alertas():
@@ -136,21 +411,77 @@ def inventario_alertas():
 
 @app.route('/api/contratos', methods=['GET'])
 def contratos():
-    """Todos los contratos con información detallada"""
-    return jsonify({
-        'contratos': motor_reglas.obtener_todos_contratos()
-    })
+    """
+    Contratos con información detallada, de más a menos inactivas.
+    Query opcional: cliente_id, producto_id, limit, cursor, fields
+    """
+    try:
+        listado = leer_listado({'cliente_id': int, 'producto_id': int}, _cursor_contrato, con_fechas=False)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if listado is None:
+        # Depende también del stock (máximo pedido) y de los nombres
+        return respuesta_cacheada('contratos', ('contratos', 'productos', 'clientes'), lambda: {
+            'contratos': motor_reglas.obtener_todos_contratos()
+        }, con_reglas=True)
+    
+    filtros = listado['filtros']
+    if any(len(valores) > 1 for valores in filtros.values()):
+        return jsonify({'error': 'cliente_id y producto_id aceptan un solo valor'}), 400
+    
+    contratos, siguiente = motor_reglas.listar_contratos(
+        cliente_id=filtros.get('cliente_id', (None,))[0],
+        producto_id=filtros.get('producto_id', (None,))[0],
+        despues_de=listado['cursor'],
+        limite=listado['limite']
+    )
+    return respuesta_listado('contratos', contratos, siguiente, listado)
+
+def _cursor_contrato(cursor):
+    """El cursor de contratos es [porcentaje_inactivas, id del contrato]"""
+    return (
+        isinstance(cursor, list) and len(cursor) == 2 and
+        isinstance(cursor[0], (int, float)) and _cursor_entero(cursor[1])
+    )
 
 @app.route('/api/contratos/acaparamiento', methods=['GET'])
 def contratos_acaparamiento():
-    """Detecta contratos con alto porcentaje de inactivas"""
+    """
+    Detecta contratos con alto porcentaje de inactivas
+    Query: umbral, limit (los N con más inactivas), offset (paginación)
+    """
     umbral = request.args.get('umbral', 50, type=int)
-    return jsonify(motor_reglas.detectar_acaparamiento(umbral))
+    limite = request.args.get('limit', type=int)
+    desplazamiento = request.args.get('offset', 0, type=int)
+    
+    if (limite is not None and limite < 0) or desplazamiento < 0:
+        return jsonify({'error': 'limit y offset no pueden ser negativos'}), 400
+    
+    return jsonify(motor_reglas.detectar_acaparamiento(umbral, desplazamiento, limite))
 
 # ============================================================
 # ENDPOINTS - PEDIDOS
 # ============================================================
 
+# Error de un pedido del lote con campos faltantes o que no son enteros positivos
+ERROR_CAMPOS_LOTE = 'cliente_id, producto_id y cantidad deben ser enteros positivos'
+
+def _campos_pedido(pedido):
+    """
+    (cliente_id, producto_id, cantidad) de un pedido del lote, o None si
+    falta alguno o no es un entero positivo
+    """
+    campos = (
+        pedido.get('cliente_id'),
+        pedido.get('producto_id'),
+        pedido.get('cantidad')
+    ) if isinstance(pedido, dict) else ()
+    
+    if not campos or not all(type(valor) is int and valor > 0 for valor in campos):
+        return None
+    return campos
+
 @app.route('/api/pedido/validar', methods=['POST'])
 def validar_pedido():
     """
@@ -169,9 +500,76 @@ def validar_pedido():
     if not all([cliente_id, producto_id, cantidad]):
         return jsonify({'error': 'Faltan campos: cliente_id, producto_id, cantidad'}), 400
     
+    # Un id que no es entero no puede existir (y una lista ni siquiera se puede buscar)
+    if not all(type(valor) is int for valor in (cliente_id, producto_id, cantidad)):
+        return jsonify({'error': 'cliente_id, producto_id y cantidad deben ser enteros'}), 400
+    
     resultado = motor_reglas.validar_pedido(cliente_id, producto_id, cantidad)
     return jsonify(resultado)
 
+@app.route('/api/pedidos/validar-lote', methods=['POST'])
+def validar_lote():
+    """
+    Valida muchos pedidos en una sola solicitud
+    Body: { pedidos: [ { cliente_id, producto_id, cantidad }, ... ] }
+    Los resultados vuelven en el mismo orden que los pedidos.
+    """
+    data = request.get_json()
+    
+    if not data or not isinstance(data.get('pedidos'), list):
+        return jsonify({'error': 'Se requiere una lista de pedidos'}), 400
+    
+    pedidos = data['pedidos']
+    if len(pedidos) > MAX_PEDIDOS_LOTE:
+        return jsonify({'error': f'Máximo {MAX_PEDIDOS_LOTE} pedidos por lote'}), 400
+    
+    validos = []
+    posiciones = []
+    resultados = [None] * len(pedidos)
+    for i, pedido in enumerate(pedidos):
+        # Un pedido mal formado recibe su error sin afectar a los demás
+        campos = _campos_pedido(pedido)
+        if campos is None:
+            resultados[i] = {'error': ERROR_CAMPOS_LOTE}
+            continue
+        validos.append(campos)
+        posiciones.append(i)
+    
+    for i, resultado in zip(posiciones, motor_reglas.validar_lote(validos)):
+        resultados[i] = resultado
+    
+    return jsonify({
+        'total': len(resultados),
+        'resultados': resultados
+    })
+
+@app.route('/api/pedido/validar/cache', methods=['GET'])
+def metricas_cache_validaciones():
+    """Aciertos y fallos de la cache de validaciones"""
+    return jsonify(motor_reglas.obtener_metricas_cache())
+
+@app.route('/api/compresion/metricas', methods=['GET'])
+def metricas_compresion():
+    """Respuestas comprimidas, bytes ahorrados y tiempo por codificación"""
+    return jsonify(compresor.obtener_metricas())
+
+@app.route('/api/eventos/metricas', methods=['GET'])
+def metricas_eventos():
+    """Suscriptores conectados y eventos publicados, entregados y perdidos"""
+    return jsonify(bus_eventos.obtener_metricas())
+
+@app.route('/api/reglas/metricas', methods=['GET'])
+def metricas_reglas():
+    """Evaluaciones y tiempos de las reglas configurables (data/reglas.json)"""
+    return jsonify(motor_reglas.obtener_metricas_reglas())
+
+@app.route('/api/journal/metricas', methods=['GET'])
+def metricas_journal():
+    """Registros, fsyncs, mayor lote, compactaciones y errores de la bitácora"""
+    if not isinstance(almacen, JournalPedidos):
+        return jsonify({'error': 'La bitácora no está activa (SMARTSTOCK_JOURNAL)'}), 404
+    return jsonify(almacen.obtener_metricas())
+
 @app.route('/api/pedido/confirmar', methods=['POST'])
 def confirmar_pedido():
     """
@@ -190,22 +588,97 @@ def confirmar_pedido():
     if not all([cliente_id, producto_id, cantidad]):
         return jsonify({'error': 'Faltan campos: cliente_id, producto_id, cantidad'}), 400
     
+    # Un id que no es entero no puede existir (y una lista ni siquiera se puede buscar)
+    if not all(type(valor) is int for valor in (cliente_id, producto_id, cantidad)):
+        return jsonify({'error': 'cliente_id, producto_id y cantidad deben ser enteros'}), 400
+    
     resultado = pedidos_service.confirmar_pedido(cliente_id, producto_id, cantidad)
     return jsonify(resultado)
 
-@app.route('/api/pedidos/historial', methods=['GET'])
-def pedidos_historial():
-    """Historial completo de pedidos"""
+@app.route('/api/pedidos/confirmar-lote', methods=['POST'])
+def confirmar_lote():
+    """
+    Confirma muchos pedidos en un solo paso atómico
+    Body: { pedidos: [ { cliente_id, producto_id, cantidad }, ... ] }
+    Si el lote pide más stock del que hay, se reparte en proporción a las
+    tarjetas en uso. Los resultados vuelven en el mismo orden que los pedidos.
+    """
+    data = request.get_json()
+    
+    if not data or not isinstance(data.get('pedidos'), list):
+        return jsonify({'error': 'Se requiere una lista de pedidos'}), 400
+    
+    pedidos = data['pedidos']
+    if len(pedidos) > MAX_PEDIDOS_LOTE:
+        return jsonify({'error': f'Máximo {MAX_PEDIDOS_LOTE} pedidos por lote'}), 400
+    
+    validos = []
+    posiciones = []
+    resultados = [None] * len(pedidos)
+    for i, pedido in enumerate(pedidos):
+        # Enteros positivos: las claves se ordenan para tomar los locks del lote
+        campos = _campos_pedido(pedido)
+        if campos is None:
+            resultados[i] = {'error': ERROR_CAMPOS_LOTE}
+            continue
+        validos.append(campos)
+        posiciones.append(i)
+    
+    for i, resultado in zip(posiciones, pedidos_service.confirmar_lote(validos)):
+        resultados[i] = resultado
+    
     return jsonify({
-        'pedidos': pedidos_service.obtener_historial()
+        'total': len(resultados),
+        'confirmados': sum(1 for r in resultados if r.get('success')),
+        'resultados': resultados
     })
 
+@app.route('/api/pedidos/historial', methods=['GET'])
+def pedidos_historial():
+    """
+    Historial de pedidos, del más reciente al más antiguo.
+    Query opcional: cliente_id, producto_id, estado_envio, desde, hasta, limit, cursor, fields
+    """
+    return listado_pedidos(vista=None)
+
 @app.route('/api/pedidos/en-proceso', methods=['GET'])
 def pedidos_en_proceso():
-    """Pedidos pendientes de entrega"""
-    return jsonify({
-        'pedidos': pedidos_service.obtener_pedidos_en_proceso()
-    })
+    """Pedidos pendientes de entrega (misma query opcional que el historial)"""
+    return listado_pedidos(vista='en_proceso')
+
+@app.route('/api/pedidos/entregados', methods=['GET'])
+def pedidos_entregados():
+    """Pedidos entregados (misma query opcional que el historial)"""
+    return listado_pedidos(vista='entregados')
+
+# Vista -> listado completo (sin parámetros)
+LISTADOS_PEDIDOS = {
+    None: pedidos_service.obtener_historial,
+    'en_proceso': pedidos_service.obtener_pedidos_en_proceso,
+    'entregados': pedidos_service.obtener_pedidos_entregados
+}
+
+def listado_pedidos(vista):
+    try:
+        listado = leer_listado(FILTROS_PEDIDOS, _cursor_entero)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if quiere_ndjson():
+        listado = listado or LISTADO_COMPLETO
+        pedidos = pedidos_service.iterar(
+            listado['filtros'], listado['desde'], listado['hasta'], vista=vista
+        )
+        return respuesta_ndjson(pedidos, listado['campos'])
+    
+    if listado is None:
+        return jsonify({'pedidos': LISTADOS_PEDIDOS[vista]()})
+    
+    pedidos, siguiente = pedidos_service.listar(
+        listado['filtros'], listado['desde'], listado['hasta'],
+        listado['cursor'], listado['limite'], vista=vista
+    )
+    return respuesta_listado('pedidos', pedidos, siguiente, listado)
 
 # ============================================================
 # ENDPOINTS - TRACKING
@@ -239,6 +712,71 @@ def actualizar_estado_pedido(pedido_id):
     
     return jsonify(resultado)
 
+@app.route('/api/pedidos/actualizar-estado-lote', methods=['POST'])
+def actualizar_estado_lote():
+    """
+    Actualiza el estado de envío de muchos pedidos en una sola llamada
+    Body: { cambios: [ { pedido_id, estado }, ... ], comentario?, ubicacion? }
+    Todo el lote comparte la misma fecha. Cada cambio se valida por separado
+    (solo hacia adelante); los resultados vuelven en el mismo orden.
+    """
+    data = request.get_json()
+    
+    if not data or not isinstance(data.get('cambios'), list):
+        return jsonify({'error': 'Se requiere una lista de cambios'}), 400
+    
+    cambios = data['cambios']
+    if len(cambios) > MAX_PEDIDOS_LOTE:
+        return jsonify({'error': f'Máximo {MAX_PEDIDOS_LOTE} cambios por lote'}), 400
+    
+    validos = []
+    posiciones = []
+    resultados = [None] * len(cambios)
+    for i, cambio in enumerate(cambios):
+        pedido_id = cambio.get('pedido_id') if isinstance(cambio, dict) else None
+        estado = cambio.get('estado') if isinstance(cambio, dict) else None
+        
+        if type(pedido_id) is not int or not isinstance(estado, str):
+            resultados[i] = {
+                'pedido_id': pedido_id,
+                'success': False,
+                'error': 'pedido_id debe ser entero y estado un texto'
+            }
+            continue
+        validos.append((pedido_id, estado))
+        posiciones.append(i)
+    
+    aplicados = tracking_service.actualizar_lote(validos, data.get('comentario'), data.get('ubicacion'))
+    for i, resultado in zip(posiciones, aplicados):
+        resultados[i] = resultado
+    
+    return jsonify({
+        'total': len(resultados),
+        'actualizados': sum(1 for r in resultados if r['success']),
+        'resultados': resultados
+    })
+
+@app.route('/api/pedido/tracking/<tracking>/eventos', methods=['GET'])
+def eventos_tracking(tracking):
+    """Cambios de estado de un pedido en vivo (SSE), empezando por el actual"""
+    pedido = pedidos_service.obtener_pedido_por_tracking(tracking)
+    if not pedido:
+        return jsonify({'error': 'Pedido no encontrado'}), 404
+    
+    # Primero la suscripción y luego la foto: un cambio en medio llega igual
+    suscripcion = bus_eventos.suscribir(pedido['tracking'])
+    if suscripcion is None:
+        return jsonify({'error': 'Demasiadas suscripciones activas'}), 503
+    return respuesta_sse(suscripcion, tracking_service.estado_actual(pedido))
+
+@app.route('/api/pedidos/eventos', methods=['GET'])
+def eventos_pedidos():
+    """Todos los cambios de estado en vivo (SSE), para el portal admin"""
+    suscripcion = bus_eventos.suscribir()
+    if suscripcion is None:
+        return jsonify({'error': 'Demasiadas suscripciones activas'}), 503
+    return respuesta_sse(suscripcion)
+
 @app.route('/api/estados-envio', methods=['GET'])
 def estados_envio():
     """Lista de estados de envío posibles"""
@@ -251,7 +789,11 @@ def estados_envio():
 @app.route('/api/analytics/dashboard', methods=['GET'])
 def analytics_dashboard():
     """Dashboard completo con todas las métricas"""
-    return jsonify(analytics_service.obtener_dashboard_completo())
+    # Sale de los contratos (con stock y nombres) y del historial simulado, que no cambia
+    return respuesta_cacheada(
+        'dashboard', ('contratos', 'productos', 'clientes'), analytics_service.obtener_dashboard_completo,
+        con_reglas=True
+    )
 
 @app.route('/api/analytics/riesgo-cobertura', methods=['GET'])
 def analytics_riesgo():
@@ -275,10 +817,34 @@ def analytics_temporadas():
 
 @app.route('/api/analytics/historial', methods=['GET'])
 def analytics_historial():
-    """Historial completo de pedidos (12 meses)"""
-    return jsonify({
-        'pedidos': analytics_service.obtener_historial_completo()
-    })
+    """
+    Historial de pedidos (12 meses), en orden de fecha.
+    Query opcional: cliente_id, producto_id, estado_envio, desde, hasta, limit, cursor, fields
+    """
+    try:
+        listado = leer_listado(FILTROS_PEDIDOS, _cursor_entero)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if listado is None and not quiere_ndjson():
+        return jsonify({
+            'pedidos': analytics_service.obtener_historial_completo()
+        })
+    listado = listado or LISTADO_COMPLETO
+    
+    # En el historial simulado el estado de envío se llama 'estado'
+    filtros = dict(listado['filtros'])
+    if 'estado_envio' in filtros:
+        filtros['estado'] = filtros.pop('estado_envio')
+    
+    if quiere_ndjson():
+        pedidos = analytics_service.iterar_historial(filtros, listado['desde'], listado['hasta'])
+        return respuesta_ndjson(pedidos, listado['campos'])
+    
+    pedidos, siguiente = analytics_service.listar_historial(
+        filtros, listado['desde'], listado['hasta'], listado['cursor'], listado['limite']
+    )
+    return respuesta_listado('pedidos', pedidos, siguiente, listado)
 
 # ============================================================
 # MANEJO DE ERRORES
@@ -309,21 +875,33 @@ if __name__ == '__main__':
     print("   - GET  /api/cliente/<id>/contratos")
     print("   - GET  /api/productos")
     print("   - GET  /api/inventario")
-    print("   - GET  /api/contratos")
-    print("   - GET  /api/contratos/acaparamiento")
+    print("   - GET  /api/contratos?cliente_id=&producto_id=&limit=&cursor=&fields=")
+    print("   - GET  /api/contratos/acaparamiento?umbral=50&limit=&offset=")
     print("   - POST /api/pedido/validar")
+    print("   - GET  /api/pedido/validar/cache")
+    print("   - POST /api/pedidos/validar-lote")
+    print("   - GET  /api/reglas/metricas")
+    print("   - GET  /api/compresion/metricas")
+    print("   - GET  /api/eventos/metricas")
+    print("   - GET  /api/journal/metricas")
     print("   - POST /api/pedido/confirmar")
-    print("   - GET  /api/pedidos/historial")
-    print("   - GET  /api/pedidos/en-proceso")
+    print("   - POST /api/pedidos/confirmar-lote")
+    print("   - GET  /api/pedidos/historial?cliente_id=&producto_id=&estado_envio=&desde=&hasta=&limit=&cursor=&fields=")
+    print("   - GET  /api/pedidos/en-proceso (mismos filtros)")
+    print("   - GET  /api/pedidos/entregados (mismos filtros)")
+    print("     (historiales: &formato=ndjson para exportar en streaming)")
     print("   - GET  /api/pedido/tracking/<tracking>")
     print("   - POST /api/pedido/<id>/actualizar-estado")
+    print("   - POST /api/pedidos/actualizar-estado-lote")
+    print("   - GET  /api/pedido/tracking/<tracking>/eventos (SSE)")
+    print("   - GET  /api/pedidos/eventos (SSE, todos los cambios)")
     print("\n📊 Analytics:")
     print("   - GET  /api/analytics/dashboard")
     print("   - GET  /api/analytics/riesgo-cobertura")
     print("   - GET  /api/analytics/tendencia-demanda")
     print("   - GET  /api/analytics/stock-rop")
     print("   - GET  /api/analytics/temporadas")
-    print("   - GET  /api/analytics/historial")
+    print("   - GET  /api/analytics/historial (mismos filtros)")
     print("=" * 60 + "\n")
     
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,526 @@
+"""
+AlmacenSQLite - Estado compartido en SQLite
+===========================================
+Guarda en un archivo SQLite (modo WAL) todo lo que cambia:
+- tarjetas actuales de cada contrato y stock de cada producto
+- pedidos confirmados y su historial de envío
+
+Los CSV siguen siendo el catálogo base; la base de datos es la fuente de
+verdad del estado que cambia y la comparten todos los procesos (workers):
+
+- Un pedido se confirma dentro de una transacción BEGIN IMMEDIATE (una a
+  la vez entre procesos): se leen de la base el contrato y el stock
+  (sincronizar), se valida con esos valores y el stock se descuenta con
+  un UPDATE condicionado (stock_current >= cantidad). Si la condición no
+  se cumple la transacción se deshace y no cambia nada.
+- Cada transacción de escritura avanza un reloj (tabla reloj) y marca con
+  ese número las filas que escribe. Cada proceso recuerda el último
+  número que vio y trae solo lo escrito después (refrescar): pedidos
+  nuevos, cambios de estado y valores de contratos y stock.
+- Los cambios de la recarga de CSV llegan como observador de DataService
+  y reemplazan el valor (igual que en memoria). Se guardan junto al valor
+  del CSV (base): si varios procesos recargan el mismo cambio, solo el
+  primero lo aplica.
+"""
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+TABLAS = """
+CREATE TABLE IF NOT EXISTS contratos (
+    client_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    card_current_amount INTEGER NOT NULL,
+    base INTEGER,
+    cambio INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (client_id, product_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS productos (
+    id INTEGER PRIMARY KEY,
+    stock_current INTEGER NOT NULL,
+    base INTEGER,
+    cambio INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS pedidos (
+    id INTEGER PRIMARY KEY,
+    tracking TEXT NOT NULL,
+    fecha TEXT NOT NULL,
+    cliente_id INTEGER NOT NULL,
+    cliente_nombre TEXT,
+    producto_id INTEGER NOT NULL,
+    producto_nombre TEXT,
+    cantidad_solicitada INTEGER NOT NULL,
+    cantidad_aprobada INTEGER NOT NULL,
+    estado TEXT,
+    mensaje TEXT,
+    estado_envio TEXT NOT NULL,
+    ubicacion_actual TEXT,
+    cambio INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS historial_envio (
+    pedido_id INTEGER NOT NULL,
+    orden INTEGER NOT NULL,
+    estado TEXT NOT NULL,
+    fecha TEXT NOT NULL,
+    comentario TEXT,
+    PRIMARY KEY (pedido_id, orden)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS reloj (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    valor INTEGER NOT NULL
+);
+
+INSERT OR IGNORE INTO reloj (id, valor) VALUES (1, 0)
+"""
+
+# Columnas que no existían en las bases creadas antes del estado compartido
+COLUMNAS_NUEVAS = (
+    ('contratos', 'base', 'INTEGER'),
+    ('contratos', 'cambio', 'INTEGER NOT NULL DEFAULT 0'),
+    ('productos', 'base', 'INTEGER'),
+    ('productos', 'cambio', 'INTEGER NOT NULL DEFAULT 0'),
+    ('pedidos', 'cambio', 'INTEGER NOT NULL DEFAULT 0')
+)
+
+INDICES = """
+CREATE UNIQUE INDEX IF NOT EXISTS idx_pedidos_tracking ON pedidos (tracking);
+CREATE INDEX IF NOT EXISTS idx_pedidos_cliente_producto ON pedidos (cliente_id, producto_id);
+CREATE INDEX IF NOT EXISTS idx_pedidos_cambio ON pedidos (cambio);
+CREATE INDEX IF NOT EXISTS idx_contratos_cambio ON contratos (cambio);
+CREATE INDEX IF NOT EXISTS idx_productos_cambio ON productos (cambio)
+"""
+
+# Sentencias fijas: el módulo sqlite3 las prepara una vez y las reutiliza
+SQL_RELOJ_LEER = 'SELECT valor FROM reloj WHERE id = 1'
+SQL_RELOJ_AVANZAR = 'UPDATE reloj SET valor = valor + 1 WHERE id = 1'
+# Cambia cuando otra conexión (de este u otro proceso) hace COMMIT
+SQL_VERSION_DATOS = 'PRAGMA data_version'
+SQL_CONTRATO_LEER = 'SELECT card_current_amount, cambio FROM contratos WHERE client_id = ? AND product_id = ?'
+SQL_CONTRATO_SUMAR = 'UPDATE contratos SET card_current_amount = card_current_amount + ?, cambio = ? WHERE client_id = ? AND product_id = ?'
+SQL_CONTRATO_INSERTAR = 'INSERT OR IGNORE INTO contratos (client_id, product_id, card_current_amount, base, cambio) VALUES (?, ?, ?, ?, ?)'
+SQL_CONTRATO_RECARGAR = 'UPDATE contratos SET card_current_amount = ?, base = ?, cambio = ? WHERE client_id = ? AND product_id = ? AND base IS NOT ?'
+SQL_CONTRATO_ELIMINAR = 'DELETE FROM contratos WHERE client_id = ? AND product_id = ?'
+SQL_CONTRATOS_DESDE = 'SELECT client_id, product_id, card_current_amount, cambio FROM contratos WHERE cambio > ?'
+SQL_PRODUCTO_LEER = 'SELECT stock_current, cambio FROM productos WHERE id = ?'
+SQL_PRODUCTO_DESCONTAR = 'UPDATE productos SET stock_current = stock_current - ?, cambio = ? WHERE id = ? AND stock_current >= ?'
+SQL_PRODUCTO_INSERTAR = 'INSERT OR IGNORE INTO productos (id, stock_current, base, cambio) VALUES (?, ?, ?, ?)'
+SQL_PRODUCTO_RECARGAR = 'UPDATE productos SET stock_current = ?, base = ?, cambio = ? WHERE id = ? AND base IS NOT ?'
+SQL_PRODUCTO_ELIMINAR = 'DELETE FROM productos WHERE id = ?'
+SQL_PRODUCTOS_DESDE = 'SELECT id, stock_current, cambio FROM productos WHERE cambio > ?'
+SQL_PEDIDO_INSERTAR = """
+INSERT INTO pedidos (
+    id, tracking, fecha, cliente_id, cliente_nombre, producto_id, producto_nombre,
+    cantidad_solicitada, cantidad_aprobada, estado, mensaje, estado_envio, ubicacion_actual, cambio
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+SQL_PEDIDO_ESTADO = 'UPDATE pedidos SET estado_envio = ?, ubicacion_actual = ?, cambio = ? WHERE id = ?'
+SQL_HISTORIAL_INSERTAR = 'INSERT OR REPLACE INTO historial_envio (pedido_id, orden, estado, fecha, comentario) VALUES (?, ?, ?, ?, ?)'
+
+
+class StockInsuficiente(Exception):
+    """El UPDATE condicionado no encontró stock suficiente en la base"""
+
+
+class AlmacenSQLite:
+    """Estado compartido entre procesos: contratos, stock, pedidos y tracking"""
+    
+    # Otros procesos escriben en la misma base: PedidosService sincroniza
+    # antes de validar y refresca lo ajeno
+    compartido = True
+    
+    def __init__(self, ruta):
+        self.ruta = ruta
+        # sqlite3 no comparte conexiones entre hilos: una por hilo
+        self._local = threading.local()
+        
+        # Último número del reloj que este proceso trajo a memoria, y el
+        # número de cambio del valor en memoria de cada contrato/producto
+        self._marca = 0
+        self._vistos = {}
+        # Registros cuya recarga de CSV ya había aplicado otro proceso: se
+        # vuelven a leer de la base en el próximo refresco
+        self._releer = set()
+        
+        with self.transaccion() as tx:
+            self._crear_esquema(tx)
+        print(f"🗄️  Almacén SQLite: {ruta}")
+    
+    def _crear_esquema(self, tx):
+        for sentencia in TABLAS.split(';'):
+            tx.execute(sentencia)
+        for tabla, columna, tipo in COLUMNAS_NUEVAS:
+            existentes = {fila[1] for fila in tx.execute(f'PRAGMA table_info({tabla})')}
+            if columna not in existentes:
+                tx.execute(f'ALTER TABLE {tabla} ADD COLUMN {columna} {tipo}')
+        for sentencia in INDICES.split(';'):
+            tx.execute(sentencia)
+    
+    def _conexion(self):
+        conexion = getattr(self._local, 'conexion', None)
+        if conexion is None:
+            # isolation_level=None: las transacciones se abren explícitamente
+            conexion = sqlite3.connect(self.ruta, timeout=30, isolation_level=None, check_same_thread=False)
+            conexion.execute('PRAGMA journal_mode=WAL')
+            conexion.execute('PRAGMA synchronous=NORMAL')
+            self._local.conexion = conexion
+            self._local.profundidad = 0
+            self._local.marca = None
+            self._local.reflejando = False
+            # data_version de la última vez que este hilo vio la memoria al día
+            self._local.version = None
+        return conexion
+    
+    @contextmanager
+    def transaccion(self):
+        """
+        Agrupa todas las escrituras del bloque en una sola transacción.
+        Se puede anidar: solo la más externa hace COMMIT.
+        """
+        conexion = self._conexion()
+        if self._local.profundidad == 0:
+            conexion.execute('BEGIN IMMEDIATE')
+        self._local.profundidad += 1
+        try:
+            yield conexion
+        except BaseException:
+            self._local.profundidad -= 1
+            if self._local.profundidad == 0:
+                self._local.marca = None
+                conexion.execute('ROLLBACK')
+            raise
+        else:
+            self._local.profundidad -= 1
+            if self._local.profundidad == 0:
+                self._local.marca = None
+                conexion.execute('COMMIT')
+    
+    @contextmanager
+    def _lectura(self):
+        """Lecturas con una misma vista de la base (no bloquea a los escritores)"""
+        conexion = self._conexion()
+        if self._local.profundidad:
+            yield conexion  # ya dentro de una transacción
+            return
+        conexion.execute('BEGIN')
+        try:
+            yield conexion
+        finally:
+            conexion.execute('COMMIT')
+    
+    def _marca_transaccion(self, tx):
+        """Número de cambio de la transacción abierta (avanza el reloj una vez)"""
+        if self._local.marca is None:
+            tx.execute(SQL_RELOJ_AVANZAR)
+            self._local.marca = tx.execute(SQL_RELOJ_LEER).fetchone()[0]
+        return self._local.marca
+    
+    def cerrar(self):
+        """Cierra la conexión del hilo actual"""
+        conexion = getattr(self._local, 'conexion', None)
+        if conexion is not None:
+            conexion.close()
+            self._local.conexion = None
+    
+    # ============================================================
+    # RESTAURACIÓN AL ARRANCAR
+    # ============================================================
+    
+    def restaurar(self, data_service):
+        """
+        Aplica sobre DataService el estado guardado y devuelve los pedidos.
+        - Contratos/productos guardados: se restauran tarjetas actuales y stock
+        - Contratos/productos nuevos en el CSV: se agregan a la base
+        Después queda registrado como observador de las recargas de CSV.
+        """
+        with self.transaccion() as tx:
+            guardados = {
+                (cid, pid): (actuales, cambio)
+                for cid, pid, actuales, cambio in tx.execute('SELECT client_id, product_id, card_current_amount, cambio FROM contratos')
+            }
+            stock_guardado = {
+                pid: (stock, cambio)
+                for pid, stock, cambio in tx.execute('SELECT id, stock_current, cambio FROM productos')
+            }
+            
+            nuevos_contratos = []
+            bases_contratos = {}
+            for contrato in data_service.contratos:
+                clave = contrato.clave()
+                if data_service.obtener_contrato(*clave) is not contrato:
+                    continue  # fila duplicada en el CSV
+                bases_contratos[clave] = contrato.card_current_amount
+                if clave in guardados:
+                    actuales, cambio = guardados[clave]
+                    self._vistos[('contratos', clave)] = cambio
+                    if actuales != contrato.card_current_amount:
+                        data_service.restaurar_valores('contratos', clave, card_current_amount=actuales)
+                else:
+                    nuevos_contratos.append(contrato.clave() + (contrato.card_current_amount,) * 2)
+            
+            nuevos_productos = []
+            bases_productos = {}
+            for producto in data_service.productos:
+                pid = producto.id
+                if data_service.obtener_producto(pid) is not producto:
+                    continue
+                bases_productos[pid] = producto.stock_current
+                if pid in stock_guardado:
+                    stock, cambio = stock_guardado[pid]
+                    self._vistos[('productos', pid)] = cambio
+                    if stock != producto.stock_current:
+                        data_service.restaurar_valores('productos', pid, stock_current=stock)
+                else:
+                    nuevos_productos.append((pid, producto.stock_current, producto.stock_current))
+            
+            if nuevos_contratos or nuevos_productos:
+                marca = self._marca_transaccion(tx)
+                tx.executemany(SQL_CONTRATO_INSERTAR, [fila + (marca,) for fila in nuevos_contratos])
+                tx.executemany(SQL_PRODUCTO_INSERTAR, [fila + (marca,) for fila in nuevos_productos])
+            
+            # Bases creadas antes de guardar el valor del CSV: se completa con el de ahora
+            if tx.execute('SELECT 1 FROM contratos WHERE base IS NULL LIMIT 1').fetchone():
+                tx.executemany(
+                    'UPDATE contratos SET base = ? WHERE client_id = ? AND product_id = ? AND base IS NULL',
+                    [(base,) + clave for clave, base in bases_contratos.items()]
+                )
+            if tx.execute('SELECT 1 FROM productos WHERE base IS NULL LIMIT 1').fetchone():
+                tx.executemany(
+                    'UPDATE productos SET base = ? WHERE id = ? AND base IS NULL',
+                    [(base, pid) for pid, base in bases_productos.items()]
+                )
+            
+            pedidos = self._leer_pedidos(tx)
+            self._marca = tx.execute(SQL_RELOJ_LEER).fetchone()[0]
+        
+        data_service.registrar_observador(self._registro_cambiado)
+        
+        print(f"   ✓ Estado restaurado: {len(guardados)} contratos, {len(pedidos)} pedidos")
+        return pedidos
+    
+    def cargar_pedidos(self):
+        """Lee todos los pedidos con su historial, ordenados por id"""
+        with self._lectura() as conexion:
+            return self._leer_pedidos(conexion)
+    
+    def _leer_pedidos(self, conexion, desde=None):
+        """Pedidos (todos, o los marcados después de `desde`) con su historial"""
+        condicion = '' if desde is None else 'WHERE cambio > ?'
+        parametros = () if desde is None else (desde,)
+        
+        historiales = {}
+        for pedido_id, estado, fecha, comentario in conexion.execute(
+                'SELECT pedido_id, estado, fecha, comentario FROM historial_envio '
+                f'WHERE pedido_id IN (SELECT id FROM pedidos {condicion}) ORDER BY pedido_id, orden', parametros):
+            historiales.setdefault(pedido_id, []).append({
+                'estado': estado,
+                'fecha': fecha,
+                'comentario': comentario
+            })
+        
+        conexion.row_factory = sqlite3.Row
+        try:
+            filas = conexion.execute(f'SELECT * FROM pedidos {condicion} ORDER BY id', parametros).fetchall()
+        finally:
+            conexion.row_factory = None
+        
+        pedidos = []
+        for fila in filas:
+            pedido = dict(fila)
+            del pedido['cambio']
+            pedido['historial_envio'] = historiales.get(pedido['id'], [])
+            pedidos.append(pedido)
+        return pedidos
+    
+    # ============================================================
+    # SINCRONIZACIÓN ENTRE PROCESOS
+    # ============================================================
+    
+    def sincronizar(self, data_service, contratos=(), productos=()):
+        """
+        Lleva a memoria los valores guardados de los contratos
+        (cliente_id, producto_id) y productos indicados. Dentro de la
+        transacción de una confirmación, son los valores contra los que se
+        valida: ningún otro proceso puede cambiarlos hasta el COMMIT.
+        """
+        conexion = self._conexion()
+        for clave in contratos:
+            fila = conexion.execute(SQL_CONTRATO_LEER, clave).fetchone()
+            if fila:
+                self._reflejar(data_service, 'contratos', clave, fila[1], card_current_amount=fila[0])
+        for producto_id in productos:
+            fila = conexion.execute(SQL_PRODUCTO_LEER, (producto_id,)).fetchone()
+            if fila:
+                self._reflejar(data_service, 'productos', producto_id, fila[1], stock_current=fila[0])
+    
+    def al_dia(self):
+        """
+        True si ningún proceso escribió desde el último refresco. Dentro
+        de una transacción que ya escribió no se refresca (el reloj tiene
+        el número propio, que se pierde si se deshace).
+        
+        Se llama en cada lectura de pedidos: primero se compara
+        PRAGMA data_version, que no lee páginas de la base. Si ninguna
+        otra conexión hizo COMMIT desde que este hilo vio la memoria al
+        día, lo sigue estando (lo que escribió este hilo ya está en
+        memoria); solo si cambió se lee el reloj.
+        """
+        if self._local.__dict__.get('marca') is not None:
+            return True
+        if self._releer:
+            return False
+        
+        conexion = self._conexion()
+        version = conexion.execute(SQL_VERSION_DATOS).fetchone()[0]
+        if version == self._local.version:
+            return True
+        if conexion.execute(SQL_RELOJ_LEER).fetchone()[0] != self._marca:
+            return False
+        self._local.version = version
+        return True
+    
+    def refrescar(self, data_service):
+        """
+        Trae lo escrito desde el último refresco (por cualquier proceso):
+        aplica contratos y stock sobre DataService y devuelve los pedidos
+        nuevos o con cambios, con su historial completo. El llamador evita
+        que dos refrescos corran a la vez.
+        """
+        if self.al_dia():
+            return []
+        
+        releer, self._releer = self._releer, set()
+        with self._lectura() as conexion:
+            marca = conexion.execute(SQL_RELOJ_LEER).fetchone()[0]
+            contratos = conexion.execute(SQL_CONTRATOS_DESDE, (self._marca,)).fetchall()
+            productos = conexion.execute(SQL_PRODUCTOS_DESDE, (self._marca,)).fetchall()
+            pedidos = self._leer_pedidos(conexion, self._marca)
+            for tabla, clave in releer:
+                if tabla == 'contratos':
+                    fila = conexion.execute(SQL_CONTRATO_LEER, clave).fetchone()
+                    if fila:
+                        contratos.append(clave + fila)
+                else:
+                    fila = conexion.execute(SQL_PRODUCTO_LEER, (clave,)).fetchone()
+                    if fila:
+                        productos.append((clave,) + fila)
+        
+        if self._local.profundidad:
+            # Dentro de una transacción no se toman locks de registros (el
+            # orden es registros -> base): se aplican en el próximo refresco
+            self._releer.update(('contratos', (cid, pid)) for cid, pid, _, _ in contratos)
+            self._releer.update(('productos', pid) for pid, _, _ in productos)
+        else:
+            for cid, pid, actuales, cambio in contratos:
+                self._reflejar(data_service, 'contratos', (cid, pid), cambio, card_current_amount=actuales)
+            for pid, stock, cambio in productos:
+                self._reflejar(data_service, 'productos', pid, cambio, stock_current=stock)
+        self._marca = marca
+        return pedidos
+    
+    def _reflejar(self, data_service, tabla, clave, cambio, **campos):
+        """
+        Pone en memoria un valor leído de la base, salvo que la memoria ya
+        tenga uno más nuevo (los números de cambio solo crecen). No se
+        vuelve a escribir: el observador lo ignora.
+        """
+        with data_service.bloquear(**{tabla: [clave]}):
+            if cambio < self._vistos.get((tabla, clave), 0):
+                return
+            self._vistos[(tabla, clave)] = cambio
+            
+            if tabla == 'contratos':
+                registro = data_service.obtener_contrato(*clave)
+            else:
+                registro = data_service.obtener_producto(clave)
+            if registro is None or all(getattr(registro, campo) == valor for campo, valor in campos.items()):
+                return
+            
+            self._local.reflejando = True
+            try:
+                data_service.restaurar_valores(tabla, clave, **campos)
+            finally:
+                self._local.reflejando = False
+    
+    # ============================================================
+    # ESCRITURAS
+    # ============================================================
+    
+    def _registro_cambiado(self, tabla, anterior, nuevo):
+        """
+        Observador de DataService: guarda los cambios de la recarga de CSV.
+        El valor del CSV reemplaza al guardado solo si cambió respecto a la
+        base (si otro proceso ya lo aplicó, se relee el de la base).
+        """
+        self._conexion()
+        if self._local.reflejando or tabla not in ('contratos', 'productos'):
+            return
+        
+        with self.transaccion() as tx:
+            marca = self._marca_transaccion(tx)
+            if tabla == 'contratos':
+                if nuevo is None:
+                    tx.execute(SQL_CONTRATO_ELIMINAR, anterior.clave())
+                    return
+                clave = nuevo.clave()
+                valor = nuevo.card_current_amount
+                if anterior is None or anterior.clave() != clave:
+                    cursor = tx.execute(SQL_CONTRATO_INSERTAR, clave + (valor, valor, marca))
+                else:
+                    cursor = tx.execute(SQL_CONTRATO_RECARGAR, (valor, valor, marca) + clave + (valor,))
+            else:
+                if nuevo is None:
+                    tx.execute(SQL_PRODUCTO_ELIMINAR, (anterior.id,))
+                    return
+                clave = nuevo.id
+                valor = nuevo.stock_current
+                if anterior is None:
+                    cursor = tx.execute(SQL_PRODUCTO_INSERTAR, (clave, valor, valor, marca))
+                else:
+                    cursor = tx.execute(SQL_PRODUCTO_RECARGAR, (valor, valor, marca, clave, valor))
+            
+            if cursor.rowcount:
+                self._vistos[(tabla, clave)] = marca
+            else:
+                self._releer.add((tabla, clave))
+    
+    def guardar_pedido(self, pedido):
+        """
+        Inserta un pedido nuevo con su historial y aplica su efecto:
+        descuenta el stock solo si alcanza y suma las tarjetas al contrato.
+        Si el stock no alcanza lanza StockInsuficiente sin haber escrito
+        nada del pedido (dentro de un lote, los demás siguen en pie).
+        """
+        cantidad = pedido['cantidad_aprobada']
+        with self.transaccion() as tx:
+            marca = self._marca_transaccion(tx)
+            if tx.execute(SQL_PRODUCTO_DESCONTAR, (cantidad, marca, pedido['producto_id'], cantidad)).rowcount != 1:
+                raise StockInsuficiente(f"Producto {pedido['producto_id']}: no hay stock para {cantidad} tarjetas")
+            tx.execute(SQL_CONTRATO_SUMAR, (cantidad, marca, pedido['cliente_id'], pedido['producto_id']))
+            
+            tx.execute(SQL_PEDIDO_INSERTAR, (
+                pedido['id'], pedido['tracking'], pedido['fecha'],
+                pedido['cliente_id'], pedido['cliente_nombre'],
+                pedido['producto_id'], pedido['producto_nombre'],
+                pedido['cantidad_solicitada'], pedido['cantidad_aprobada'],
+                pedido['estado'], pedido['mensaje'],
+                pedido['estado_envio'], pedido['ubicacion_actual'], marca
+            ))
+            tx.executemany(SQL_HISTORIAL_INSERTAR, [
+                (pedido['id'], orden, h['estado'], h['fecha'], h['comentario'])
+                for orden, h in enumerate(pedido['historial_envio'])
+            ])
+    
+    def guardar_estado(self, pedido):
+        """Guarda el estado de envío actual y la última entrada del historial"""
+        orden = len(pedido['historial_envio']) - 1
+        ultimo = pedido['historial_envio'][orden]
+        with self.transaccion() as tx:
+            marca = self._marca_transaccion(tx)
+            tx.execute(SQL_PEDIDO_ESTADO, (pedido['estado_envio'], pedido['ubicacion_actual'], marca, pedido['id']))
+            tx.execute(SQL_HISTORIAL_INSERTAR, (pedido['id'], orden, ultimo['estado'], ultimo['fecha'], ultimo['comentario']))
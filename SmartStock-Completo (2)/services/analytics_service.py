@@ -5,10 +5,13 @@ Servicio de análisis avanzado - SIN pandas
 """
 
 import random
+from bisect import bisect_left, bisect_right
 from datetime import datetime, timedelta
 from collections import defaultdict
 import math
 
+from .listados import IndiceListado, consultar, iterar_paginas
+
 class AnalyticsService:
     def __init__(self, data_service, motor_reglas):
         self.data_service = data_service
@@ -21,8 +24,6 @@ class AnalyticsService:
     def _generar_historial_simulado(self):
         """Genera 12 meses de historial de pedidos simulado"""
         clientes = self.data_service.obtener_clientes()
-        productos = self.data_service.obtener_productos()
-        contratos = self.data_service.contratos  # Lista de diccionarios
         
         # Patrones de temporalidad
         temporalidad = {
@@ -50,15 +51,11 @@ class AnalyticsService:
             mes = fecha_mes.month
             
             for cliente in clientes:
-                cliente_id = cliente['id']
-                cliente_nombre = cliente['name']
+                cliente_id = cliente.id
+                cliente_nombre = cliente.name
                 
-                # Buscar contratos del cliente usando client_id (nombre real de columna)
-                contratos_cliente = []
-                for c in contratos:
-                    cid = c.get('client_id', c.get('cliente_id'))
-                    if cid == cliente_id:
-                        contratos_cliente.append(c)
+                # Contratos del cliente (registros ya normalizados)
+                contratos_cliente = self.data_service.obtener_contratos_cliente(cliente_id)
                 
                 if not contratos_cliente:
                     continue
@@ -70,7 +67,7 @@ class AnalyticsService:
                 
                 for _ in range(num_pedidos):
                     contrato = random.choice(contratos_cliente)
-                    producto_id = contrato.get('product_id', contrato.get('producto_id'))
+                    producto_id = contrato.product_id
                     
                     producto = self.data_service.obtener_producto(producto_id)
                     if not producto:
@@ -79,7 +76,7 @@ class AnalyticsService:
                     cantidad_base = random.randint(20, 200)
                     mult_temp = temporalidad.get(mes, 1.0)
                     
-                    producto_nombre = producto.get('name', '')
+                    producto_nombre = producto.name
                     for key, mult in producto_temporalidad.items():
                         if key in producto_nombre:
                             mult_temp *= mult.get(mes, 1.0)
@@ -105,10 +102,40 @@ class AnalyticsService:
         
         historial.sort(key=lambda x: x['fecha'])
         self.historial_generado = historial
+        
+        # Índices para listar_historial: la clave es la posición en el historial
+        self._fechas_historial = [p['fecha'] for p in historial]
+        self._indice_historial = IndiceListado(('cliente_id', 'producto_id', 'estado'))
+        for posicion, pedido in enumerate(historial):
+            self._indice_historial.agregar(posicion, pedido)
     
     def obtener_historial_completo(self):
         return self.historial_generado
     
+    def listar_historial(self, filtros=None, desde=None, hasta=None, cursor=None, limite=None):
+        """
+        Historial en orden de fecha, filtrado con los índices.
+        - filtros: {'cliente_id'|'producto_id'|'estado': (valores, ...)}
+        - desde/hasta: fechas YYYY-MM-DD, inclusivas
+        - cursor: posición del último pedido de la página anterior
+        Devuelve (pedidos, cursor de la siguiente página o None).
+        """
+        fechas = self._fechas_historial
+        inicio = bisect_left(fechas, desde) if desde else 0
+        fin = bisect_right(fechas, hasta) if hasta else len(fechas)
+        if inicio >= fin:
+            return [], None
+        return consultar(
+            range(len(fechas)), self._indice_historial, filtros or {}, self.historial_generado.__getitem__,
+            desde=inicio, hasta=fin - 1, cursor=cursor, limite=limite
+        )
+    
+    def iterar_historial(self, filtros=None, desde=None, hasta=None):
+        """Generador del historial con los filtros de listar_historial(), por páginas"""
+        return iterar_paginas(
+            lambda cursor, limite: self.listar_historial(filtros, desde, hasta, cursor, limite)
+        )
+    
     def obtener_riesgo_cobertura_contractual(self):
         contratos = self.motor_reglas.obtener_todos_contratos()
         
@@ -293,9 +320,9 @@ class AnalyticsService:
         resultado = []
         
         for producto in productos:
-            pid = producto['id']
-            stock_actual = producto.get('stock_current', producto.get('stock_actual', 0))
-            stock_minimo = producto.get('stock_alert', producto.get('stock_minimo', 50))
+            pid = producto.id
+            stock_actual = producto.stock_current
+            stock_minimo = producto.stock_alert
             
             cantidades = demanda_producto.get(pid, [0])
             demanda_total = sum(cantidades)
@@ -327,7 +354,7 @@ class AnalyticsService:
             
             resultado.append({
                 'producto_id': pid,
-                'producto_nombre': producto.get('name', 'N/A'),
+                'producto_nombre': producto.name or 'N/A',
                 'stock_actual': int(stock_actual),
                 'stock_minimo': int(stock_minimo),
                 'rop': round(rop),
@@ -0,0 +1,63 @@
+"""
+CacheLRU - Memoria acotada de resultados con sello de versión
+=============================================================
+Cada entrada guarda el resultado junto con un sello (por ejemplo, las
+versiones de los registros de los que depende). Una consulta con un
+sello distinto cuenta como obsoleta: la entrada se descarta y se vuelve
+a calcular, así un cambio invalida solo las entradas que dependen del
+registro modificado.
+
+Cuando se llena, se descarta la entrada usada hace más tiempo.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class CacheLRU:
+    """Cache LRU acotada con sello de versión y métricas de aciertos"""
+    
+    def __init__(self, capacidad=4096):
+        self.capacidad = capacidad
+        self._entradas = OrderedDict()  # clave -> (sello, valor)
+        self._lock = threading.Lock()
+        self.metricas = {'aciertos': 0, 'fallos': 0, 'obsoletas': 0, 'expulsadas': 0}
+    
+    def obtener(self, clave, sello):
+        """Valor guardado para la clave si su sello coincide, o None"""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                self.metricas['fallos'] += 1
+                return None
+            if entrada[0] != sello:
+                del self._entradas[clave]
+                self.metricas['obsoletas'] += 1
+                self.metricas['fallos'] += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.metricas['aciertos'] += 1
+            return entrada[1]
+    
+    def guardar(self, clave, sello, valor):
+        with self._lock:
+            self._entradas[clave] = (sello, valor)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.capacidad:
+                self._entradas.popitem(last=False)
+                self.metricas['expulsadas'] += 1
+    
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+    
+    def obtener_metricas(self):
+        """Aciertos, fallos (incluye obsoletas), expulsiones y ocupación"""
+        with self._lock:
+            consultas = self.metricas['aciertos'] + self.metricas['fallos']
+            return dict(
+                self.metricas,
+                entradas=len(self._entradas),
+                capacidad=self.capacidad,
+                tasa_aciertos=round(self.metricas['aciertos'] / consultas * 100, 1) if consultas else 0
+            )
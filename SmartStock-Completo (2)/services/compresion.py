@@ -0,0 +1,119 @@
+"""
+Compresor - Compresión negociada de respuestas
+==============================================
+Elige la codificación según Accept-Encoding del cliente entre las
+disponibles (brotli y zstd si están instaladas, gzip siempre) y comprime
+solo los cuerpos que superan un tamaño mínimo: en los pequeños el costo
+no compensa.
+
+- El nivel se configura al crear el compresor (por codificación).
+- Cada compresión suma su tiempo y los bytes antes y después, para ver
+  en /api/compresion/metricas cuánto cuesta y cuánto ahorra.
+- Las respuestas en cache guardan sus bytes comprimidos junto al cuerpo
+  original; esas reutilizaciones se cuentan aparte.
+"""
+
+import gzip
+import threading
+from time import perf_counter
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # zstandard es opcional
+    zstandard = None
+
+
+# Niveles por defecto (compromiso entre tamaño y tiempo)
+NIVELES = {'br': 5, 'zstd': 3, 'gzip': 6}
+
+
+def _comprimir_gzip(cuerpo, nivel):
+    # mtime=0: mismos bytes para el mismo cuerpo
+    return gzip.compress(cuerpo, compresslevel=nivel, mtime=0)
+
+
+def _comprimir_brotli(cuerpo, nivel):
+    return brotli.compress(cuerpo, quality=nivel)
+
+
+def _comprimir_zstd(cuerpo, nivel):
+    return zstandard.ZstdCompressor(level=nivel).compress(cuerpo)
+
+
+def codificaciones_disponibles():
+    """Codificación -> función (cuerpo, nivel), en orden de preferencia"""
+    disponibles = {}
+    if brotli is not None:
+        disponibles['br'] = _comprimir_brotli
+    if zstandard is not None:
+        disponibles['zstd'] = _comprimir_zstd
+    disponibles['gzip'] = _comprimir_gzip
+    return disponibles
+
+
+class Compresor:
+    """Compresión negociada con umbral de tamaño y métricas"""
+    
+    def __init__(self, minimo_bytes=1024, niveles=None):
+        self.minimo_bytes = minimo_bytes
+        self.niveles = dict(NIVELES, **(niveles or {}))
+        self._funciones = codificaciones_disponibles()
+        self._lock = threading.Lock()
+        self.metricas = {
+            codificacion: {
+                'respuestas': 0,
+                'desde_cache': 0,
+                'bytes_originales': 0,
+                'bytes_comprimidos': 0,
+                'tiempo_ms': 0.0
+            }
+            for codificacion in self._funciones
+        }
+    
+    def elegir(self, aceptadas, tamano):
+        """
+        Codificación a usar para un cuerpo de `tamano` bytes, o None.
+        aceptadas: request.accept_encodings (respeta los q= del cliente)
+        """
+        if tamano < self.minimo_bytes:
+            return None
+        return aceptadas.best_match(list(self._funciones))
+    
+    def comprimir(self, cuerpo, codificacion):
+        inicio = perf_counter()
+        comprimido = self._funciones[codificacion](cuerpo, self.niveles[codificacion])
+        transcurrido = (perf_counter() - inicio) * 1000
+        
+        with self._lock:
+            metrica = self.metricas[codificacion]
+            metrica['respuestas'] += 1
+            metrica['bytes_originales'] += len(cuerpo)
+            metrica['bytes_comprimidos'] += len(comprimido)
+            metrica['tiempo_ms'] += transcurrido
+        return comprimido
+    
+    def reutilizado(self, codificacion):
+        """Cuenta una respuesta servida con bytes ya comprimidos"""
+        with self._lock:
+            self.metricas[codificacion]['desde_cache'] += 1
+    
+    def obtener_metricas(self):
+        with self._lock:
+            return {
+                'minimo_bytes': self.minimo_bytes,
+                'niveles': {codificacion: self.niveles[codificacion] for codificacion in self._funciones},
+                'codificaciones': {
+                    codificacion: dict(
+                        metrica,
+                        tiempo_ms=round(metrica['tiempo_ms'], 3),
+                        tiempo_promedio_ms=round(metrica['tiempo_ms'] / metrica['respuestas'], 3) if metrica['respuestas'] else 0,
+                        proporcion=round(metrica['bytes_comprimidos'] / metrica['bytes_originales'], 3) if metrica['bytes_originales'] else 0
+                    )
+                    for codificacion, metrica in self.metricas.items()
+                }
+            }
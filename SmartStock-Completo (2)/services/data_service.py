@@ -5,124 +5,578 @@ Versión SIN pandas - usa csv nativo de Python
 """
 
 import csv
+import itertools
 import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from .modelos import Cliente, Producto, Contrato, modificar
+from .snapshot import huella_fuentes, guardar_snapshot, cargar_snapshot
+
+# Filas que se convierten antes de entregarlas al llamador
+TAMANO_BLOQUE = 10000
+
+# Franjas de locks para modificaciones en memoria (ver congelar())
+FRANJAS = 16
+
+
+def _a_entero(valor):
+    """Convierte una celda a int (acepta '12' y '12.0')"""
+    try:
+        return int(valor)
+    except ValueError:
+        pass
+    try:
+        numero = float(valor)
+    except ValueError:
+        numero = None
+    if numero is None or not numero.is_integer():
+        raise ValueError(f'valor no entero: {valor!r}')
+    return int(numero)
+
 
 class DataService:
     """Servicio para cargar y acceder a los datos del sistema"""
     
-    def __init__(self, data_path='data'):
+    # Filas inválidas que se muestran por archivo al cargar
+    MAX_ERRORES_REPORTADOS = 5
+    
+    # Tablas del sistema: nombre -> (archivo CSV, modelo)
+    TABLAS = {
+        'clientes': ('tabla_clientes.csv', Cliente),
+        'productos': ('productos.csv', Producto),
+        'contratos': ('contratos_clientes.csv', Contrato)
+    }
+    
+    # Snapshot binario de las tablas (relativo a data_path)
+    RUTA_SNAPSHOT = os.path.join('.snapshot', 'tablas.bin')
+    
+    def __init__(self, data_path='data', usar_snapshot=True, recarga_automatica=False, intervalo_recarga=2.0):
         self.data_path = data_path
-        self.clientes = []
-        self.productos = []
-        self.contratos = []
+        self.usar_snapshot = usar_snapshot
+        self.recarga_automatica = recarga_automatica
+        self.intervalo_recarga = intervalo_recarga
+        # Tablas como tuplas de registros de solo lectura: se entregan sin copiar
+        self.clientes = ()
+        self.productos = ()
+        self.contratos = ()
+        
+        # Filas inválidas por archivo: {archivo: [(línea, mensaje), ...]}
+        self.errores_carga = {}
+        
+        # Índices en memoria (se construyen al cargar)
+        self._indice_clientes = {}
+        self._indice_productos = {}
+        self._indice_contratos = {}
+        self._indice_contratos_cliente = {}
+        
+        # Cambios de estructura (recargas, restauración) se serializan con este lock
+        self._lock = threading.RLock()
+        # Un lock por registro: {(tabla, clave): RLock}. Los pedidos sobre
+        # contratos y productos distintos no se bloquean entre sí.
+        self._candados = {}
+        self._candados_guardia = threading.Lock()
+        # Cada modificación (cambio + aviso a observadores) toma una franja;
+        # congelar() las toma todas para leer un estado sin cambios a medias
+        self._franjas = [threading.Lock() for _ in range(FRANJAS)]
+        # Funciones notificadas cuando cambia un registro: fn(tabla, anterior, nuevo)
+        self._observadores = []
+        # Versión de cada registro: {(tabla, clave): n}, sube con cada cambio
+        self._versiones = {}
+        # Versión de cada tabla: {tabla: n}. Cada cambio toma un valor nuevo de un
+        # contador global (next() es atómico): un valor ya reemplazado nunca vuelve
+        self._reloj = itertools.count(1)
+        self._versiones_tabla = {}
+        # Hash de cada fila tal como venía en el CSV: {tabla: {clave: hash}}
+        self._huellas_filas = {}
+        self._huella_archivos = {}
+        self._hilo_recarga = None
+        # Marca el hilo que está avisando los cambios de una recarga (en_recarga)
+        self._local = threading.local()
         
         self._cargar_datos()
+        self._construir_indices()
+        
+        if self.recarga_automatica:
+            self.iniciar_recarga_automatica()
     
     def _cargar_datos(self):
-        """Carga todos los archivos CSV"""
+        """
+        Carga todos los archivos CSV.
+        Si hay un snapshot que corresponde a los CSV actuales se usa ese;
+        si no, se parsean los CSV y se regenera el snapshot.
+        """
+        archivos = [archivo for archivo, _ in self.TABLAS.values()]
+        huella = huella_fuentes(self.data_path, archivos)
+        self._huella_archivos = huella
+        ruta_snapshot = os.path.join(self.data_path, self.RUTA_SNAPSHOT)
+        
+        cargado = None
+        if self.usar_snapshot:
+            modelos = {nombre: modelo for nombre, (_, modelo) in self.TABLAS.items()}
+            cargado = cargar_snapshot(ruta_snapshot, huella, modelos)
+        
+        if cargado:
+            tablas, extras = cargado
+            for nombre, registros in tablas.items():
+                setattr(self, nombre, tuple(registros))
+            self.errores_carga = {archivo: [tuple(e) for e in errores] for archivo, errores in extras.get('errores_carga', {}).items()}
+            print("⚡ Datos cargados desde snapshot")
+        else:
+            for nombre, (archivo, modelo) in self.TABLAS.items():
+                setattr(self, nombre, tuple(self._cargar_tabla(archivo, modelo)))
+            
+            if self.usar_snapshot:
+                self._guardar_snapshot(ruta_snapshot, huella)
+        
+        print(f"✅ Clientes cargados: {len(self.clientes)}")
+        print(f"✅ Productos cargados: {len(self.productos)}")
+        print(f"✅ Contratos cargados: {len(self.contratos)}")
+        
+        # La línea base del diff solo hace falta si se recargan los CSV
+        if self.recarga_automatica:
+            for nombre in self.TABLAS:
+                self._huellas_filas[nombre] = self._calcular_huellas(getattr(self, nombre))
+    
+    def _calcular_huellas(self, registros):
+        """Hash de cada fila por clave (la primera aparición gana, como en los índices)"""
+        huellas = {}
+        for registro in registros:
+            huellas.setdefault(registro.clave(), hash(registro.valores()))
+        return huellas
+    
+    def _guardar_snapshot(self, ruta_snapshot, huella):
+        """Guarda el snapshot de las tablas recién parseadas"""
+        # Solo se cachean CSV presentes; si falta alguno se vuelve a intentar en el próximo arranque
+        if any(h is None for h in huella.values()):
+            return
         try:
-            # Cargar clientes
-            clientes_path = os.path.join(self.data_path, 'tabla_clientes.csv')
-            if os.path.exists(clientes_path):
-                self.clientes = self._leer_csv(clientes_path)
-                print(f"✅ Clientes cargados: {len(self.clientes)}")
+            guardar_snapshot(
+                ruta_snapshot,
+                huella,
+                {nombre: (modelo, getattr(self, nombre)) for nombre, (_, modelo) in self.TABLAS.items()},
+                extras={'errores_carga': self.errores_carga}
+            )
+        except (OSError, OverflowError, ValueError) as e:
+            # Un entero que no cabe en 64 bits (o un texto que no se puede
+            # codificar) solo deja sin snapshot: los datos ya vienen del CSV
+            print(f"⚠️  No se pudo guardar el snapshot: {e}")
+    
+    def _cargar_tabla(self, archivo, modelo):
+        """
+        Carga un CSV completo como lista de registros del modelo.
+        Un archivo faltante o ilegible deja la tabla vacía sin detener
+        la carga de las demás; las filas inválidas se reportan y se omiten.
+        """
+        filepath = os.path.join(self.data_path, archivo)
+        if not os.path.exists(filepath):
+            print(f"⚠️  {archivo} no encontrado")
+            return []
+        
+        errores = []
+        registros = []
+        try:
+            for bloque in self._leer_csv(filepath, modelo, errores):
+                registros.extend(bloque)
+        except (OSError, UnicodeDecodeError, csv.Error) as e:
+            print(f"❌ Error leyendo {archivo}: {e}")
+            return []
+        
+        self.errores_carga[archivo] = errores
+        if errores:
+            print(f"⚠️  {archivo}: {len(errores)} filas inválidas omitidas")
+            for linea, mensaje in errores[:self.MAX_ERRORES_REPORTADOS]:
+                print(f"     → línea {linea}: {mensaje}")
+        
+        return registros
+    
+    def _leer_csv(self, filepath, modelo, errores, tamano_bloque=TAMANO_BLOQUE):
+        """
+        Lee un CSV en streaming y genera bloques de registros del modelo.
+        
+        Los tipos de cada columna vienen del esquema del modelo (CAMPOS),
+        así cada celda se convierte una sola vez con el tipo correcto.
+        Las filas inválidas se agregan a `errores` como (línea, mensaje).
+        """
+        with open(filepath, 'r', encoding='utf-8-sig', newline='') as f:
+            reader = csv.reader(f)
+            encabezados = next(reader, None)
+            if not encabezados:
+                return
             
-            # Cargar productos
-            productos_path = os.path.join(self.data_path, 'productos.csv')
-            if os.path.exists(productos_path):
-                self.productos = self._leer_csv(productos_path)
-                print(f"✅ Productos cargados: {len(self.productos)}")
+            columnas = modelo.resolver_columnas(encabezados)
+            total_columnas = len(encabezados)
             
-            # Cargar contratos
-            contratos_path = os.path.join(self.data_path, 'contratos_clientes.csv')
-            if os.path.exists(contratos_path):
-                self.contratos = self._leer_csv(contratos_path)
-                print(f"✅ Contratos cargados: {len(self.contratos)}")
+            # Plan de conversión: (posición en CSV, tipo) o valor fijo si falta la columna
+            plan = []
+            for campo, tipo in modelo.CAMPOS.items():
+                if campo in columnas:
+                    plan.append((columnas[campo], _a_entero if tipo is int else tipo, None))
+                else:
+                    plan.append((None, None, modelo.valor_defecto(campo)))
+            
+            bloque = []
+            for fila in reader:
+                if not fila:
+                    continue
+                if len(fila) != total_columnas:
+                    errores.append((reader.line_num, f'se esperaban {total_columnas} columnas, hay {len(fila)}'))
+                    continue
+                try:
+                    valores = [
+                        convertir(fila[posicion]) if posicion is not None else defecto
+                        for posicion, convertir, defecto in plan
+                    ]
+                except ValueError as e:
+                    errores.append((reader.line_num, str(e)))
+                    continue
                 
-        except Exception as e:
-            print(f"❌ Error cargando datos: {e}")
-    
-    def _leer_csv(self, filepath):
-        """Lee un archivo CSV y devuelve lista de diccionarios"""
-        datos = []
-        with open(filepath, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                # Convertir valores numéricos
-                fila = {}
-                for key, value in row.items():
-                    # Intentar convertir a int
-                    try:
-                        fila[key] = int(value)
-                    except (ValueError, TypeError):
-                        # Intentar convertir a float
-                        try:
-                            fila[key] = float(value)
-                        except (ValueError, TypeError):
-                            fila[key] = value  # Mantener como string
-                datos.append(fila)
-        return datos
+                bloque.append(modelo(*valores))
+                if len(bloque) >= tamano_bloque:
+                    yield bloque
+                    bloque = []
+            
+            if bloque:
+                yield bloque
+    
+    def _construir_indices(self):
+        """
+        Construye los índices de búsqueda:
+        - clientes y productos por id
+        - contratos por (cliente_id, producto_id)
+        - contratos agrupados por cliente_id
+        """
+        self._indice_clientes = {}
+        self._indice_productos = {}
+        self._indice_contratos = {}
+        self._indice_contratos_cliente = {}
+        
+        # Si hay ids duplicados se conserva el primero (igual que la búsqueda lineal)
+        for cliente in self.clientes:
+            self._indice_clientes.setdefault(cliente.id, cliente)
+        
+        for producto in self.productos:
+            self._indice_productos.setdefault(producto.id, producto)
+        
+        por_cliente = {}
+        for contrato in self.contratos:
+            self._indice_contratos.setdefault(contrato.clave(), contrato)
+            por_cliente.setdefault(contrato.client_id, []).append(contrato)
+        self._indice_contratos_cliente = {cliente_id: tuple(lista) for cliente_id, lista in por_cliente.items()}
+    
+    # ============================================================
+    # LOCKS POR REGISTRO
+    # ============================================================
+    
+    def _candado(self, tabla, clave):
+        """Lock de un registro (se crea la primera vez que se pide)"""
+        candado = self._candados.get((tabla, clave))
+        if candado is None:
+            with self._candados_guardia:
+                candado = self._candados.setdefault((tabla, clave), threading.RLock())
+        return candado
+    
+    @contextmanager
+    def bloquear(self, contratos=(), productos=()):
+        """
+        Toma los locks de los contratos (cliente_id, producto_id) y productos
+        indicados durante el bloque.
+        
+        Siempre se toman en el mismo orden (primero contratos, luego productos,
+        cada grupo ordenado por clave) para que dos pedidos nunca se esperen
+        mutuamente. Los locks son reentrantes: los métodos que modifican un
+        registro vuelven a tomar el suyo sin bloquearse.
+        """
+        candados = [self._candado('contratos', clave) for clave in sorted(set(contratos))]
+        candados += [self._candado('productos', clave) for clave in sorted(set(productos))]
+        
+        tomados = []
+        try:
+            for candado in candados:
+                candado.acquire()
+                tomados.append(candado)
+            yield
+        finally:
+            for candado in reversed(tomados):
+                candado.release()
+    
+    def _franja(self, tabla, clave):
+        return self._franjas[hash((tabla, clave)) % FRANJAS]
+    
+    @contextmanager
+    def congelar(self):
+        """
+        Detiene las modificaciones de registros y las recargas durante el
+        bloque. Sirve para recalcular un agregado completo sin que un pedido
+        en curso quede contado a medias (cambiado pero aún no notificado).
+        """
+        with self._lock:
+            for franja in self._franjas:
+                franja.acquire()
+            try:
+                yield
+            finally:
+                for franja in reversed(self._franjas):
+                    franja.release()
+    
+    def registrar_observador(self, funcion):
+        """
+        Registra una función que se llama cada vez que cambia un registro:
+        funcion(tabla, anterior, nuevo)
+        - anterior es None si el registro es nuevo
+        - nuevo es None si el registro se eliminó
+        Se usa para mantener agregados derivados sin recalcularlos.
+        """
+        self._observadores.append(funcion)
+    
+    def en_recarga(self):
+        """
+        True si el aviso en curso viene de una recarga de CSV (el valor se
+        reemplaza) y no de un pedido o una restauración (el valor cambia).
+        """
+        return getattr(self._local, 'recargando', False)
+    
+    def _notificar(self, tabla, anterior, nuevo):
+        # Se llama con el lock del registro tomado: la versión no se pisa
+        clave = (tabla, (nuevo if nuevo is not None else anterior).clave())
+        self._versiones[clave] = self._versiones.get(clave, 0) + 1
+        self._versiones_tabla[tabla] = next(self._reloj)
+        for funcion in self._observadores:
+            funcion(tabla, anterior, nuevo)
+    
+    def version(self, tabla, clave):
+        """
+        Versión de un registro: cambia cada vez que el registro se modifica,
+        se agrega o se elimina (0 si nunca cambió desde la carga).
+        """
+        return self._versiones.get((tabla, clave), 0)
+    
+    def version_tabla(self, tabla):
+        """
+        Versión de una tabla: cambia con cada modificación de cualquiera de
+        sus registros o con una recarga (0 si no cambió desde la carga).
+        """
+        return self._versiones_tabla.get(tabla, 0)
+    
+    def restaurar_valores(self, tabla, clave, **campos):
+        """
+        Sobrescribe campos de un registro con valores guardados fuera del CSV
+        (por ejemplo, desde el almacenamiento persistente al arrancar).
+        """
+        with self._candado(tabla, clave), self._franja(tabla, clave):
+            registro = getattr(self, f'_indice_{tabla}').get(clave)
+            if registro is None:
+                return False
+            anterior = registro.copiar()
+            modificar(registro, **campos)
+            self._notificar(tabla, anterior, registro)
+        return True
+    
+    # ============================================================
+    # RECARGA EN CALIENTE
+    # ============================================================
+    
+    def iniciar_recarga_automatica(self):
+        """Inicia un hilo que vigila los CSV y aplica los cambios"""
+        if self._hilo_recarga and self._hilo_recarga.is_alive():
+            return
+        for nombre in self.TABLAS:
+            if nombre not in self._huellas_filas:
+                self._huellas_filas[nombre] = self._calcular_huellas(getattr(self, nombre))
+        self._hilo_recarga = threading.Thread(target=self._vigilar_archivos, name='recarga-csv', daemon=True)
+        self._hilo_recarga.start()
+        print(f"👀 Recarga automática de CSV activa (cada {self.intervalo_recarga}s)")
+    
+    def _vigilar_archivos(self):
+        while True:
+            time.sleep(self.intervalo_recarga)
+            try:
+                self.recargar_cambios()
+            except Exception as e:
+                # El hilo no debe morir por un CSV a medio escribir
+                print(f"❌ Error en recarga automática: {e}")
+    
+    def recargar_cambios(self):
+        """
+        Recarga los CSV que cambiaron desde la última carga.
+        Devuelve {tabla: {'agregados': n, 'modificados': n, 'eliminados': n}}
+        """
+        resumen = {}
+        for nombre, (archivo, modelo) in self.TABLAS.items():
+            huella = huella_fuentes(self.data_path, [archivo])[archivo]
+            if huella is None or huella == self._huella_archivos.get(archivo):
+                continue
+            
+            errores = []
+            registros = []
+            try:
+                for bloque in self._leer_csv(os.path.join(self.data_path, archivo), modelo, errores):
+                    registros.extend(bloque)
+            except (OSError, UnicodeDecodeError, csv.Error) as e:
+                print(f"❌ Error recargando {archivo}: {e}")
+                continue
+            
+            resumen[nombre] = self._aplicar_diff(nombre, registros)
+            self._huella_archivos[archivo] = huella
+            self.errores_carga[archivo] = errores
+            
+            cambios = resumen[nombre]
+            print(f"🔄 {archivo} recargado: +{cambios['agregados']} ~{cambios['modificados']} -{cambios['eliminados']}")
+        
+        return resumen
+    
+    def _aplicar_diff(self, nombre, registros):
+        """
+        Aplica a la tabla solo las filas que cambiaron respecto al CSV anterior.
+        
+        - Las filas sin cambios conservan su registro vivo (incluye lo que
+          hayan modificado los pedidos confirmados).
+        - Las filas nuevas o modificadas entran como registros nuevos, así
+          quien tenga el registro anterior nunca lo ve a medio actualizar.
+        - La lista de la tabla se reemplaza en una sola asignación.
+        """
+        huellas_anteriores = self._huellas_filas.get(nombre, {})
+        huellas = {}
+        indice = getattr(self, f'_indice_{nombre}')
+        
+        tabla = []
+        cambios = []  # (clave, anterior, nuevo)
+        duplicados = []
+        for registro in registros:
+            clave = registro.clave()
+            if clave in huellas:
+                # Clave duplicada en el CSV: se conserva la fila pero no se indexa
+                tabla.append(registro)
+                duplicados.append(registro)
+                continue
+            
+            huella = hash(registro.valores())
+            huellas[clave] = huella
+            actual = indice.get(clave)
+            
+            if actual is not None and huellas_anteriores.get(clave) == huella:
+                tabla.append(actual)
+            else:
+                tabla.append(registro)
+                cambios.append((clave, actual, registro))
+        
+        eliminados = [(clave, indice.get(clave), None) for clave in huellas_anteriores if clave not in huellas]
+        cambios.extend(c for c in eliminados if c[1] is not None)
+        
+        # Los registros que cambian se bloquean como en un pedido, así ningún
+        # pedido en curso modifica un registro que se está reemplazando
+        claves = [clave for clave, _, _ in cambios]
+        bloqueo = self.bloquear(**{nombre: claves}) if nombre in ('contratos', 'productos') else nullcontext()
+        
+        with self._lock, bloqueo:
+            for clave, anterior, nuevo in cambios:
+                if nuevo is None:
+                    del indice[clave]
+                else:
+                    indice[clave] = nuevo
+            
+            if nombre == 'contratos' and (cambios or duplicados):
+                self._actualizar_indice_cliente(tabla, cambios, duplicados)
+            
+            setattr(self, nombre, tuple(tabla))
+            self._huellas_filas[nombre] = huellas
+            self._versiones_tabla[nombre] = next(self._reloj)
+            
+            self._local.recargando = True
+            try:
+                for _, anterior, nuevo in cambios:
+                    self._notificar(nombre, anterior, nuevo)
+            finally:
+                self._local.recargando = False
+        
+        return {
+            'agregados': sum(1 for _, anterior, nuevo in cambios if anterior is None),
+            'modificados': sum(1 for _, anterior, nuevo in cambios if anterior is not None and nuevo is not None),
+            'eliminados': sum(1 for _, anterior, nuevo in cambios if nuevo is None)
+        }
+    
+    def _actualizar_indice_cliente(self, tabla, cambios, duplicados):
+        """
+        Rehace las listas de contratos por cliente solo para los clientes
+        afectados por el diff; las de los demás clientes no se tocan.
+        """
+        afectados = set()
+        for _, anterior, nuevo in cambios:
+            if anterior is not None:
+                afectados.add(anterior.client_id)
+            if nuevo is not None:
+                afectados.add(nuevo.client_id)
+        afectados.update(c.client_id for c in duplicados)
+        
+        listas = {cliente_id: [] for cliente_id in afectados}
+        for contrato in tabla:
+            lista = listas.get(contrato.client_id)
+            if lista is not None:
+                lista.append(contrato)
+        
+        for cliente_id, lista in listas.items():
+            if lista:
+                self._indice_contratos_cliente[cliente_id] = tuple(lista)
+            else:
+                self._indice_contratos_cliente.pop(cliente_id, None)
     
     # ============================================================
     # MÉTODOS DE CLIENTES
     # ============================================================
+    # Las lecturas devuelven los registros vivos (de solo lectura) sin
+    # copiarlos; para serializar se usa registro.a_dict().
     
     def obtener_clientes(self):
-        """Obtiene lista de todos los clientes"""
-        return [{'id': c['id'], 'name': c['name']} for c in self.clientes]
+        """Obtiene todos los clientes (tupla de registros)"""
+        return self.clientes
     
     def obtener_cliente(self, cliente_id):
         """Obtiene un cliente por su ID"""
-        for cliente in self.clientes:
-            if cliente['id'] == cliente_id:
-                return cliente.copy()
-        return None
+        return self._indice_clientes.get(cliente_id)
     
     def obtener_nombre_cliente(self, cliente_id):
         """Obtiene solo el nombre de un cliente"""
-        cliente = self.obtener_cliente(cliente_id)
-        return cliente['name'] if cliente else 'Desconocido'
+        cliente = self._indice_clientes.get(cliente_id)
+        return cliente.name if cliente else 'Desconocido'
     
     # ============================================================
     # MÉTODOS DE PRODUCTOS
     # ============================================================
     
     def obtener_productos(self):
-        """Obtiene lista de todos los productos"""
-        return [p.copy() for p in self.productos]
+        """Obtiene todos los productos (tupla de registros)"""
+        return self.productos
     
     def obtener_producto(self, producto_id):
         """Obtiene un producto por su ID"""
-        for producto in self.productos:
-            if producto['id'] == producto_id:
-                return producto.copy()
-        return None
+        return self._indice_productos.get(producto_id)
     
     def obtener_nombre_producto(self, producto_id):
         """Obtiene solo el nombre de un producto"""
-        producto = self.obtener_producto(producto_id)
-        return producto['name'] if producto else 'Desconocido'
+        producto = self._indice_productos.get(producto_id)
+        return producto.name if producto else 'Desconocido'
     
     def obtener_stock_producto(self, producto_id):
         """Obtiene el stock actual de un producto"""
-        producto = self.obtener_producto(producto_id)
-        if producto:
-            # Intentar ambas columnas posibles
-            return int(producto.get('stock_current', producto.get('stock_actual', 0)))
-        return 0
+        producto = self._indice_productos.get(producto_id)
+        return producto.stock_current if producto else 0
     
     def actualizar_stock_producto(self, producto_id, cantidad_a_restar):
         """Actualiza el stock de un producto después de un pedido"""
-        for producto in self.productos:
-            if producto['id'] == producto_id:
-                # Determinar columna de stock
-                stock_key = 'stock_current' if 'stock_current' in producto else 'stock_actual'
-                stock_actual = int(producto.get(stock_key, 0))
-                nuevo_stock = max(0, stock_actual - cantidad_a_restar)
-                producto[stock_key] = nuevo_stock
-                print(f"📦 Stock actualizado: Producto {producto_id} -> {nuevo_stock} (restado {cantidad_a_restar})")
-                return True
-        return False
+        with self._candado('productos', producto_id), self._franja('productos', producto_id):
+            producto = self._indice_productos.get(producto_id)
+            if not producto:
+                return False
+            
+            anterior = producto.copiar()
+            nuevo_stock = max(0, producto.stock_current - cantidad_a_restar)
+            # Se modifica el mismo registro referenciado por el índice
+            modificar(producto, stock_current=nuevo_stock)
+            self._notificar('productos', anterior, producto)
+        
+        print(f"📦 Stock actualizado: Producto {producto_id} -> {nuevo_stock} (restado {cantidad_a_restar})")
+        return True
     
     # ============================================================
     # MÉTODOS DE CONTRATOS
@@ -130,40 +584,31 @@ class DataService:
     
     def obtener_contrato(self, cliente_id, producto_id):
         """Obtiene un contrato específico cliente-producto"""
-        for contrato in self.contratos:
-            cid = contrato.get('client_id', contrato.get('cliente_id'))
-            pid = contrato.get('product_id', contrato.get('producto_id'))
-            if cid == cliente_id and pid == producto_id:
-                return contrato.copy()
-        return None
+        return self._indice_contratos.get((cliente_id, producto_id))
     
     def obtener_contratos_cliente(self, cliente_id):
-        """Obtiene todos los contratos de un cliente"""
-        resultado = []
-        for contrato in self.contratos:
-            cid = contrato.get('client_id', contrato.get('cliente_id'))
-            if cid == cliente_id:
-                resultado.append(contrato.copy())
-        return resultado
+        """Obtiene todos los contratos de un cliente (tupla de registros)"""
+        return self._indice_contratos_cliente.get(cliente_id, ())
     
     def obtener_todos_contratos(self):
-        """Obtiene todos los contratos"""
-        return [c.copy() for c in self.contratos]
+        """Obtiene todos los contratos (tupla de registros)"""
+        return self.contratos
     
     def actualizar_contrato_despues_pedido(self, cliente_id, producto_id, cantidad_aprobada):
         """
         Actualiza el contrato después de confirmar un pedido
         - Incrementa card_current_amount
         """
-        for contrato in self.contratos:
-            cid = contrato.get('client_id', contrato.get('cliente_id'))
-            pid = contrato.get('product_id', contrato.get('producto_id'))
-            if cid == cliente_id and pid == producto_id:
-                # Determinar columna de tarjetas actuales
-                key = 'card_current_amount' if 'card_current_amount' in contrato else 'tarjetas_actuales'
-                tarjetas_actuales = int(contrato.get(key, 0))
-                nuevas_tarjetas = tarjetas_actuales + cantidad_aprobada
-                contrato[key] = nuevas_tarjetas
-                print(f"📄 Contrato actualizado: Cliente {cliente_id}, Producto {producto_id} -> {nuevas_tarjetas} tarjetas (+{cantidad_aprobada})")
-                return True
-        return False
+        with self._candado('contratos', (cliente_id, producto_id)), self._franja('contratos', (cliente_id, producto_id)):
+            contrato = self._indice_contratos.get((cliente_id, producto_id))
+            if not contrato:
+                return False
+            
+            anterior = contrato.copiar()
+            nuevas_tarjetas = contrato.card_current_amount + cantidad_aprobada
+            # Se modifica el mismo registro referenciado por los índices
+            modificar(contrato, card_current_amount=nuevas_tarjetas)
+            self._notificar('contratos', anterior, contrato)
+        
+        print(f"📄 Contrato actualizado: Cliente {cliente_id}, Producto {producto_id} -> {nuevas_tarjetas} tarjetas (+{cantidad_aprobada})")
+        return True
\ No newline at end of file
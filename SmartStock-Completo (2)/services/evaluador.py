@@ -0,0 +1,404 @@
+"""
+EvaluadorContratos - Regla de Oro sobre todos los contratos a la vez
+====================================================================
+Guarda los contratos en columnas (una lista/arreglo por campo) y calcula
+para todos a la vez el máximo pedido y el porcentaje de inactivas, en
+lugar de buscar contrato, producto y nombres fila por fila.
+
+- Con NumPy instalado las columnas son arreglos y el cálculo es
+  vectorizado. Las columnas se mantienen al día con el observador de
+  DataService (un pedido actualiza una celda); si una recarga reemplaza
+  una tabla, se reconstruyen la siguiente vez que se evalúa.
+- NumPy es opcional: sin él se hace una sola pasada sobre los registros
+  con stock y nombres ya resueltos, con los mismos resultados.
+- El orden de los listados (porcentaje de inactivas y id) es un índice
+  ordenado que el mismo observador mantiene, con una lista por cliente y
+  por producto: una página es una búsqueda binaria del cursor y solo se
+  evalúan los contratos de esa página.
+- Las reglas configurables (data/reglas.json) se aplican al máximo pedido
+  como en validar_pedido, solo en los contratos a los que les aplica
+  alguna y solo en los que se devuelven.
+"""
+
+import threading
+from bisect import bisect_left, bisect_right, insort
+from operator import itemgetter
+
+try:
+    import numpy as np
+except ImportError:  # NumPy es opcional
+    np = None
+
+
+# Columnas que puede devolver evaluar(), en el orden de la fila completa
+COLUMNAS = (
+    'id', 'cliente_id', 'cliente_nombre', 'producto_id', 'producto_nombre',
+    'limite', 'actuales', 'inactivas', 'en_uso', 'espacio', 'stock',
+    'maximo_pedido', 'porcentaje_inactivas'
+)
+_POSICION = {nombre: posicion for posicion, nombre in enumerate(COLUMNAS)}
+
+
+def _entrada_orden(fila, contrato):
+    """Entrada del índice de orden: (-porcentaje redondeado, id, fila)"""
+    actuales = contrato.card_current_amount
+    porcentaje = round(contrato.card_inactive_amount / actuales * 100, 1) if actuales > 0 else 0
+    return (-porcentaje, contrato.id, fila)
+
+
+class EvaluadorContratos:
+    """Evaluación columnar de la Regla de Oro sobre los contratos"""
+    
+    def __init__(self, data_service, usar_numpy=True, reglas=None):
+        self.data = data_service
+        self.numpy = usar_numpy and np is not None
+        # ConjuntoReglas de MotorReglas (None o vacío: solo la Regla de Oro)
+        self.reglas = reglas or None
+        self._lock = threading.Lock()
+        
+        # Tablas con las que se construyeron las columnas
+        self._tablas = None
+        
+        self.data.registrar_observador(self._registro_cambiado)
+    
+    # ============================================================
+    # COLUMNAS
+    # ============================================================
+    
+    def _tablas_actuales(self):
+        return (
+            self.data.obtener_todos_contratos(),
+            self.data.obtener_productos(),
+            self.data.obtener_clientes()
+        )
+    
+    def _al_dia(self):
+        """True si las columnas corresponden a las tablas actuales"""
+        return self._tablas is not None and all(
+            actual is construida for actual, construida in zip(self._tablas_actuales(), self._tablas)
+        )
+    
+    def _vigentes(self):
+        """Reconstruye las columnas si alguna tabla fue reemplazada"""
+        if self._al_dia():
+            return
+        tablas = self._tablas_actuales()
+        contratos, productos, clientes = tablas
+        
+        nombres_cliente = {}
+        for cliente in clientes:
+            nombres_cliente.setdefault(cliente.id, cliente.name)
+        
+        # Índice de orden: todas las entradas y las de cada cliente y producto
+        self._fila_contrato = {}
+        self._entradas = {}
+        for fila, contrato in enumerate(contratos):
+            self._fila_contrato.setdefault(contrato.clave(), fila)
+            self._entradas[fila] = _entrada_orden(fila, contrato)
+        self._orden = {None: sorted(self._entradas.values())}
+        for entrada in self._orden[None]:
+            contrato = contratos[entrada[2]]
+            self._orden.setdefault(('cliente', contrato.client_id), []).append(entrada)
+            self._orden.setdefault(('producto', contrato.product_id), []).append(entrada)
+        
+        if not self.numpy:
+            # Sin NumPy se leen los registros vivos: solo hacen falta las búsquedas
+            self._productos = {}
+            for producto in productos:
+                self._productos.setdefault(producto.id, producto)
+            self._nombres_cliente = nombres_cliente
+            self._tablas = tablas
+            return
+        
+        # Stock y nombre por producto (primera aparición de cada id, como el índice)
+        self._fila_producto = {}
+        stock = []
+        nombres_producto = []
+        for producto in productos:
+            if producto.id not in self._fila_producto:
+                self._fila_producto[producto.id] = len(stock)
+                stock.append(producto.stock_current)
+                nombres_producto.append(producto.name)
+        # Posición extra para contratos sin producto
+        stock.append(0)
+        nombres_producto.append('Desconocido')
+        sin_producto = len(stock) - 1
+        
+        self._filas_cliente = {}
+        self._filas_producto = {}
+        for fila, contrato in enumerate(contratos):
+            self._filas_cliente.setdefault(contrato.client_id, []).append(fila)
+            self._filas_producto.setdefault(contrato.product_id, []).append(fila)
+        
+        columnas = {
+            'id': [c.id for c in contratos],
+            'cliente_id': [c.client_id for c in contratos],
+            'producto_id': [c.product_id for c in contratos],
+            'limite': [c.card_limit_amount for c in contratos],
+            'actuales': [c.card_current_amount for c in contratos],
+            'inactivas': [c.card_inactive_amount for c in contratos],
+            'pos_producto': [self._fila_producto.get(c.product_id, sin_producto) for c in contratos]
+        }
+        # Contratos a los que les aplica alguna regla configurable
+        self._con_reglas = np.array(
+            [bool(self.reglas and self.reglas.aplicables(c.client_id, c.product_id)) for c in contratos],
+            dtype=bool
+        )
+        columnas['cliente_nombre'] = [nombres_cliente.get(c, 'Desconocido') for c in columnas['cliente_id']]
+        
+        self._columnas = {
+            nombre: np.array(valores, dtype=object if nombre == 'cliente_nombre' else np.int64)
+            for nombre, valores in columnas.items()
+        }
+        self._stock = np.array(stock, dtype=np.int64)
+        self._nombres_producto = np.array(nombres_producto, dtype=object)
+        self._tablas = tablas
+    
+    def _registro_cambiado(self, tabla, anterior, nuevo):
+        """Observador de DataService: actualiza la celda y la entrada que cambiaron"""
+        if anterior is None or nuevo is None:
+            return  # alta/baja: llega con una recarga que reemplaza la tabla
+        
+        with self._lock:
+            if not self._al_dia():
+                return  # se reconstruye en la próxima evaluación
+            if tabla == 'contratos':
+                fila = self._fila_contrato.get(nuevo.clave())
+                if fila is None:
+                    return
+                self._reubicar(fila, nuevo)
+                if self.numpy:
+                    self._columnas['actuales'][fila] = nuevo.card_current_amount
+            elif tabla == 'productos' and self.numpy:
+                fila = self._fila_producto.get(nuevo.id)
+                if fila is not None:
+                    self._stock[fila] = nuevo.stock_current
+    
+    def _reubicar(self, fila, contrato):
+        """Mueve la entrada del contrato en las listas del índice de orden"""
+        # Se reemplaza la entrada guardada, no la calculada desde `anterior`:
+        # así aplicar dos veces el mismo cambio no desordena el índice
+        vieja = self._entradas[fila]
+        entrada = _entrada_orden(fila, contrato)
+        if entrada == vieja:
+            return
+        self._entradas[fila] = entrada
+        for clave in (None, ('cliente', contrato.client_id), ('producto', contrato.product_id)):
+            lista = self._orden[clave]
+            del lista[bisect_left(lista, vieja)]
+            insort(lista, entrada)
+    
+    def _tramo_ordenado(self, cliente_id, producto_id, despues_de, limite):
+        """
+        Filas de la página pedida en el orden del índice: se busca el
+        cursor y se toman `limite` entradas desde ahí (todas si es None).
+        """
+        # Se recorre la lista más corta y se filtra por la otra columna
+        listas = []
+        if cliente_id is not None:
+            listas.append(self._orden.get(('cliente', cliente_id), []))
+        if producto_id is not None:
+            listas.append(self._orden.get(('producto', producto_id), []))
+        entradas = min(listas, key=len) if listas else self._orden[None]
+        
+        inicio = 0
+        if despues_de is not None:
+            porcentaje_cursor, id_cursor = despues_de
+            # Después de todas las entradas con ese porcentaje e id (cualquier fila)
+            inicio = bisect_right(entradas, (-porcentaje_cursor, id_cursor, float('inf')))
+        
+        if len(listas) < 2:
+            fin = len(entradas) if limite is None else inicio + limite
+            return [fila for _, _, fila in entradas[inicio:fin]]
+        
+        contratos = self._tablas[0]
+        filas = []
+        for _, _, fila in entradas[inicio:]:
+            contrato = contratos[fila]
+            if contrato.client_id == cliente_id and contrato.product_id == producto_id:
+                filas.append(fila)
+                if len(filas) == limite:
+                    break
+        return filas
+    
+    # ============================================================
+    # EVALUACIÓN
+    # ============================================================
+    
+    def evaluar(self, columnas, cliente_id=None, ordenar=False,
+                producto_id=None, despues_de=None, limite=None):
+        """
+        Evalúa los contratos y devuelve una lista de tuplas con los
+        valores de `columnas` (ver COLUMNAS), una por contrato.
+        - porcentaje_inactivas va redondeado a 1 decimal (0 sin tarjetas)
+        
+        Filtros:
+        - cliente_id / producto_id: solo los contratos de ese cliente / producto
+        - ordenar: por porcentaje de inactivas descendente y, a igual
+          porcentaje, por id de contrato; sale del índice de orden y solo
+          se evalúan los contratos de la página
+        
+        Paginación (sobre el orden, requiere ordenar):
+        - despues_de: (porcentaje_inactivas, id) del último contrato entregado;
+          el id no cambia con una recarga, la posición en la tabla sí
+        - limite: máximo de contratos a devolver
+        """
+        if (despues_de is not None or limite is not None) and not ordenar:
+            raise ValueError('la paginación requiere ordenar')
+        
+        with self._lock:
+            self._vigentes()
+            
+            if ordenar:
+                filas = self._tramo_ordenado(cliente_id, producto_id, despues_de, limite)
+                if self.numpy:
+                    return self._evaluar_numpy(columnas, filas)
+                contratos = self._tablas[0]
+                return self._evaluar_registros(columnas, [contratos[fila] for fila in filas])
+            
+            if not self.numpy:
+                if cliente_id is None:
+                    contratos = self.data.obtener_todos_contratos()
+                else:
+                    contratos = self.data.obtener_contratos_cliente(cliente_id)
+                return self._evaluar_registros(columnas, contratos, producto_id)
+            
+            # Se parte de la lista de filas más corta y se filtra por la otra columna
+            filas = None
+            if cliente_id is not None:
+                filas = self._filas_cliente.get(cliente_id, [])
+            if producto_id is not None:
+                del_producto = self._filas_producto.get(producto_id, [])
+                if filas is None or len(del_producto) < len(filas):
+                    filas = del_producto
+            if filas is not None and cliente_id is not None and producto_id is not None:
+                filas = np.array(filas, dtype=np.intp)
+                filas = filas[
+                    (self._columnas['cliente_id'][filas] == cliente_id) &
+                    (self._columnas['producto_id'][filas] == producto_id)
+                ]
+            return self._evaluar_numpy(columnas, filas)
+    
+    def _evaluar_numpy(self, columnas, filas):
+        """Evalúa las filas dadas, en ese orden (None = todas, en orden de tabla)"""
+        col = self._columnas
+        con_reglas = self._con_reglas
+        if filas is not None:
+            indices = np.asarray(filas, dtype=np.intp)
+            col = {nombre: valores[indices] for nombre, valores in col.items()}
+            con_reglas = con_reglas[indices]
+        
+        stock = self._stock[col['pos_producto']]
+        en_uso = col['actuales'] - col['inactivas']
+        espacio = col['limite'] - col['actuales']
+        maximo = np.maximum(0, np.minimum(np.minimum(en_uso, espacio), stock))
+        
+        con_tarjetas = col['actuales'] > 0
+        porcentaje = np.zeros(len(en_uso))
+        np.divide(col['inactivas'], col['actuales'], out=porcentaje, where=con_tarjetas)
+        porcentaje *= 100
+        redondeado = _redondear_numpy(porcentaje)
+        
+        # Reglas configurables: fila por fila, en los contratos que tienen alguna
+        if self.reglas is not None and 'maximo_pedido' in columnas:
+            for posicion in np.flatnonzero(con_reglas).tolist():
+                maximo[posicion] = _aplicar_reglas(
+                    self.reglas, int(col['cliente_id'][posicion]), int(col['producto_id'][posicion]),
+                    int(col['actuales'][posicion]), int(col['inactivas'][posicion]),
+                    int(espacio[posicion]), int(stock[posicion])
+                )
+        
+        vectores = dict(
+            col,
+            en_uso=en_uso,
+            espacio=espacio,
+            stock=stock,
+            maximo_pedido=maximo,
+            porcentaje_inactivas=redondeado
+        )
+        if 'producto_nombre' in columnas:
+            vectores['producto_nombre'] = self._nombres_producto[col['pos_producto']]
+        
+        listas = []
+        for nombre in columnas:
+            valores = vectores[nombre].tolist()
+            if nombre == 'porcentaje_inactivas' and not con_tarjetas.all():
+                # Sin tarjetas actuales el porcentaje es el entero 0, como fila por fila
+                for posicion in np.flatnonzero(~con_tarjetas).tolist():
+                    valores[posicion] = 0
+            listas.append(valores)
+        return list(zip(*listas))
+    
+    def _evaluar_registros(self, columnas, contratos, producto_id=None):
+        """Evalúa los registros dados, en ese orden"""
+        productos = self._productos
+        nombres_cliente = self._nombres_cliente
+        reglas = self.reglas
+        
+        if len(columnas) == 1:
+            posicion = _POSICION[columnas[0]]
+            proyectar = lambda fila: (fila[posicion],)
+        else:
+            proyectar = itemgetter(*(_POSICION[nombre] for nombre in columnas))
+        
+        # Una sola pasada; cada fila se arma completa (orden de COLUMNAS) y se proyecta
+        resultado = []
+        for contrato in contratos:
+            if producto_id is not None and contrato.product_id != producto_id:
+                continue
+            actuales = contrato.card_current_amount
+            inactivas = contrato.card_inactive_amount
+            porcentaje = inactivas / actuales * 100 if actuales > 0 else None
+            
+            producto = productos.get(contrato.product_id)
+            stock = producto.stock_current if producto else 0
+            limite_contrato = contrato.card_limit_amount
+            en_uso = actuales - inactivas
+            espacio = limite_contrato - actuales
+            if reglas is not None and reglas.aplicables(contrato.client_id, contrato.product_id):
+                maximo = _aplicar_reglas(
+                    reglas, contrato.client_id, contrato.product_id, actuales, inactivas, espacio, stock
+                )
+            else:
+                maximo = max(0, min(en_uso, espacio, stock))
+            
+            resultado.append(proyectar((
+                contrato.id, contrato.client_id, nombres_cliente.get(contrato.client_id, 'Desconocido'),
+                contrato.product_id, producto.name if producto else 'Desconocido',
+                limite_contrato, actuales, inactivas, en_uso, espacio, stock, maximo,
+                round(porcentaje, 1) if porcentaje is not None else 0
+            )))
+        return resultado
+
+
+def _aplicar_reglas(reglas, cliente_id, producto_id, actuales, inactivas, espacio, stock):
+    """
+    Máximo pedido de un contrato con sus reglas configurables, como en
+    MotorReglas._evaluar: las inactivas toleradas se suman al uso y el
+    tope limita lo que permite el contrato.
+    """
+    ajuste = reglas.ajustar(cliente_id, producto_id, actuales, inactivas)
+    uso_permitido = actuales - inactivas
+    tope = None
+    if ajuste:
+        uso_permitido += ajuste['inactivas_toleradas']
+        tope = ajuste['tope_pedido']
+    
+    maximo = min(uso_permitido, espacio)
+    if tope is not None:
+        maximo = min(maximo, tope)
+    return max(0, min(maximo, stock))
+
+
+def _redondear_numpy(porcentaje):
+    """
+    Redondea a 1 decimal con los mismos resultados que round() de Python.
+    np.round multiplica por 10 antes de redondear y eso puede cruzar un
+    empate (x.x5); los valores cercanos a un empate se redondean con round().
+    """
+    escalado = porcentaje * 10
+    redondeado = np.rint(escalado) / 10
+    dudosos = np.flatnonzero(np.abs(escalado - np.floor(escalado) - 0.5) < 1e-6)
+    for fila in dudosos.tolist():
+        redondeado[fila] = round(float(porcentaje[fila]), 1)
+    return redondeado
@@ -0,0 +1,114 @@
+"""
+BusEventos - Publicación en proceso de los cambios de estado
+============================================================
+TrackingService publica aquí cada cambio de estado de envío y los
+endpoints SSE lo entregan a quienes están suscritos: al canal de un
+tracking (portal de clientes) o a todos los cambios (portal admin).
+
+- Publicar no se bloquea nunca: solo agrega el evento a la cola de cada
+  suscriptor del canal y lo despierta. Los suscriptores de otros
+  trackings no se recorren.
+- Un suscriptor inactivo cuesta su cola vacía y una condición en espera;
+  todas comparten el lock del bus.
+- Cada cola tiene un máximo. Si un consumidor lento la llena, se descarta
+  el evento más antiguo y se cuenta como perdido; el endpoint le avisa
+  para que vuelva a consultar el estado completo.
+"""
+
+import threading
+from collections import deque
+
+
+# Canal de los suscriptores que reciben todos los cambios
+TODOS = '*'
+
+
+class Suscripcion:
+    """Cola acotada de eventos de un suscriptor"""
+    
+    __slots__ = ('canal', 'cola', 'perdidos', 'activa', 'condicion')
+    
+    def __init__(self, canal, capacidad, lock):
+        self.canal = canal
+        self.cola = deque(maxlen=capacidad)
+        self.perdidos = 0
+        self.activa = True
+        self.condicion = threading.Condition(lock)
+
+
+class BusEventos:
+    """Pub/sub en memoria con colas acotadas por suscriptor"""
+    
+    def __init__(self, capacidad=100, max_suscriptores=1000):
+        self.capacidad = capacidad
+        self.max_suscriptores = max_suscriptores
+        self._canales = {}  # canal -> {suscripciones}
+        self._total = 0
+        self._secuencia = 0
+        self._lock = threading.Lock()
+        self.metricas = {'publicados': 0, 'entregados': 0, 'perdidos': 0, 'rechazados': 0}
+    
+    def suscribir(self, canal=TODOS):
+        """Nueva suscripción al canal, o None si se alcanzó el máximo"""
+        with self._lock:
+            if self._total >= self.max_suscriptores:
+                self.metricas['rechazados'] += 1
+                return None
+            suscripcion = Suscripcion(canal, self.capacidad, self._lock)
+            self._canales.setdefault(canal, set()).add(suscripcion)
+            self._total += 1
+            return suscripcion
+    
+    def cancelar(self, suscripcion):
+        """Quita la suscripción (se puede llamar más de una vez)"""
+        with self._lock:
+            if not suscripcion.activa:
+                return
+            suscripcion.activa = False
+            suscriptores = self._canales[suscripcion.canal]
+            suscriptores.discard(suscripcion)
+            if not suscriptores:
+                del self._canales[suscripcion.canal]
+            self._total -= 1
+            suscripcion.condicion.notify()
+    
+    def publicar(self, canal, evento):
+        """Entrega el evento a los suscriptores del canal y a los de TODOS"""
+        with self._lock:
+            self._secuencia += 1
+            self.metricas['publicados'] += 1
+            entrada = (self._secuencia, evento)
+            for suscriptores in (self._canales.get(canal, ()), self._canales.get(TODOS, ())):
+                for suscripcion in suscriptores:
+                    if len(suscripcion.cola) == self.capacidad:
+                        # Cola llena: deque(maxlen) descarta el más antiguo
+                        suscripcion.perdidos += 1
+                        self.metricas['perdidos'] += 1
+                    suscripcion.cola.append(entrada)
+                    self.metricas['entregados'] += 1
+                    suscripcion.condicion.notify()
+    
+    def esperar(self, suscripcion, timeout):
+        """
+        Espera hasta `timeout` segundos a que haya eventos y los retira.
+        Devuelve ([(id, evento), ...], perdidos desde la última llamada);
+        la lista queda vacía si se agotó el tiempo o se canceló.
+        """
+        with self._lock:
+            if not suscripcion.cola and suscripcion.activa:
+                suscripcion.condicion.wait(timeout)
+            eventos = list(suscripcion.cola)
+            suscripcion.cola.clear()
+            perdidos = suscripcion.perdidos
+            suscripcion.perdidos = 0
+            return eventos, perdidos
+    
+    def obtener_metricas(self):
+        with self._lock:
+            return dict(
+                self.metricas,
+                suscriptores=self._total,
+                suscriptores_todos=len(self._canales.get(TODOS, ())),
+                max_suscriptores=self.max_suscriptores,
+                capacidad_cola=self.capacidad
+            )
@@ -0,0 +1,107 @@
+"""
+IndiceAcaparamiento - Contratos ordenados por porcentaje de inactivas
+=====================================================================
+Lista ordenada de los contratos con tarjetas, de mayor a menor
+porcentaje de inactivas (redondeado a 1 decimal) y, con el mismo
+porcentaje, en el orden de la tabla. Es el orden en que responde
+detectar_acaparamiento, así que una consulta por umbral es una búsqueda
+binaria más un corte, y paginar es cortar otro tramo.
+
+- Cada entrada es (-porcentaje_redondeado, fila, porcentaje).
+- Un cambio de contrato (pedido, restauración) mueve solo su entrada.
+- Si una recarga reemplaza la tabla, el índice se reconstruye en la
+  siguiente consulta.
+"""
+
+import threading
+from bisect import bisect_left, insort
+
+# El redondeo a 1 decimal mueve el porcentaje a lo más 0.05 (con margen)
+MARGEN_REDONDEO = 0.06
+
+
+def _entrada(fila, contrato):
+    """Entrada del índice para un contrato (None si no tiene tarjetas)"""
+    actuales = contrato.card_current_amount
+    if actuales <= 0:
+        return None
+    porcentaje = contrato.card_inactive_amount / actuales * 100
+    return (-round(porcentaje, 1), fila, porcentaje)
+
+
+class IndiceAcaparamiento:
+    """Índice ordenado de contratos por porcentaje de tarjetas inactivas"""
+    
+    def __init__(self, data_service):
+        self.data = data_service
+        self._lock = threading.Lock()
+        self._tabla = None
+        
+        self.data.registrar_observador(self._contrato_cambiado)
+    
+    def _vigente(self):
+        """Reconstruye el índice si la tabla de contratos fue reemplazada"""
+        contratos = self.data.obtener_todos_contratos()
+        if contratos is self._tabla:
+            return
+        
+        self._fila_contrato = {}
+        self._por_fila = {}
+        for fila, contrato in enumerate(contratos):
+            self._fila_contrato.setdefault(contrato.clave(), fila)
+            entrada = _entrada(fila, contrato)
+            if entrada is not None:
+                self._por_fila[fila] = entrada
+        
+        self._entradas = sorted(self._por_fila.values())
+        self._tabla = contratos
+    
+    def _contrato_cambiado(self, tabla, anterior, nuevo):
+        """Observador de DataService: reubica la entrada del contrato"""
+        if tabla != 'contratos' or anterior is None or nuevo is None:
+            return
+        
+        with self._lock:
+            if self._tabla is not self.data.obtener_todos_contratos():
+                return  # la tabla se reemplazó: se reconstruye en la próxima consulta
+            
+            fila = self._fila_contrato.get(nuevo.clave())
+            if fila is None:
+                return
+            
+            # Se reemplaza la entrada guardada, no la calculada desde `anterior`:
+            # así aplicar dos veces el mismo cambio no desordena el índice
+            vieja = self._por_fila.pop(fila, None)
+            if vieja is not None:
+                del self._entradas[bisect_left(self._entradas, vieja)]
+            
+            entrada = _entrada(fila, nuevo)
+            if entrada is not None:
+                self._por_fila[fila] = entrada
+                insort(self._entradas, entrada)
+    
+    def consultar(self, umbral, desplazamiento=0, limite=None):
+        """
+        Contratos con porcentaje de inactivas > umbral, en orden.
+        Devuelve (total, [(registro, porcentaje_redondeado), ...]) con
+        solo el tramo [desplazamiento, desplazamiento + limite).
+        """
+        with self._lock:
+            self._vigente()
+            entradas = self._entradas
+            
+            # Con redondeado > umbral + margen todas cumplen y con redondeado
+            # <= umbral - margen ninguna; solo las del medio se revisan una por una
+            seguras = bisect_left(entradas, (-(umbral + MARGEN_REDONDEO), -1))
+            fin = bisect_left(entradas, (-(umbral - MARGEN_REDONDEO), -1))
+            frontera = [e for e in entradas[seguras:fin] if e[2] > umbral]
+            
+            total = seguras + len(frontera)
+            hasta = total if limite is None else min(total, desplazamiento + limite)
+            
+            tramo = entradas[desplazamiento:min(hasta, seguras)]
+            if hasta > seguras:
+                tramo += frontera[max(0, desplazamiento - seguras):hasta - seguras]
+            
+            tabla = self._tabla
+            return total, [(tabla[fila], -negativo) for negativo, fila, _ in tramo]
@@ -35,7 +35,7 @@ class InventarioService:
     
     def obtener_estado_inventario(self):
         """Obtiene el estado completo del inventario"""
-        productos = self.data.productos
+        productos = self.data.obtener_productos()
         
         if not productos:
             return {
@@ -49,16 +49,16 @@ class InventarioService:
         alertas = []
         
         for p in productos:
-            stock_actual = int(p.get('stock_current', p.get('stock_actual', 0)))
-            stock_alerta = int(p.get('stock_alert', p.get('stock_minimo', 50)))
+            stock_actual = p.stock_current
+            stock_alerta = p.stock_alert
             nivel = self._calcular_nivel(stock_actual, stock_alerta)
             
             # Calcular porcentaje
             porcentaje = round((stock_actual / (stock_alerta * 2)) * 100) if stock_alerta > 0 else 100
             
             producto_info = {
-                'id': int(p['id']),
-                'nombre': p['name'],
+                'id': p.id,
+                'nombre': p.name,
                 'stock_actual': stock_actual,
                 'stock_minimo': stock_alerta,
                 'stock_alerta': stock_alerta,
@@ -72,8 +72,8 @@ class InventarioService:
                 resumen['criticos'] += 1
                 alertas.append({
                     'tipo': 'critico',
-                    'producto_id': int(p['id']),
-                    'producto': p['name'],
+                    'producto_id': p.id,
+                    'producto': p.name,
                     'stock_actual': stock_actual,
                     'stock_alerta': stock_alerta,
                     'mensaje': f'Stock crítico: solo {stock_actual:,} unidades (alerta en {stock_alerta:,})'
@@ -82,8 +82,8 @@ class InventarioService:
                 resumen['bajos'] += 1
                 alertas.append({
                     'tipo': 'bajo',
-                    'producto_id': int(p['id']),
-                    'producto': p['name'],
+                    'producto_id': p.id,
+                    'producto': p.name,
                     'stock_actual': stock_actual,
                     'stock_alerta': stock_alerta,
                     'mensaje': f'Stock bajo: {stock_actual:,} unidades (alerta en {stock_alerta:,})'
@@ -116,7 +116,7 @@ class InventarioService:
                 'mensaje': 'Producto no encontrado'
             }
         
-        stock_actual = int(producto.get('stock_current', producto.get('stock_actual', 0)))
+        stock_actual = producto.stock_current
         disponible = stock_actual >= cantidad
         
         return {
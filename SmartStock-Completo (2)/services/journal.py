@@ -0,0 +1,393 @@
+"""
+JournalPedidos - Bitácora append-only de pedidos confirmados
+============================================================
+Alternativa ligera a AlmacenSQLite: cada confirmación se escribe como
+una línea JSON en un archivo de solo-agregado. Una línea contiene el
+pedido completo, así el contrato (+cantidad) y el stock (-cantidad)
+se derivan del mismo registro y nunca quedan a medias.
+
+- Group commit: un hilo escritor junta todas las líneas pendientes y
+  hace un solo fsync por lote; cada llamador espera a que su línea
+  sea durable antes de responder.
+- Si un lote no se puede escribir, sus llamadores reciben el error, la
+  bitácora se recorta al último lote durable y el escritor sigue: un
+  error pasajero (disco lleno, por ejemplo) no la deja inutilizable.
+- Al arrancar se reproduce snapshot + bitácora sobre la línea base CSV.
+- Una recarga de CSV en caliente reemplaza el valor de los contratos y
+  productos que cambiaron; ese valor se anota en la bitácora. Al
+  reproducir, el valor anotado reemplaza al del CSV y solo se le suman
+  los pedidos posteriores, como pasó en memoria. Si el CSV se volvió a
+  editar con el servidor detenido, manda el CSV.
+- Cada N registros la bitácora se compacta en el snapshot (un registro
+  por pedido con su estado final) y se vacía.
+
+Los registros de una transacción (por ejemplo, un lote de pedidos
+confirmados juntos) se escriben en una sola línea: al reproducir se
+aplican todos o, si la línea quedó cortada, ninguno.
+
+La reproducción es idempotente: un pedido ya visto o un cambio de estado
+ya aplicado se ignoran, así un corte entre compactar y vaciar no duplica.
+"""
+
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+
+class JournalPedidos:
+    """Bitácora durable de confirmaciones y cambios de estado"""
+    
+    ARCHIVO_JOURNAL = 'pedidos.journal'
+    ARCHIVO_SNAPSHOT = 'pedidos.snapshot'
+    
+    # Un solo proceso escribe la bitácora: no hay cambios ajenos que traer
+    compartido = False
+    
+    def __init__(self, directorio, compactar_cada=10000):
+        self.directorio = directorio
+        self.compactar_cada = compactar_cada
+        os.makedirs(directorio, exist_ok=True)
+        
+        self.ruta_journal = os.path.join(directorio, self.ARCHIVO_JOURNAL)
+        self.ruta_snapshot = os.path.join(directorio, self.ARCHIVO_SNAPSHOT)
+        
+        # Estado según la bitácora (lo que sobreviviría a un reinicio)
+        self._espejo = {}
+        # Valores que puso una recarga de CSV, con los pedidos posteriores
+        # ya aplicados: {(tabla, clave): [valor, número de la recarga, valor del CSV]}
+        self._recargas = {}
+        self._ultima_recarga = 0
+        
+        self._cond = threading.Condition()
+        self._pendientes = []
+        self._secuencia = 0
+        # Última secuencia procesada (escrita o fallida) y errores de las fallidas
+        self._procesado = 0
+        self._fallidos = {}
+        self._desde_compactacion = 0
+        
+        self.metricas = {'registros': 0, 'fsyncs': 0, 'lote_maximo': 0, 'compactaciones': 0, 'errores': 0}
+        
+        self._archivo = None
+        # Tamaño de la bitácora hasta el último lote durable; si un lote
+        # falla, lo escrito después se descarta antes del siguiente
+        self._tamano = 0
+        self._recortar = False
+        self._hilo = None
+        
+        # Registros de la transacción abierta en cada hilo (None fuera de una)
+        self._local = threading.local()
+    
+    # ============================================================
+    # RESTAURACIÓN AL ARRANCAR
+    # ============================================================
+    
+    def restaurar(self, data_service):
+        """
+        Reproduce snapshot + bitácora, aplica los efectos sobre DataService
+        y devuelve los pedidos ordenados por id.
+        """
+        for ruta in (self.ruta_snapshot, self.ruta_journal):
+            self._reproducir(ruta)
+        
+        pedidos = sorted(self._espejo.values(), key=lambda p: p['id'])
+        
+        # Una recarga cuyo CSV cambió otra vez (con el servidor detenido)
+        # ya no vale: se parte del CSV actual, como sin recargas
+        for tabla, clave in list(self._recargas):
+            if tabla == 'contratos':
+                registro = data_service.obtener_contrato(*clave)
+                actual = registro.card_current_amount if registro else None
+            else:
+                registro = data_service.obtener_producto(clave)
+                actual = registro.stock_current if registro else None
+            if actual != self._recargas[(tabla, clave)][2]:
+                del self._recargas[(tabla, clave)]
+        
+        # Efectos acumulados de los pedidos sobre contratos y stock (los
+        # recargados en caliente ya traen los suyos en el valor anotado)
+        tarjetas = {}
+        consumos = {}
+        for pedido in pedidos:
+            clave = (pedido['cliente_id'], pedido['producto_id'])
+            if ('contratos', clave) not in self._recargas:
+                tarjetas[clave] = tarjetas.get(clave, 0) + pedido['cantidad_aprobada']
+            if ('productos', pedido['producto_id']) not in self._recargas:
+                consumos.setdefault(pedido['producto_id'], []).append(pedido['cantidad_aprobada'])
+        
+        for clave, cantidad in tarjetas.items():
+            contrato = data_service.obtener_contrato(*clave)
+            if contrato:
+                data_service.restaurar_valores('contratos', clave, card_current_amount=contrato.card_current_amount + cantidad)
+        
+        for producto_id, cantidades in consumos.items():
+            producto = data_service.obtener_producto(producto_id)
+            if producto:
+                stock = producto.stock_current
+                for cantidad in cantidades:
+                    stock = max(0, stock - cantidad)
+                data_service.restaurar_valores('productos', producto_id, stock_current=stock)
+        
+        for (tabla, clave), (valor, numero, _) in self._recargas.items():
+            if tabla == 'contratos':
+                data_service.restaurar_valores('contratos', clave, card_current_amount=valor)
+            else:
+                data_service.restaurar_valores('productos', clave, stock_current=valor)
+            self._ultima_recarga = max(self._ultima_recarga, numero)
+        
+        self._data = data_service
+        data_service.registrar_observador(self._registro_cambiado)
+        
+        self._archivo = open(self.ruta_journal, 'ab')
+        self._tamano = os.path.getsize(self.ruta_journal)
+        self._hilo = threading.Thread(target=self._escritor, name='journal-pedidos', daemon=True)
+        self._hilo.start()
+        
+        print(f"   ✓ Bitácora reproducida: {len(pedidos)} pedidos")
+        # El servicio recibe copias: el espejo solo cambia desde la bitácora
+        return [self._copiar_pedido(p) for p in pedidos]
+    
+    def _reproducir(self, ruta):
+        """Aplica un archivo de registros; una última línea incompleta se descarta"""
+        if not os.path.exists(ruta):
+            return
+        
+        valido = 0
+        with open(ruta, 'rb') as f:
+            for linea in f:
+                try:
+                    registro = json.loads(linea)
+                except ValueError:
+                    # Escritura cortada por una caída: el resto no es confiable
+                    print(f"⚠️  {os.path.basename(ruta)}: registro incompleto descartado")
+                    break
+                self._aplicar(registro)
+                valido += len(linea)
+        
+        if valido < os.path.getsize(ruta):
+            with open(ruta, 'r+b') as f:
+                f.truncate(valido)
+    
+    def _aplicar(self, registro):
+        """Aplica un registro al espejo (idempotente)"""
+        if registro['t'] == 'p':
+            pedido = registro['pedido']
+            if pedido['id'] in self._espejo:
+                return
+            self._espejo[pedido['id']] = pedido
+            
+            # Pedido posterior a una recarga: se suma al valor anotado
+            cantidad = pedido['cantidad_aprobada']
+            recarga = self._recargas.get(('contratos', (pedido['cliente_id'], pedido['producto_id'])))
+            if recarga:
+                recarga[0] += cantidad
+            recarga = self._recargas.get(('productos', pedido['producto_id']))
+            if recarga:
+                recarga[0] = max(0, recarga[0] - cantidad)
+        elif registro['t'] == 'r':
+            tabla = registro['tabla']
+            clave = tuple(registro['clave']) if tabla == 'contratos' else registro['clave']
+            # Una recarga ya aplicada (o una anterior) se ignora
+            if registro['n'] > self._recargas.get((tabla, clave), (None, 0))[1]:
+                self._recargas[(tabla, clave)] = [registro['valor'], registro['n'], registro.get('csv', registro['valor'])]
+        elif registro['t'] == 'l':
+            for incluido in registro['registros']:
+                self._aplicar(incluido)
+        elif registro['t'] == 'e':
+            pedido = self._espejo.get(registro['id'])
+            if pedido and len(pedido['historial_envio']) == registro['orden']:
+                pedido['estado_envio'] = registro['estado']
+                pedido['ubicacion_actual'] = registro['ubicacion']
+                pedido['historial_envio'].append(registro['historial'])
+    
+    def _copiar_pedido(self, pedido):
+        copia = dict(pedido)
+        copia['historial_envio'] = [dict(h) for h in pedido['historial_envio']]
+        return copia
+    
+    # ============================================================
+    # ESCRITURA CON GROUP COMMIT
+    # ============================================================
+    
+    @contextmanager
+    def transaccion(self):
+        """
+        Junta los registros del bloque en una sola línea, que se escribe
+        (y espera a ser durable) al salir. Se puede anidar: solo la más
+        externa escribe. Si el bloque falla no se escribe nada.
+        """
+        if getattr(self._local, 'registros', None) is not None:
+            yield
+            return
+        
+        self._local.registros = []
+        try:
+            yield
+            registros = self._local.registros
+        finally:
+            self._local.registros = None
+        
+        if len(registros) == 1:
+            self._anotar(registros[0])
+        elif registros:
+            self._anotar({'t': 'l', 'registros': registros})
+    
+    def _agregar(self, registro):
+        """Anota un registro, o lo suma a la transacción abierta del hilo"""
+        registros = getattr(self._local, 'registros', None)
+        if registros is None:
+            self._anotar(registro)
+        else:
+            registros.append(registro)
+    
+    def guardar_pedido(self, pedido):
+        """Anota una confirmación y espera a que sea durable"""
+        self._agregar({'t': 'p', 'pedido': self._copiar_pedido(pedido)})
+    
+    def _registro_cambiado(self, tabla, anterior, nuevo):
+        """
+        Observador de DataService: anota el valor que puso una recarga de
+        CSV en un contrato o producto. Los cambios de los pedidos ya están
+        en la bitácora y una baja no cambia lo que se reproduce.
+        """
+        if nuevo is None or tabla not in ('contratos', 'productos') or not self._data.en_recarga():
+            return
+        
+        self._ultima_recarga += 1
+        registro = {
+            't': 'r',
+            'tabla': tabla,
+            'clave': nuevo.clave(),
+            'valor': nuevo.card_current_amount if tabla == 'contratos' else nuevo.stock_current,
+            'n': self._ultima_recarga
+        }
+        try:
+            self._agregar(registro)
+        except OSError as e:
+            # La recarga ya se aplicó en memoria: solo se avisa
+            print(f"❌ No se pudo anotar la recarga de {tabla} {registro['clave']}: {e}")
+    
+    def guardar_estado(self, pedido):
+        """Anota el último cambio de estado de envío y espera a que sea durable"""
+        orden = len(pedido['historial_envio']) - 1
+        self._agregar({
+            't': 'e',
+            'id': pedido['id'],
+            'orden': orden,
+            'estado': pedido['estado_envio'],
+            'ubicacion': pedido['ubicacion_actual'],
+            'historial': dict(pedido['historial_envio'][orden])
+        })
+    
+    def _anotar(self, registro):
+        linea = json.dumps(registro, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+        with self._cond:
+            self._secuencia += 1
+            secuencia = self._secuencia
+            self._pendientes.append((linea, registro))
+            self._cond.notify_all()
+            
+            while self._procesado < secuencia:
+                self._cond.wait()
+            error = self._fallidos.pop(secuencia, None)
+        if error is not None:
+            raise OSError(f'No se pudo escribir la bitácora: {error}')
+    
+    def _escritor(self):
+        """Hilo que escribe los lotes pendientes con un solo fsync por lote"""
+        while True:
+            with self._cond:
+                while not self._pendientes:
+                    self._cond.wait()
+                lote = self._pendientes
+                self._pendientes = []
+                ultima = self._secuencia
+            
+            try:
+                if self._recortar:
+                    self._reabrir()
+                self._archivo.write(b''.join(linea for linea, _ in lote))
+                self._archivo.flush()
+                os.fsync(self._archivo.fileno())
+            except OSError as e:
+                # El lote se da por fallido (las secuencias de un lote son
+                # consecutivas) y se recorta antes de escribir el siguiente
+                print(f"❌ Error escribiendo la bitácora: {e}")
+                self._recortar = True
+                self.metricas['errores'] += 1
+                with self._cond:
+                    for secuencia in range(ultima - len(lote) + 1, ultima + 1):
+                        self._fallidos[secuencia] = e
+                    self._procesado = ultima
+                    self._cond.notify_all()
+                continue
+            self._tamano = self._archivo.tell()
+            
+            for _, registro in lote:
+                self._aplicar(registro)
+            
+            self.metricas['registros'] += len(lote)
+            self.metricas['fsyncs'] += 1
+            self.metricas['lote_maximo'] = max(self.metricas['lote_maximo'], len(lote))
+            
+            with self._cond:
+                self._procesado = ultima
+                self._cond.notify_all()
+            
+            self._desde_compactacion += len(lote)
+            if self._desde_compactacion >= self.compactar_cada:
+                self._compactar()
+    
+    def _reabrir(self):
+        """Descarta lo escrito después del último lote durable y reabre el archivo"""
+        try:
+            self._archivo.close()
+        except OSError:
+            pass
+        self._archivo = open(self.ruta_journal, 'ab')
+        self._archivo.truncate(self._tamano)
+        os.fsync(self._archivo.fileno())
+        self._recortar = False
+        print(f"🔧 Bitácora recortada a {self._tamano} bytes tras un error")
+    
+    # ============================================================
+    # COMPACTACIÓN
+    # ============================================================
+    
+    def _compactar(self):
+        """
+        Escribe el estado del espejo como snapshot (un registro por pedido
+        y, después, uno por valor recargado con los pedidos ya sumados) y
+        vacía la bitácora. Corre en el hilo escritor, entre lotes.
+        """
+        temporal = f'{self.ruta_snapshot}.tmp'
+        registros = [{'t': 'p', 'pedido': self._espejo[pedido_id]} for pedido_id in sorted(self._espejo)]
+        registros += [
+            {'t': 'r', 'tabla': tabla, 'clave': clave, 'valor': valor, 'n': numero, 'csv': csv}
+            for (tabla, clave), (valor, numero, csv) in self._recargas.items()
+        ]
+        try:
+            with open(temporal, 'wb') as f:
+                for registro in registros:
+                    f.write(json.dumps(registro, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporal, self.ruta_snapshot)
+            
+            self._archivo.truncate(0)
+            self._archivo.flush()
+            os.fsync(self._archivo.fileno())
+            self._tamano = 0
+        except OSError as e:
+            # Si falla, la bitácora sigue completa y se reintenta más adelante
+            print(f"⚠️  No se pudo compactar la bitácora: {e}")
+            return
+        
+        self._desde_compactacion = 0
+        self.metricas['compactaciones'] += 1
+        print(f"🗜️  Bitácora compactada: {len(self._espejo)} pedidos en snapshot")
+    
+    def obtener_metricas(self):
+        """Registros escritos, fsyncs, mayor lote, compactaciones y errores"""
+        return dict(self.metricas, pendientes=len(self._pendientes))
@@ -0,0 +1,157 @@
+"""
+Listados - Filtros por índice, paginación por cursor y proyección
+=================================================================
+Herramientas comunes de los endpoints que listan filas (pedidos,
+historial de analytics):
+
+- IndiceListado guarda, por cada campo indexado, la lista ordenada de
+  claves de las filas con cada valor. Un filtro por igualdad parte de
+  esa lista en lugar de recorrer todas las filas.
+- consultar() elige la lista más corta entre los filtros pedidos,
+  recorta el rango de claves y el cursor con bisect y recorre solo
+  hasta llenar la página; los demás filtros se comprueban sobre esas
+  candidatas.
+- El cursor es la última clave entregada, codificada como texto opaco:
+  la siguiente página empieza después de ella aunque entren filas nuevas.
+- iterar_paginas() convierte un listado paginado en un generador de
+  filas, para exportar historiales completos en streaming.
+"""
+
+import base64
+import heapq
+import json
+from bisect import bisect_left, bisect_right, insort
+
+
+class IndiceListado:
+    """Claves ordenadas por valor de cada campo indexado"""
+    
+    def __init__(self, campos):
+        self.campos = tuple(campos)
+        self._listas = {campo: {} for campo in self.campos}  # campo -> valor -> [claves]
+    
+    def agregar(self, clave, fila):
+        for campo in self.campos:
+            lista = self._listas[campo].setdefault(fila[campo], [])
+            if not lista or clave > lista[-1]:
+                lista.append(clave)  # lo normal: claves crecientes
+            else:
+                insort(lista, clave)
+    
+    def mover(self, clave, campo, anterior, nuevo):
+        """Cambia la clave de lista cuando cambia el valor de un campo indexado"""
+        lista = self._listas[campo].get(anterior)
+        if lista:
+            posicion = bisect_left(lista, clave)
+            if posicion < len(lista) and lista[posicion] == clave:
+                del lista[posicion]
+        insort(self._listas[campo].setdefault(nuevo, []), clave)
+    
+    def listas(self, campo, valores):
+        """Listas de claves de cada valor (las que no existen se omiten)"""
+        por_valor = self._listas[campo]
+        return [por_valor[valor] for valor in valores if valor in por_valor]
+    
+    def valores(self, campo):
+        """Valores del campo con al menos una clave"""
+        return [valor for valor, lista in self._listas[campo].items() if lista]
+    
+    def contar(self, campo, valor):
+        return len(self._listas[campo].get(valor, ()))
+
+
+def consultar(todas, indice, filtros, obtener, desde=None, hasta=None, cursor=None, limite=None,
+              descendente=False, condicion=None):
+    """
+    Filtra y pagina filas usando el índice.
+    - todas: secuencia ordenada con todas las claves (se usa sin filtros)
+    - filtros: {campo: (valores aceptados, ...)} sobre campos indexados
+    - obtener: clave -> fila
+    - desde/hasta: rango de claves (inclusivo)
+    - cursor: última clave de la página anterior
+    - condicion: filtro adicional por fila (sin índice), opcional
+    Devuelve (filas, siguiente_cursor); siguiente es None en la última página.
+    """
+    fuentes = {campo: indice.listas(campo, valores) for campo, valores in filtros.items()}
+    if fuentes:
+        # Se recorre el filtro con menos candidatas; el resto se comprueba por fila
+        principal = min(fuentes, key=lambda campo: sum(len(lista) for lista in fuentes[campo]))
+        listas = fuentes[principal]
+        resto = [(campo, frozenset(valores)) for campo, valores in filtros.items() if campo != principal]
+    else:
+        listas = [todas]
+        resto = []
+    
+    tramos = []
+    for lista in listas:
+        inicio = bisect_left(lista, desde) if desde is not None else 0
+        fin = bisect_right(lista, hasta) if hasta is not None else len(lista)
+        if cursor is not None:
+            if descendente:
+                fin = min(fin, bisect_left(lista, cursor))
+            else:
+                inicio = max(inicio, bisect_right(lista, cursor))
+        if inicio < fin:
+            tramos.append(_recorrer(lista, inicio, fin, descendente))
+    
+    if len(tramos) == 1:
+        claves = tramos[0]
+    else:
+        claves = heapq.merge(*tramos, reverse=descendente)
+    
+    filas = []
+    for clave in claves:
+        fila = obtener(clave)
+        if all(fila[campo] in valores for campo, valores in resto) and (condicion is None or condicion(fila)):
+            filas.append(fila)
+            if limite is not None and len(filas) >= limite:
+                return filas, clave
+    return filas, None
+
+
+def iterar_paginas(listar, tamano=500):
+    """
+    Recorre un listado completo página por página: listar(cursor, limite)
+    devuelve (filas, siguiente). La memoria queda acotada por una página y
+    entre páginas no se retiene ningún lock.
+    """
+    cursor = None
+    while True:
+        filas, cursor = listar(cursor, tamano)
+        yield from filas
+        if cursor is None:
+            return
+
+
+def _recorrer(lista, inicio, fin, descendente):
+    if descendente:
+        return (lista[i] for i in range(fin - 1, inicio - 1, -1))
+    return (lista[i] for i in range(inicio, fin))
+
+
+# ============================================================
+# CURSOR Y PROYECCIÓN
+# ============================================================
+
+def codificar_cursor(clave):
+    """Cursor opaco para la clave (None si no hay más páginas)"""
+    if clave is None:
+        return None
+    texto = json.dumps(clave, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(texto).decode('ascii').rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    """Clave de un cursor; ValueError si el cursor no es válido"""
+    try:
+        texto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        return json.loads(texto)
+    except (ValueError, TypeError):
+        raise ValueError('cursor inválido')
+
+
+def proyectar(filas, campos):
+    """Deja en cada fila solo los campos pedidos (todos si campos es None)"""
+    if not campos:
+        return filas
+    return [{campo: fila[campo] for campo in campos if campo in fila} for fila in filas]
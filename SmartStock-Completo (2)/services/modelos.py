@@ -0,0 +1,179 @@
+"""
+Modelos - Registros compactos de datos
+======================================
+Cada fila de los CSV se guarda como un objeto con __slots__ (sin dict
+por instancia) y con los nombres de columna ya normalizados.
+
+Los CSV pueden venir con nombres en inglés o en español; los alias se
+resuelven una sola vez al cargar, así los servicios leen atributos
+tipados directamente (contrato.card_current_amount, producto.stock_current).
+
+Los registros son de solo lectura: DataService los entrega sin copiarlos
+y solo él los modifica, a través de modificar().
+"""
+
+# Asignación directa al slot, saltando el bloqueo de solo lectura
+_asignar = object.__setattr__
+
+
+def modificar(registro, **campos):
+    """Modifica campos de un registro. Uso exclusivo de DataService."""
+    for campo, valor in campos.items():
+        _asignar(registro, campo, valor)
+
+
+class Registro:
+    """Base de los registros: solo lectura, conversión a dict y resolución de alias"""
+    
+    __slots__ = ()
+    
+    # Clase con los slots y el __init__ que llena los campos
+    _DATOS = None
+    
+    # Nombre canónico -> tipo de la columna (int o str)
+    CAMPOS = {}
+    # Valores por defecto si la columna no existe en el CSV
+    DEFECTOS = {}
+    # Nombre alternativo -> nombre canónico
+    ALIAS = {}
+    
+    @classmethod
+    def resolver_columnas(cls, encabezados):
+        """
+        Relaciona los encabezados de un CSV con los campos canónicos.
+        Devuelve {campo_canonico: posicion_en_csv}
+        """
+        columnas = {}
+        for posicion, encabezado in enumerate(encabezados):
+            encabezado = encabezado.strip()
+            campo = encabezado if encabezado in cls.CAMPOS else cls.ALIAS.get(encabezado)
+            if campo and campo not in columnas:
+                columnas[campo] = posicion
+        return columnas
+    
+    @classmethod
+    def valor_defecto(cls, campo):
+        """Valor que toma un campo cuando el CSV no trae su columna"""
+        return cls.DEFECTOS.get(campo, cls.CAMPOS[campo]())
+    
+    def __new__(cls, *valores):
+        # Se construye con la clase de datos (asignación normal, rápida)
+        # y después se convierte a la clase de solo lectura
+        registro = cls._DATOS(*valores)
+        registro.__class__ = cls
+        return registro
+    
+    def __init__(self, *valores):
+        pass  # los campos ya se llenaron en __new__
+    
+    def __setattr__(self, campo, valor):
+        raise AttributeError(f'{type(self).__name__} es de solo lectura; se modifica desde DataService')
+    
+    def __delattr__(self, campo):
+        raise AttributeError(f'{type(self).__name__} es de solo lectura; se modifica desde DataService')
+    
+    def clave(self):
+        """Clave primaria del registro"""
+        return self.id
+    
+    def valores(self):
+        """Tupla con los valores en el orden de CAMPOS"""
+        return tuple(getattr(self, campo) for campo in self.CAMPOS)
+    
+    def copiar(self):
+        """Copia independiente del registro"""
+        return type(self)(*self.valores())
+    
+    def a_dict(self):
+        """Devuelve una copia del registro como diccionario"""
+        return {campo: getattr(self, campo) for campo in self.CAMPOS}
+    
+    def __repr__(self):
+        return f'{type(self).__name__}({self.a_dict()})'
+
+
+class _DatosCliente:
+    __slots__ = ('id', 'name')
+    
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+
+class Cliente(Registro, _DatosCliente):
+    """Fila de tabla_clientes.csv"""
+    
+    __slots__ = ()
+    _DATOS = _DatosCliente
+    
+    CAMPOS = {'id': int, 'name': str}
+    ALIAS = {'cliente_id': 'id', 'nombre': 'name'}
+
+
+class _DatosProducto:
+    __slots__ = ('id', 'name', 'stock_current', 'stock_alert')
+    
+    def __init__(self, id, name, stock_current, stock_alert):
+        self.id = id
+        self.name = name
+        self.stock_current = stock_current
+        self.stock_alert = stock_alert
+
+
+class Producto(Registro, _DatosProducto):
+    """Fila de productos.csv"""
+    
+    __slots__ = ()
+    _DATOS = _DatosProducto
+    
+    CAMPOS = {'id': int, 'name': str, 'stock_current': int, 'stock_alert': int}
+    DEFECTOS = {'stock_alert': 50}
+    ALIAS = {
+        'producto_id': 'id',
+        'nombre': 'name',
+        'stock_actual': 'stock_current',
+        'stock_minimo': 'stock_alert'
+    }
+
+
+class _DatosContrato:
+    __slots__ = (
+        'id', 'client_id', 'product_id',
+        'card_limit_amount', 'card_current_amount', 'card_inactive_amount'
+    )
+    
+    def __init__(self, id, client_id, product_id, card_limit_amount, card_current_amount, card_inactive_amount):
+        self.id = id
+        self.client_id = client_id
+        self.product_id = product_id
+        self.card_limit_amount = card_limit_amount
+        self.card_current_amount = card_current_amount
+        self.card_inactive_amount = card_inactive_amount
+
+
+class Contrato(Registro, _DatosContrato):
+    """Fila de contratos_clientes.csv"""
+    
+    __slots__ = ()
+    _DATOS = _DatosContrato
+    
+    CAMPOS = {
+        'id': int,
+        'client_id': int,
+        'product_id': int,
+        'card_limit_amount': int,
+        'card_current_amount': int,
+        'card_inactive_amount': int
+    }
+    ALIAS = {
+        'contrato_id': 'id',
+        'cliente_id': 'client_id',
+        'producto_id': 'product_id',
+        'limite_contrato': 'card_limit_amount',
+        'tarjetas_actuales': 'card_current_amount',
+        'tarjetas_inactivas': 'card_inactive_amount'
+    }
+    
+    def clave(self):
+        """Un contrato se identifica por la combinación cliente-producto"""
+        return (self.client_id, self.product_id)
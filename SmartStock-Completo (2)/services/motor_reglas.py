@@ -4,12 +4,35 @@ MotorReglas - Motor de validación con Regla de Oro
 Versión SIN pandas
 """
 
+import threading
+from datetime import date
+
+from .cache import CacheLRU
+from .evaluador import EvaluadorContratos
+from .indice_acaparamiento import IndiceAcaparamiento
+from .reglas import ConjuntoReglas
+
 
 class MotorReglas:
     """Motor de validación de pedidos con Regla de Oro"""
     
-    def __init__(self, data_service):
+    def __init__(self, data_service, reglas=None, tamano_cache=4096):
         self.data = data_service
+        # Variantes por cliente/producto (data/reglas.json), compiladas al cargar
+        self.reglas = reglas if reglas is not None else ConjuntoReglas.cargar(data_service.data_path)
+        # Resultados de validar_pedido, sellados con la versión del contrato y del producto
+        self.cache_validaciones = CacheLRU(tamano_cache)
+        # Regla de Oro sobre todos los contratos a la vez (listados)
+        self.evaluador = EvaluadorContratos(data_service, reglas=self.reglas)
+        # Contratos ordenados por porcentaje de inactivas (acaparamiento)
+        self.acaparamiento = IndiceAcaparamiento(data_service)
+        
+        # Totales de /api/estadisticas, actualizados con cada cambio de contrato
+        self._lock_totales = threading.Lock()
+        self._totales = None
+        self._tabla_totales = None
+        self.data.registrar_observador(self._contrato_cambiado)
+        self._recalcular_totales()
     
     def validar_pedido(self, cliente_id, producto_id, cantidad):
         """
@@ -20,57 +43,214 @@ class MotorReglas:
         1. Tarjetas en uso (card_current_amount - card_inactive_amount)
         2. Espacio en contrato (card_limit_amount - card_current_amount)
         3. Stock disponible (stock_current)
+        
+        Las reglas configurables pueden tolerar parte de las inactivas
+        (se suman al uso) y poner un tope por pedido.
+        
+        El resultado se memoriza con las versiones del contrato y del
+        producto: una consulta repetida no se recalcula mientras ninguno
+        de los dos cambie. El dict devuelto puede ser compartido: no se
+        debe modificar.
         """
-        # 1. Buscar contrato
+        # Solo cantidades enteras: 5.0 y 5 comparten clave pero no respuesta
+        if type(cantidad) is not int:
+            return self._validar(cliente_id, producto_id, cantidad)
+        
+        # El sello se lee antes de evaluar: si algo cambia en medio, la
+        # entrada queda con la versión vieja y la siguiente consulta la descarta
+        clave = (cliente_id, producto_id, cantidad)
+        sello = (
+            self.data.version('contratos', (cliente_id, producto_id)),
+            self.data.version('productos', producto_id),
+            self.sello_temporada()
+        )
+        resultado = self.cache_validaciones.obtener(clave, sello)
+        if resultado is None:
+            resultado = self._validar(cliente_id, producto_id, cantidad)
+            self.cache_validaciones.guardar(clave, sello, resultado)
+        return resultado
+    
+    def sello_temporada(self):
+        """Mes actual si hay reglas por temporada (None si no hay): va en los sellos de cache"""
+        return date.today().month if self.reglas.por_temporada else None
+    
+    def _validar(self, cliente_id, producto_id, cantidad):
         contrato = self.data.obtener_contrato(cliente_id, producto_id)
+        producto = self.data.obtener_producto(producto_id)
+        return self._resultado(cantidad, self._evaluar(contrato, producto))
+    
+    def validar_lote(self, pedidos):
+        """
+        Valida muchos pedidos en una sola pasada.
+        pedidos: iterable de (cliente_id, producto_id, cantidad)
+        Devuelve los resultados en el mismo orden de entrada.
+        
+        Cada pedido se valida contra el estado actual, igual que
+        validar_pedido (el lote no descuenta stock entre sus pedidos).
+        Cada contrato y producto se busca y evalúa una sola vez aunque
+        aparezca en varios pedidos.
+        """
+        evaluaciones = {}
+        resultados = []
+        for cliente_id, producto_id, cantidad in pedidos:
+            clave = (cliente_id, producto_id)
+            evaluacion = evaluaciones.get(clave)
+            if evaluacion is None:
+                evaluacion = self._evaluar(
+                    self.data.obtener_contrato(cliente_id, producto_id),
+                    self.data.obtener_producto(producto_id)
+                )
+                evaluaciones[clave] = evaluacion
+            resultados.append(self._resultado(cantidad, evaluacion))
+        return resultados
+    
+    def asignar_lote(self, pedidos):
+        """
+        Valida un lote de pedidos y reparte entre ellos el stock escaso.
+        pedidos: lista de (cliente_id, producto_id, cantidad)
+        Devuelve los resultados en el mismo orden de entrada.
+        
+        Cada pedido pide lo que le permite la Regla de Oro sin contar el
+        stock. Si lo que pide el lote de un producto supera su stock, el
+        stock se reparte en proporción a las tarjetas en uso de cada
+        cliente, sin dar a nadie más de lo que pidió. Solo cuenta el primer
+        pedido de cada contrato; los repetidos se rechazan.
+        
+        No modifica nada: PedidosService.confirmar_lote aplica el resultado
+        con los locks del lote tomados.
+        """
+        evaluaciones = []
+        vistos = set()
+        por_producto = {}  # producto_id -> posiciones de sus pedidos válidos
+        for posicion, (cliente_id, producto_id, cantidad) in enumerate(pedidos):
+            clave = (cliente_id, producto_id)
+            if clave in vistos:
+                evaluaciones.append(('pedido_repetido', 'Este contrato ya tiene un pedido en el lote.'))
+                continue
+            vistos.add(clave)
+            
+            evaluacion = self._evaluar(
+                self.data.obtener_contrato(cliente_id, producto_id),
+                self.data.obtener_producto(producto_id)
+            )
+            evaluaciones.append(evaluacion)
+            if not isinstance(evaluacion, tuple):
+                por_producto.setdefault(producto_id, []).append(posicion)
+        
+        # Reparto por producto solo donde la demanda del lote supera el stock
+        repartos = {}  # posición -> (asignado, detalle del reparto)
+        for producto_id, posiciones in por_producto.items():
+            stock = max(0, evaluaciones[posiciones[0]]['stock_disponible'])
+            demandas = [max(0, min(pedidos[i][2], evaluaciones[i]['maximo_contrato'])) for i in posiciones]
+            if sum(demandas) <= stock:
+                continue
+            
+            pesos = [max(1, evaluaciones[i]['tarjetas_en_uso']) for i in posiciones]
+            detalle = {'stock_disponible': stock, 'demanda_total': sum(demandas), 'pedidos': len(posiciones)}
+            for i, asignado in zip(posiciones, _repartir(stock, demandas, pesos)):
+                repartos[i] = (asignado, detalle)
+        
+        resultados = []
+        for posicion, (_, _, cantidad) in enumerate(pedidos):
+            resultado = self._resultado(cantidad, evaluaciones[posicion])
+            if posicion in repartos:
+                asignado, detalle = repartos[posicion]
+                resultado['detalles']['reparto'] = dict(detalle, asignado=asignado)
+                if asignado < resultado['cantidad_aprobada']:
+                    resultado.update(
+                        estado='aprobado_parcial' if asignado > 0 else 'rechazado',
+                        cantidad_aprobada=asignado,
+                        razon='reparto_stock',
+                        mensaje=f'El stock no alcanza para todos los pedidos de este producto y se repartió en proporción a las tarjetas en uso. Se aprobaron {asignado:,}.'
+                    )
+            resultados.append(resultado)
+        return resultados
+    
+    def _evaluar(self, contrato, producto):
+        """
+        Calcula las métricas de la Regla de Oro de un contrato-producto
+        (no dependen de la cantidad pedida). Devuelve una tupla con la
+        razón de rechazo si falta el contrato o el producto.
+        """
         if not contrato:
-            return {
-                'estado': 'rechazado',
-                'cantidad_solicitada': cantidad,
-                'cantidad_aprobada': 0,
-                'mensaje': 'No existe un contrato para esta combinación de cliente y producto.',
-                'razon': 'sin_contrato'
-            }
+            return ('sin_contrato', 'No existe un contrato para esta combinación de cliente y producto.')
         
-        # 2. Buscar producto (para stock)
-        producto = self.data.obtener_producto(producto_id)
         if not producto:
-            return {
-                'estado': 'rechazado',
-                'cantidad_solicitada': cantidad,
-                'cantidad_aprobada': 0,
-                'mensaje': 'Producto no encontrado.',
-                'razon': 'producto_invalido'
-            }
+            return ('producto_invalido', 'Producto no encontrado.')
         
-        # 3. Extraer valores del contrato (soporta ambos nombres de columnas)
-        limite_contrato = int(contrato.get('card_limit_amount', contrato.get('limite_contrato', 0)))
-        tarjetas_actuales = int(contrato.get('card_current_amount', contrato.get('tarjetas_actuales', 0)))
-        tarjetas_inactivas = int(contrato.get('card_inactive_amount', contrato.get('tarjetas_inactivas', 0)))
-        stock_disponible = int(producto.get('stock_current', producto.get('stock_actual', 0)))
+        # Valores del contrato (columnas ya normalizadas al cargar)
+        limite_contrato = contrato.card_limit_amount
+        tarjetas_actuales = contrato.card_current_amount
+        tarjetas_inactivas = contrato.card_inactive_amount
+        stock_disponible = producto.stock_current
         
-        # 4. Calcular métricas
+        # Métricas
         tarjetas_en_uso = tarjetas_actuales - tarjetas_inactivas
         espacio_contrato = limite_contrato - tarjetas_actuales
         porcentaje_inactivas = round((tarjetas_inactivas / tarjetas_actuales * 100), 1) if tarjetas_actuales > 0 else 0
         
-        # 5. APLICAR REGLA DE ORO
-        maximo_autorizable = min(tarjetas_en_uso, espacio_contrato, stock_disponible)
+        # Reglas configurables del cliente-producto (None si no aplica ninguna)
+        reglas = None
+        uso_permitido = tarjetas_en_uso
+        if self.reglas:
+            reglas = self.reglas.ajustar(contrato.client_id, contrato.product_id, tarjetas_actuales, tarjetas_inactivas)
+            if reglas:
+                uso_permitido += reglas['inactivas_toleradas']
+        
+        # APLICAR REGLA DE ORO (primero lo que permite el contrato, luego el stock)
+        maximo_contrato = min(uso_permitido, espacio_contrato)
+        if reglas and reglas['tope_pedido'] is not None:
+            maximo_contrato = min(maximo_contrato, reglas['tope_pedido'])
+        maximo_autorizable = min(maximo_contrato, stock_disponible)
         if maximo_autorizable < 0:
             maximo_autorizable = 0
         
-        # 6. Construir detalles
+        return {
+            'limite_contrato': limite_contrato,
+            'tarjetas_actuales': tarjetas_actuales,
+            'tarjetas_inactivas': tarjetas_inactivas,
+            'tarjetas_en_uso': tarjetas_en_uso,
+            'espacio_contrato': espacio_contrato,
+            'stock_disponible': stock_disponible,
+            'stock_alerta': producto.stock_alert,
+            'porcentaje_inactivas': porcentaje_inactivas,
+            'maximo_autorizable': maximo_autorizable,
+            'maximo_contrato': max(0, maximo_contrato),
+            'reglas': reglas
+        }
+    
+    def _resultado(self, cantidad, evaluacion):
+        """Construye la respuesta de validación para una cantidad pedida"""
+        if isinstance(evaluacion, tuple):
+            razon, mensaje = evaluacion
+            return {
+                'estado': 'rechazado',
+                'cantidad_solicitada': cantidad,
+                'cantidad_aprobada': 0,
+                'mensaje': mensaje,
+                'razon': razon
+            }
+        
+        tarjetas_inactivas = evaluacion['tarjetas_inactivas']
+        espacio_contrato = evaluacion['espacio_contrato']
+        stock_disponible = evaluacion['stock_disponible']
+        porcentaje_inactivas = evaluacion['porcentaje_inactivas']
+        maximo_autorizable = evaluacion['maximo_autorizable']
+        reglas = evaluacion['reglas']
+        tope_pedido = reglas['tope_pedido'] if reglas else None
+        
+        # Construir detalles
         detalles = {
             'contrato': {
-                'limite_contrato': limite_contrato,
-                'tarjetas_actuales': tarjetas_actuales,
+                'limite_contrato': evaluacion['limite_contrato'],
+                'tarjetas_actuales': evaluacion['tarjetas_actuales'],
                 'tarjetas_inactivas': tarjetas_inactivas,
-                'tarjetas_en_uso': tarjetas_en_uso,
+                'tarjetas_en_uso': evaluacion['tarjetas_en_uso'],
                 'espacio_contrato': espacio_contrato
             },
             'inventario': {
                 'stock_actual': stock_disponible,
-                'stock_alerta': int(producto.get('stock_alert', producto.get('stock_minimo', 0)))
+                'stock_alerta': evaluacion['stock_alerta']
             },
             'regla_oro': {
                 'aplicada': porcentaje_inactivas > 0,
@@ -78,8 +258,10 @@ class MotorReglas:
                 'porcentaje_inactivas': porcentaje_inactivas
             }
         }
+        if reglas:
+            detalles['reglas'] = reglas
         
-        # 7. Determinar resultado
+        # Determinar resultado
         
         # CASO: No se puede aprobar nada
         if maximo_autorizable <= 0:
@@ -89,6 +271,9 @@ class MotorReglas:
             elif stock_disponible <= 0:
                 razon = 'sin_stock'
                 mensaje = 'No hay stock disponible para este producto.'
+            elif tope_pedido is not None and tope_pedido <= 0:
+                razon = 'tope_pedido'
+                mensaje = 'Por ahora este producto no admite pedidos.'
             else:
                 razon = 'regla_oro'
                 mensaje = f'Tienes {tarjetas_inactivas:,} tarjetas sin usar ({porcentaje_inactivas}%). Según la Regla de Oro, debes activar tus tarjetas actuales antes de solicitar más.'
@@ -120,6 +305,12 @@ class MotorReglas:
         elif cantidad > espacio_contrato and espacio_contrato < maximo_autorizable:
             razon = 'limite_contrato'
             mensaje = f'Tu contrato solo permite {espacio_contrato:,} tarjetas más. Se aprobaron {maximo_autorizable:,}.'
+        elif tope_pedido == maximo_autorizable:
+            razon = 'tope_pedido'
+            mensaje = f'Los pedidos de este producto tienen un tope de {tope_pedido:,} tarjetas. Se aprobaron {maximo_autorizable:,}.'
+        elif reglas and reglas['inactivas_toleradas']:
+            razon = 'regla_oro'
+            mensaje = f'Tienes {tarjetas_inactivas:,} tarjetas sin usar ({porcentaje_inactivas}%). Según la Regla de Oro, solo puedes pedir hasta {maximo_autorizable:,} tarjetas (las que tienes en uso más {reglas["inactivas_toleradas"]:,} inactivas toleradas).'
         else:
             razon = 'regla_oro'
             mensaje = f'Tienes {tarjetas_inactivas:,} tarjetas sin usar ({porcentaje_inactivas}%). Según la Regla de Oro, solo puedes pedir hasta {maximo_autorizable:,} tarjetas (igual a las que tienes en uso).'
@@ -133,9 +324,67 @@ class MotorReglas:
             'detalles': detalles
         }
     
+    def obtener_metricas_reglas(self):
+        """Evaluaciones y tiempo acumulado de cada regla configurable"""
+        return self.reglas.obtener_metricas()
+    
+    def obtener_metricas_cache(self):
+        """Aciertos y fallos de la cache de validaciones"""
+        return self.cache_validaciones.obtener_metricas()
+    
+    # ============================================================
+    # ESTADÍSTICAS (agregados mantenidos en O(1) por cambio)
+    # ============================================================
+    
+    def _recalcular_totales(self):
+        """Suma completa de los contratos (al arrancar y después de una recarga)"""
+        with self.data.congelar(), self._lock_totales:
+            contratos = self.data.obtener_todos_contratos()
+            total_tarjetas = 0
+            total_inactivas = 0
+            contratos_problematicos = 0
+            
+            for c in contratos:
+                actuales = c.card_current_amount
+                inactivas = c.card_inactive_amount
+                total_tarjetas += actuales
+                total_inactivas += inactivas
+                contratos_problematicos += self._es_problematico(actuales, inactivas)
+            
+            self._totales = {
+                'total_tarjetas': total_tarjetas,
+                'total_inactivas': total_inactivas,
+                'contratos_problematicos': contratos_problematicos
+            }
+            self._tabla_totales = contratos
+    
+    @staticmethod
+    def _es_problematico(actuales, inactivas):
+        return 1 if actuales > 0 and (inactivas / actuales * 100) > 50 else 0
+    
+    def _contrato_cambiado(self, tabla, anterior, nuevo):
+        """Observador de DataService: aplica al total la diferencia del contrato"""
+        if tabla != 'contratos':
+            return
+        with self._lock_totales:
+            if self._tabla_totales is not self.data.obtener_todos_contratos():
+                return  # la tabla se reemplazó: se recalcula en la próxima consulta
+            totales = self._totales
+            for registro, signo in ((anterior, -1), (nuevo, 1)):
+                if registro is None:
+                    continue
+                actuales = registro.card_current_amount
+                inactivas = registro.card_inactive_amount
+                totales['total_tarjetas'] += signo * actuales
+                totales['total_inactivas'] += signo * inactivas
+                totales['contratos_problematicos'] += signo * self._es_problematico(actuales, inactivas)
+    
     def obtener_estadisticas(self):
         """Calcula estadísticas generales del sistema"""
-        contratos = self.data.contratos
+        contratos = self.data.obtener_todos_contratos()
+        if self._tabla_totales is not contratos:
+            self._recalcular_totales()
+            contratos = self._tabla_totales
         
         if not contratos:
             return {
@@ -151,18 +400,10 @@ class MotorReglas:
                 'desperdicio_estimado_mxn': 0
             }
         
-        total_tarjetas = 0
-        total_inactivas = 0
-        contratos_problematicos = 0
-        
-        for c in contratos:
-            actuales = int(c.get('card_current_amount', c.get('tarjetas_actuales', 0)))
-            inactivas = int(c.get('card_inactive_amount', c.get('tarjetas_inactivas', 0)))
-            total_tarjetas += actuales
-            total_inactivas += inactivas
-            
-            if actuales > 0 and (inactivas / actuales * 100) > 50:
-                contratos_problematicos += 1
+        with self._lock_totales:
+            total_tarjetas = self._totales['total_tarjetas']
+            total_inactivas = self._totales['total_inactivas']
+            contratos_problematicos = self._totales['contratos_problematicos']
         
         total_en_uso = total_tarjetas - total_inactivas
         
@@ -173,124 +414,141 @@ class MotorReglas:
             'porcentaje_uso': round(total_en_uso / total_tarjetas * 100, 1) if total_tarjetas > 0 else 0,
             'porcentaje_inactivas': round(total_inactivas / total_tarjetas * 100, 1) if total_tarjetas > 0 else 0,
             'total_contratos': len(contratos),
-            'total_clientes': len(self.data.clientes),
+            'total_clientes': len(self.data.obtener_clientes()),
             'contratos_problematicos': contratos_problematicos,
             'total_tarjetas_circulacion': total_tarjetas,
             'desperdicio_estimado_mxn': total_inactivas * 50
         }
     
-    def detectar_acaparamiento(self, umbral=50):
-        """Detecta contratos con alto porcentaje de tarjetas inactivas"""
-        contratos = self.data.contratos
-        
-        if not contratos:
-            return {'total_problematicos': 0, 'umbral_usado': umbral, 'contratos': []}
+    def detectar_acaparamiento(self, umbral=50, desplazamiento=0, limite=None):
+        """
+        Detecta contratos con alto porcentaje de tarjetas inactivas.
+        desplazamiento/limite devuelven solo un tramo del resultado
+        (limite sin desplazamiento = los N contratos con más inactivas).
+        """
+        total, tramo = self.acaparamiento.consultar(umbral, desplazamiento, limite)
         
         resultado = []
+        for c, porcentaje in tramo:
+            resultado.append({
+                'contrato_id': c.id,
+                'cliente_id': c.client_id,
+                'cliente_nombre': self.data.obtener_nombre_cliente(c.client_id),
+                'producto_id': c.product_id,
+                'producto_nombre': self.data.obtener_nombre_producto(c.product_id),
+                'tarjetas_totales': c.card_current_amount,
+                'tarjetas_inactivas': c.card_inactive_amount,
+                'tarjetas_en_uso': c.card_current_amount - c.card_inactive_amount,
+                'porcentaje_inactivas': porcentaje
+            })
         
-        for c in contratos:
-            cliente_id = int(c.get('client_id', c.get('cliente_id', 0)))
-            producto_id = int(c.get('product_id', c.get('producto_id', 0)))
-            tarjetas_actuales = int(c.get('card_current_amount', c.get('tarjetas_actuales', 0)))
-            tarjetas_inactivas = int(c.get('card_inactive_amount', c.get('tarjetas_inactivas', 0)))
-            
-            if tarjetas_actuales <= 0:
-                continue
-            
-            pct = tarjetas_inactivas / tarjetas_actuales * 100
-            
-            if pct > umbral:
-                resultado.append({
-                    'contrato_id': int(c.get('id', 0)),
-                    'cliente_id': cliente_id,
-                    'cliente_nombre': self.data.obtener_nombre_cliente(cliente_id),
-                    'producto_id': producto_id,
-                    'producto_nombre': self.data.obtener_nombre_producto(producto_id),
-                    'tarjetas_totales': tarjetas_actuales,
-                    'tarjetas_inactivas': tarjetas_inactivas,
-                    'tarjetas_en_uso': tarjetas_actuales - tarjetas_inactivas,
-                    'porcentaje_inactivas': round(pct, 1)
-                })
-        
-        resultado.sort(key=lambda x: x['porcentaje_inactivas'], reverse=True)
-        
-        return {
-            'total_problematicos': len(resultado),
+        respuesta = {
+            'total_problematicos': total,
             'umbral_usado': umbral,
             'contratos': resultado
         }
+        if desplazamiento or limite is not None:
+            respuesta['desplazamiento'] = desplazamiento
+            respuesta['limite'] = limite
+        return respuesta
     
     def obtener_todos_contratos(self):
         """Obtiene todos los contratos con información detallada"""
-        contratos = self.data.contratos
-        
-        if not contratos:
-            return []
+        return self.listar_contratos()[0]
+    
+    def listar_contratos(self, cliente_id=None, producto_id=None, despues_de=None, limite=None):
+        """
+        Contratos con información detallada, de más a menos inactivas.
+        Filtra por cliente y/o producto y pagina con despues_de
+        ((porcentaje, id) del último contrato entregado) y limite.
+        Devuelve (contratos, cursor de la siguiente página o None).
+        """
+        filas = self.evaluador.evaluar(
+            ('id', 'cliente_id', 'cliente_nombre', 'producto_id', 'producto_nombre', 'limite',
+             'actuales', 'inactivas', 'en_uso', 'porcentaje_inactivas', 'maximo_pedido'),
+            ordenar=True,
+            cliente_id=cliente_id,
+            producto_id=producto_id,
+            despues_de=despues_de,
+            limite=limite
+        )
         
-        resultado = []
+        siguiente = None
+        if filas and len(filas) == limite:
+            siguiente = (filas[-1][9], filas[-1][0])
         
-        for c in contratos:
-            cliente_id = int(c.get('client_id', c.get('cliente_id', 0)))
-            producto_id = int(c.get('product_id', c.get('producto_id', 0)))
-            
-            tarjetas_actuales = int(c.get('card_current_amount', c.get('tarjetas_actuales', 0)))
-            tarjetas_inactivas = int(c.get('card_inactive_amount', c.get('tarjetas_inactivas', 0)))
-            tarjetas_en_uso = tarjetas_actuales - tarjetas_inactivas
-            limite = int(c.get('card_limit_amount', c.get('limite_contrato', 0)))
-            espacio = limite - tarjetas_actuales
-            
-            producto = self.data.obtener_producto(producto_id)
-            stock = int(producto.get('stock_current', producto.get('stock_actual', 0))) if producto else 0
-            
-            maximo_pedido = max(0, min(tarjetas_en_uso, espacio, stock))
-            porcentaje = round(tarjetas_inactivas / tarjetas_actuales * 100, 1) if tarjetas_actuales > 0 else 0
-            
-            resultado.append({
-                'id': int(c.get('id', 0)),
+        contratos = [
+            {
+                'id': contrato_id,
                 'cliente_id': cliente_id,
-                'cliente_nombre': self.data.obtener_nombre_cliente(cliente_id),
+                'cliente_nombre': cliente_nombre,
                 'producto_id': producto_id,
-                'producto_nombre': self.data.obtener_nombre_producto(producto_id),
-                'limite_contrato': limite,
-                'tarjetas_actuales': tarjetas_actuales,
-                'tarjetas_inactivas': tarjetas_inactivas,
-                'tarjetas_en_uso': tarjetas_en_uso,
+                'producto_nombre': producto_nombre,
+                'limite_contrato': limite_contrato,
+                'tarjetas_actuales': actuales,
+                'tarjetas_inactivas': inactivas,
+                'tarjetas_en_uso': en_uso,
                 'porcentaje_inactivas': porcentaje,
-                'maximo_pedido': maximo_pedido
-            })
-        
-        resultado.sort(key=lambda x: x['porcentaje_inactivas'], reverse=True)
-        return resultado
+                'maximo_pedido': maximo
+            }
+            for contrato_id, cliente_id, cliente_nombre, producto_id, producto_nombre, limite_contrato,
+                actuales, inactivas, en_uso, porcentaje, maximo in filas
+        ]
+        return contratos, siguiente
     
     def obtener_contratos_cliente(self, cliente_id):
         """Obtiene los contratos de un cliente con máximo pedido calculado"""
-        contratos = self.data.obtener_contratos_cliente(cliente_id)
+        filas = self.evaluador.evaluar(
+            ('producto_id', 'producto_nombre', 'limite', 'actuales', 'inactivas',
+             'en_uso', 'porcentaje_inactivas', 'maximo_pedido'),
+            cliente_id=cliente_id
+        )
         
-        resultado = []
-        for c in contratos:
-            producto_id = int(c.get('product_id', c.get('producto_id', 0)))
-            
-            tarjetas_actuales = int(c.get('card_current_amount', c.get('tarjetas_actuales', 0)))
-            tarjetas_inactivas = int(c.get('card_inactive_amount', c.get('tarjetas_inactivas', 0)))
-            tarjetas_en_uso = tarjetas_actuales - tarjetas_inactivas
-            limite = int(c.get('card_limit_amount', c.get('limite_contrato', 0)))
-            espacio = limite - tarjetas_actuales
-            
-            producto = self.data.obtener_producto(producto_id)
-            stock = int(producto.get('stock_current', producto.get('stock_actual', 0))) if producto else 0
-            
-            maximo_pedido = max(0, min(tarjetas_en_uso, espacio, stock))
-            porcentaje = round(tarjetas_inactivas / tarjetas_actuales * 100, 1) if tarjetas_actuales > 0 else 0
-            
-            resultado.append({
+        return [
+            {
                 'producto_id': producto_id,
-                'producto_nombre': self.data.obtener_nombre_producto(producto_id),
+                'producto_nombre': producto_nombre,
                 'limite_contrato': limite,
-                'tarjetas_actuales': tarjetas_actuales,
-                'tarjetas_inactivas': tarjetas_inactivas,
-                'tarjetas_en_uso': tarjetas_en_uso,
+                'tarjetas_actuales': actuales,
+                'tarjetas_inactivas': inactivas,
+                'tarjetas_en_uso': en_uso,
                 'porcentaje_inactivas': porcentaje,
-                'maximo_pedido': maximo_pedido
-            })
+                'maximo_pedido': maximo
+            }
+            for producto_id, producto_nombre, limite, actuales, inactivas, en_uso, porcentaje, maximo in filas
+        ]
+
+
+def _repartir(stock, demandas, pesos):
+    """
+    Reparte `stock` unidades en proporción a `pesos` sin dar a nadie más
+    que su demanda (water-filling): quien pide menos que su parte recibe
+    lo que pidió y lo que deja se reparte entre los demás.
+    Devuelve enteros que suman min(stock, sum(demandas)).
+    """
+    # De menor a mayor demanda por unidad de peso: los primeros son los
+    # que pueden quedar satisfechos
+    orden = sorted(range(len(demandas)), key=lambda i: demandas[i] / pesos[i])
+    partes = [0] * len(demandas)
+    restante = stock
+    peso_restante = sum(pesos)
+    
+    for posicion, i in enumerate(orden):
+        # demanda <= parte proporcional del stock restante (en enteros, sin redondeo)
+        if demandas[i] * peso_restante <= restante * pesos[i]:
+            partes[i] = demandas[i]
+            restante -= demandas[i]
+            peso_restante -= pesos[i]
+            continue
         
-        return resultado
+        # Los que quedan piden más que su parte: reparto proporcional del resto,
+        # y las unidades que sobran al redondear van a los residuos mayores
+        pendientes = orden[posicion:]
+        for j in pendientes:
+            partes[j] = restante * pesos[j] // peso_restante
+        sobrante = restante - sum(partes[j] for j in pendientes)
+        for j in sorted(pendientes, key=lambda j: (-(restante * pesos[j] % peso_restante), j))[:sobrante]:
+            partes[j] += 1
+        break
+    
+    return partes
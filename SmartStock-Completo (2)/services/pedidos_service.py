@@ -4,27 +4,114 @@ PedidosService - Servicio de gestión de pedidos
 IMPORTANTE: Cuando se confirma un pedido:
 1. Se actualiza el contrato (aumenta card_current_amount)
 2. Se actualiza el inventario (disminuye stock_current)
+
+Con un almacén persistente (AlmacenSQLite) los pedidos y su historial
+sobreviven reinicios; sin almacén todo vive en memoria. Con varios
+procesos, una SecuenciaIds compartida entrega los ids (y con ellos los
+trackings) sin repetirlos.
+
+Concurrencia: validar y guardar un pedido ocurre con los locks del
+contrato y del producto tomados (DataService.bloquear), así dos pedidos
+sobre el mismo producto no pueden sobrevender el stock, y los pedidos
+sobre productos distintos se confirman en paralelo. Un lote
+(confirmar_lote) toma a la vez los locks de todos sus contratos y
+productos y se guarda en una sola transacción. La memoria (contrato,
+inventario e índices) cambia solo después de que la transacción se
+guardó: si falla, no queda nada a medias.
+
+Con un almacén compartido entre procesos (AlmacenSQLite.compartido) la
+validación se hace dentro de la transacción, con el contrato y el stock
+leídos de la base, y lo que guardan los otros procesos (pedidos y
+cambios de estado) se trae a memoria con refrescar(). Si al guardar el
+stock de la base ya no alcanza (StockInsuficiente), el pedido se
+rechaza como sin_stock.
 """
 
+import itertools
+import re
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from contextlib import nullcontext
 from datetime import datetime
 
+from .almacen_sqlite import StockInsuficiente
+from .listados import IndiceListado, consultar, iterar_paginas
+
+# Campos de los pedidos con índice para los filtros de listar()
+CAMPOS_INDEXADOS = ('cliente_id', 'producto_id', 'estado_envio')
+
+# Formato de _generar_tracking (ya en mayúsculas): SS-AAAAMMDD-NNNN
+FORMATO_TRACKING = re.compile(r'SS-\d{8}-\d{4,}')
+
 
 class PedidosService:
     """Servicio para gestionar pedidos con contabilización"""
     
-    def __init__(self, data_service, motor_reglas):
+    def __init__(self, data_service, motor_reglas, almacen=None, secuencia=None, intervalo_refresco=1.0):
         self.data = data_service
         self.motor = motor_reglas
+        self.almacen = almacen
+        self._compartido = bool(almacen is not None and almacen.compartido)
+        
+        restaurados = self.almacen.restaurar(self.data) if self.almacen else []
         
-        # Almacenamiento en memoria
+        # Ids: de la secuencia compartida entre procesos, o un contador local.
+        # El id y la fecha de un pedido se toman juntos bajo este lock: así
+        # en este proceso la fecha nunca retrocede al avanzar el id y un
+        # rango de fechas es un rango de ids
+        primero = max((p['id'] for p in restaurados), default=0) + 1
+        if secuencia is not None:
+            secuencia.asegurar_minimo(primero)
+            self._siguiente_id = secuencia.siguiente
+        else:
+            self._siguiente_id = itertools.count(primero).__next__
+        self._lock_ids = threading.Lock()
+        
+        # Almacenamiento en memoria, en orden de id, con índices:
+        # - _claves/_fechas: ids en orden con su fecha al lado
+        # - _indice: cubetas de ids por cliente, producto y estado de envío
+        #   (en proceso, entregados y sus conteos salen de estas cubetas)
+        # - _por_dia: pedidos por día (YYYY-MM-DD), para las estadísticas
+        # - búsquedas directas: id -> pedido y tracking en mayúsculas -> pedido
+        self._lock_listados = threading.Lock()
         self.pedidos = []
-        self.contador = 0
+        self._por_id = {}
+        self._por_tracking = {}
+        # Si algún tracking guardado no sigue FORMATO_TRACKING no se usa el
+        # descarte por formato (se busca siempre en el índice)
+        self._trackings_con_formato = True
+        self._claves = []
+        self._fechas = []
+        self._por_dia = Counter()
+        # Pedidos restaurados de otros procesos pueden tener un id mayor y
+        # una fecha anterior; entonces el rango de fechas se comprueba por fila
+        self._fechas_ordenadas = True
+        self._indice = IndiceListado(CAMPOS_INDEXADOS)
+        for pedido in restaurados:
+            self._indexar(pedido)
+        
+        # Comprobar y aplicar un cambio de estado de envío (TrackingService)
+        # ocurre con este lock: dos cambios del mismo pedido no se cruzan.
+        # También lo toma refrescar(); se toma antes que los demás locks
+        self.lock_estados = threading.RLock()
+        
+        if self._compartido:
+            hilo = threading.Thread(
+                target=self._refrescar_periodicamente, args=(intervalo_refresco,),
+                name='refresco-pedidos', daemon=True
+            )
+            hilo.start()
+    
+    def transaccion(self):
+        """Transacción del almacén (o un contexto vacío si no hay almacén)"""
+        return self.almacen.transaccion() if self.almacen else nullcontext()
     
-    def _generar_tracking(self):
-        """Genera un número de tracking único"""
-        self.contador += 1
+    def _generar_tracking(self, pedido_id):
+        """Genera el número de tracking de un pedido (único porque el id lo es)"""
         fecha = datetime.now().strftime('%Y%m%d')
-        return f'SS-{fecha}-{self.contador:04d}'
+        return f'SS-{fecha}-{pedido_id:04d}'
     
     def confirmar_pedido(self, cliente_id, producto_id, cantidad):
         """
@@ -34,30 +121,103 @@ class PedidosService:
         3. Actualiza el inventario (menos stock)
         4. Registra el pedido
         """
-        # 1. Validar primero
-        validacion = self.motor.validar_pedido(cliente_id, producto_id, cantidad)
+        contratos = [(cliente_id, producto_id)]
+        productos = [producto_id]
         
-        if validacion['cantidad_aprobada'] <= 0:
-            return {
-                'success': False,
-                'mensaje': 'Pedido rechazado',
-                'resultado': validacion
-            }
+        # Validar y aplicar sin que otro pedido cambie el contrato o el stock en medio
+        with self.data.bloquear(contratos=contratos, productos=productos):
+            # Contrato, stock y pedido se guardan en una sola transacción
+            with self.transaccion():
+                self._sincronizar(contratos, productos)
+                
+                # 1. Validar primero
+                validacion = self.motor.validar_pedido(cliente_id, producto_id, cantidad)
+                
+                if validacion['cantidad_aprobada'] <= 0:
+                    return {
+                        'success': False,
+                        'mensaje': 'Pedido rechazado',
+                        'resultado': validacion
+                    }
+                
+                cantidad_aprobada = validacion['cantidad_aprobada']
+                try:
+                    pedido = self._registrar_pedido(cliente_id, producto_id, cantidad, validacion)
+                except StockInsuficiente as e:
+                    return self._rechazo_sin_stock(cantidad, e)
+            
+            # 2-4. Guardado: contrato, inventario e índices en memoria
+            self._aplicar_pedidos([pedido])
         
-        cantidad_aprobada = validacion['cantidad_aprobada']
+        print(f"✅ Pedido confirmado: {pedido['tracking']} - {cantidad_aprobada} tarjetas para {pedido['cliente_nombre']}")
+        
+        return {
+            'success': True,
+            'mensaje': f'Pedido confirmado con tracking {pedido["tracking"]}',
+            'pedido': pedido
+        }
+    
+    def confirmar_lote(self, pedidos):
+        """
+        Confirma un lote de pedidos (cliente_id, producto_id, cantidad):
+        1. Toma los locks de todos los contratos y productos del lote
+        2. Valida todos y reparte el stock escaso (MotorReglas.asignar_lote)
+        3. Guarda contratos, inventario y pedidos en una sola transacción
+        4. Aplica en memoria los pedidos guardados
+        Devuelve un resultado por pedido, en el mismo orden.
+        """
+        contratos = [(cliente_id, producto_id) for cliente_id, producto_id, _ in pedidos]
+        productos = [producto_id for _, producto_id, _ in pedidos]
         
-        # 2. ACTUALIZAR CONTRATO (agregar tarjetas al cliente)
-        self.data.actualizar_contrato_despues_pedido(cliente_id, producto_id, cantidad_aprobada)
+        resultados = []
+        confirmados = []
+        with self.data.bloquear(contratos=contratos, productos=productos):
+            with self.transaccion():
+                self._sincronizar(contratos, set(productos))
+                validaciones = self.motor.asignar_lote(pedidos)
+                
+                for (cliente_id, producto_id, cantidad), validacion in zip(pedidos, validaciones):
+                    if validacion['cantidad_aprobada'] <= 0:
+                        resultados.append({
+                            'success': False,
+                            'mensaje': 'Pedido rechazado',
+                            'resultado': validacion
+                        })
+                        continue
+                    
+                    try:
+                        pedido = self._registrar_pedido(cliente_id, producto_id, cantidad, validacion)
+                    except StockInsuficiente as e:
+                        resultados.append(self._rechazo_sin_stock(cantidad, e))
+                        continue
+                    confirmados.append(pedido)
+                    resultados.append({
+                        'success': True,
+                        'mensaje': f'Pedido confirmado con tracking {pedido["tracking"]}',
+                        'pedido': pedido
+                    })
+            
+            self._aplicar_pedidos(confirmados)
         
-        # 3. ACTUALIZAR INVENTARIO (restar stock)
-        self.data.actualizar_stock_producto(producto_id, cantidad_aprobada)
+        print(f"✅ Lote confirmado: {len(confirmados)} de {len(pedidos)} pedidos")
+        return resultados
+    
+    def _registrar_pedido(self, cliente_id, producto_id, cantidad, validacion):
+        """
+        Crea el registro de un pedido ya validado y lo guarda en el almacén
+        (que aplica contrato e inventario en la misma transacción). La
+        memoria no cambia aquí: ver _aplicar_pedidos.
+        El llamador debe tener tomados los locks del contrato y del producto.
+        """
+        cantidad_aprobada = validacion['cantidad_aprobada']
         
-        # 4. Crear registro del pedido
-        tracking = self._generar_tracking()
-        fecha_actual = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock_ids:
+            pedido_id = self._siguiente_id()
+            fecha_actual = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        tracking = self._generar_tracking(pedido_id)
         
         pedido = {
-            'id': self.contador,
+            'id': pedido_id,
             'tracking': tracking,
             'fecha': fecha_actual,
             'cliente_id': cliente_id,
@@ -84,47 +244,222 @@ class PedidosService:
             ]
         }
         
-        self.pedidos.append(pedido)
-        
-        print(f"✅ Pedido confirmado: {tracking} - {cantidad_aprobada} tarjetas para {self.data.obtener_nombre_cliente(cliente_id)}")
+        if self.almacen:
+            self.almacen.guardar_pedido(pedido)
         
+        return pedido
+    
+    def _rechazo_sin_stock(self, cantidad, error):
+        """
+        Rechazo de un pedido validado cuyo stock no alcanzó al guardarlo
+        (StockInsuficiente del almacén: no se escribió nada del pedido)
+        """
+        print(f"⚠️  Pedido rechazado al guardar: {error}")
         return {
-            'success': True,
-            'mensaje': f'Pedido confirmado con tracking {tracking}',
-            'pedido': pedido
+            'success': False,
+            'mensaje': 'Pedido rechazado',
+            'resultado': {
+                'estado': 'rechazado',
+                'cantidad_solicitada': cantidad,
+                'cantidad_aprobada': 0,
+                'mensaje': 'No hay stock disponible para este producto.',
+                'razon': 'sin_stock'
+            }
         }
     
+    def _sincronizar(self, contratos, productos):
+        """Con almacén compartido, trae de la base el contrato y el stock a validar"""
+        if self._compartido:
+            self.almacen.sincronizar(self.data, contratos, productos)
+    
+    def _aplicar_pedidos(self, pedidos):
+        """
+        Lleva a memoria pedidos ya guardados: contrato (más tarjetas),
+        inventario (menos stock) e índices.
+        El llamador debe tener tomados los locks de sus contratos y productos.
+        """
+        if self._compartido:
+            # La base ya tiene los valores nuevos: se leen de ahí
+            self.almacen.sincronizar(
+                self.data,
+                [(p['cliente_id'], p['producto_id']) for p in pedidos],
+                {p['producto_id'] for p in pedidos}
+            )
+        else:
+            for pedido in pedidos:
+                self.data.actualizar_contrato_despues_pedido(pedido['cliente_id'], pedido['producto_id'], pedido['cantidad_aprobada'])
+                self.data.actualizar_stock_producto(pedido['producto_id'], pedido['cantidad_aprobada'])
+        
+        with self._lock_listados:
+            for pedido in pedidos:
+                self._indexar(pedido)
+    
+    def _indexar(self, pedido):
+        """Agrega un pedido a los índices (con _lock_listados tomado)"""
+        pedido_id = pedido['id']
+        if pedido_id in self._por_id:
+            return  # ya lo trajo refrescar()
+        if self._claves and pedido_id < self._claves[-1]:
+            # Otro pedido concurrente se indexó antes con un id mayor
+            posicion = bisect_left(self._claves, pedido_id)
+        else:
+            posicion = len(self._claves)
+        fecha = pedido['fecha']
+        if (posicion > 0 and self._fechas[posicion - 1] > fecha) or (
+            posicion < len(self._fechas) and self._fechas[posicion] < fecha
+        ):
+            self._fechas_ordenadas = False
+        self.pedidos.insert(posicion, pedido)
+        self._claves.insert(posicion, pedido_id)
+        self._fechas.insert(posicion, fecha)
+        self._por_dia[fecha[:10]] += 1
+        self._por_id[pedido_id] = pedido
+        tracking = pedido['tracking'].upper()
+        self._por_tracking[tracking] = pedido
+        if not FORMATO_TRACKING.fullmatch(tracking):
+            self._trackings_con_formato = False
+        self._indice.agregar(pedido_id, pedido)
+    
+    def registrar_cambio_estado(self, pedido, estado_anterior):
+        """
+        Mueve el pedido a la cubeta de su nuevo estado de envío y persiste
+        el cambio. El llamador debe tener tomado lock_estados.
+        """
+        with self._lock_listados:
+            self._indice.mover(pedido['id'], 'estado_envio', estado_anterior, pedido['estado_envio'])
+        if self.almacen:
+            self.almacen.guardar_estado(pedido)
+    
+    def deshacer_cambio_estado(self, pedido, estado_anterior, ubicacion_anterior):
+        """
+        Revierte en memoria un cambio de estado que no se pudo guardar:
+        quita la última entrada del historial y devuelve el pedido a su
+        cubeta. El llamador debe tener tomado lock_estados.
+        """
+        estado = pedido['estado_envio']
+        pedido['estado_envio'] = estado_anterior
+        pedido['ubicacion_actual'] = ubicacion_anterior
+        pedido['historial_envio'].pop()
+        with self._lock_listados:
+            self._indice.mover(pedido['id'], 'estado_envio', estado, estado_anterior)
+    
+    def listar(self, filtros=None, desde=None, hasta=None, cursor=None, limite=None, vista=None):
+        """
+        Pedidos del más reciente al más antiguo, filtrados con los índices.
+        - filtros: {campo de CAMPOS_INDEXADOS: (valores aceptados, ...)}
+        - desde/hasta: fechas YYYY-MM-DD, inclusivas
+        - cursor: id del último pedido de la página anterior
+        - vista: 'en_proceso' (aún no entregados) o 'entregados'
+        Devuelve (pedidos, id para la siguiente página o None).
+        """
+        filtros = dict(filtros or {})
+        self.refrescar()
+        with self._lock_listados:
+            if vista is not None:
+                # La vista son cubetas de estado (intersección con el filtro pedido)
+                entregados = vista == 'entregados'
+                estados = filtros.get('estado_envio') or self._indice.valores('estado_envio')
+                filtros['estado_envio'] = tuple(e for e in estados if (e == 'entregado') == entregados)
+            
+            # Si las fechas crecen con el id, el rango de fechas es un rango de ids
+            primero = ultimo = condicion = None
+            if (desde or hasta) and self._fechas_ordenadas:
+                inicio = bisect_left(self._fechas, desde) if desde else 0
+                fin = bisect_right(self._fechas, hasta + '\uffff') if hasta else len(self._fechas)
+                if inicio >= fin:
+                    return [], None
+                primero, ultimo = self._claves[inicio], self._claves[fin - 1]
+            elif desde or hasta:
+                condicion = lambda pedido: (
+                    (not desde or pedido['fecha'] >= desde) and
+                    (not hasta or pedido['fecha'][:10] <= hasta)
+                )
+            
+            return consultar(
+                self._claves, self._indice, filtros, self._por_id.__getitem__,
+                desde=primero, hasta=ultimo, cursor=cursor, limite=limite, descendente=True,
+                condicion=condicion
+            )
+    
+    def iterar(self, filtros=None, desde=None, hasta=None, vista=None):
+        """Generador de pedidos con los filtros de listar(), por páginas"""
+        return iterar_paginas(
+            lambda cursor, limite: self.listar(filtros, desde, hasta, cursor, limite, vista)
+        )
+    
     def obtener_historial(self):
         """Obtiene el historial completo de pedidos"""
-        return sorted(self.pedidos, key=lambda x: x['id'], reverse=True)
+        return self.listar()[0]
     
     def obtener_pedidos_en_proceso(self):
         """Obtiene pedidos que aún no han sido entregados"""
-        en_proceso = [p for p in self.pedidos if p['estado_envio'] != 'entregado']
-        return sorted(en_proceso, key=lambda x: x['id'], reverse=True)
+        return self.listar(vista='en_proceso')[0]
+    
+    def obtener_pedidos_entregados(self):
+        """Obtiene los pedidos ya entregados"""
+        return self.listar(vista='entregados')[0]
     
     def obtener_pedido(self, pedido_id):
         """Obtiene un pedido por su ID"""
-        for pedido in self.pedidos:
-            if pedido['id'] == pedido_id:
-                return pedido
-        return None
+        self.refrescar()
+        return self._por_id.get(pedido_id)
     
     def obtener_pedido_por_tracking(self, tracking):
-        """Obtiene un pedido por su número de tracking"""
+        """Obtiene un pedido por su número de tracking (sin distinguir mayúsculas)"""
         tracking_upper = tracking.upper()
-        for pedido in self.pedidos:
-            if pedido['tracking'].upper() == tracking_upper:
-                return pedido
-        return None
+        # Un tracking con otro formato no puede existir: se descarta sin buscar
+        if self._trackings_con_formato and not FORMATO_TRACKING.fullmatch(tracking_upper):
+            return None
+        self.refrescar()
+        return self._por_tracking.get(tracking_upper)
+    
+    # ============================================================
+    # PEDIDOS DE OTROS PROCESOS
+    # ============================================================
+    
+    def refrescar(self):
+        """
+        Trae a memoria lo que otros procesos guardaron en el almacén
+        compartido: pedidos nuevos, cambios de estado de envío y valores
+        de contratos y stock. Sin almacén compartido no hace nada; si no
+        hubo cambios cuesta una consulta.
+        """
+        if not self._compartido or self.almacen.al_dia():
+            return
+        
+        with self.lock_estados:
+            for guardado in self.almacen.refrescar(self.data):
+                pedido = self._por_id.get(guardado['id'])
+                if pedido is None:
+                    with self._lock_listados:
+                        self._indexar(guardado)
+                elif len(guardado['historial_envio']) > len(pedido['historial_envio']):
+                    estado_anterior = pedido['estado_envio']
+                    pedido['estado_envio'] = guardado['estado_envio']
+                    pedido['ubicacion_actual'] = guardado['ubicacion_actual']
+                    pedido['historial_envio'][:] = guardado['historial_envio']
+                    with self._lock_listados:
+                        self._indice.mover(pedido['id'], 'estado_envio', estado_anterior, pedido['estado_envio'])
+    
+    def _refrescar_periodicamente(self, intervalo):
+        while True:
+            time.sleep(intervalo)
+            try:
+                self.refrescar()
+            except Exception as e:
+                print(f"❌ Error refrescando pedidos: {e}")
     
     def obtener_estadisticas_pedidos(self):
         """Obtiene estadísticas de pedidos"""
         hoy = datetime.now().strftime('%Y-%m-%d')
+        self.refrescar()
         
-        pedidos_hoy = len([p for p in self.pedidos if p['fecha'].startswith(hoy)])
-        pedidos_en_proceso = len([p for p in self.pedidos if p['estado_envio'] != 'entregado'])
-        pedidos_entregados = len([p for p in self.pedidos if p['estado_envio'] == 'entregado'])
+        # Conteos desde los índices: contador por día y tamaño de la cubeta
+        with self._lock_listados:
+            total = len(self._claves)
+            pedidos_hoy = self._por_dia.get(hoy, 0)
+            pedidos_entregados = self._indice.contar('estado_envio', 'entregado')
+        pedidos_en_proceso = total - pedidos_entregados
         
         return {
             'pedidos_hoy': pedidos_hoy,
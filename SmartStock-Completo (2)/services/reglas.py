@@ -0,0 +1,274 @@
+"""
+Reglas - Variantes configurables de la Regla de Oro
+===================================================
+Las variantes por cliente y por producto (tolerancias de tarjetas
+inactivas, topes por temporada) se definen en data/reglas.json y se
+compilan una sola vez al cargar en funciones que ajustan el máximo
+autorizable de validar_pedido.
+
+Formato:
+    {"reglas": [
+        {"id": "tolerancia_cliente_7", "tipo": "tolerancia_inactivas",
+         "clientes": [7], "porcentaje": 10},
+        {"id": "tope_navidad", "tipo": "tope_pedido",
+         "productos": [3], "maximo": 500, "meses": [11, 12]}
+    ]}
+
+- tolerancia_inactivas: hasta `porcentaje`% de las tarjetas actuales
+  pueden estar inactivas sin contar en contra (se suman al uso).
+- tope_pedido: máximo de tarjetas por pedido.
+- Sin "clientes" ni "productos" la regla es global; con ambos aplica
+  solo a esas combinaciones. "meses" (1-12) la limita a una temporada.
+
+Las reglas se indexan por cliente y por producto, así cada validación
+evalúa solo las que le aplican: de la más general a la más específica
+y, con la misma especificidad, en el orden del archivo. Una tolerancia
+más específica reemplaza a una más general; de los topes gana el menor.
+"""
+
+import json
+import os
+import threading
+from datetime import date
+from time import perf_counter_ns
+
+
+# ============================================================
+# COMPILACIÓN
+# ============================================================
+
+def _numero(definicion, campo, minimo=0, maximo=None):
+    valor = definicion.get(campo)
+    if isinstance(valor, bool) or not isinstance(valor, (int, float)):
+        raise ValueError(f'"{campo}" debe ser numérico')
+    if valor < minimo or (maximo is not None and valor > maximo):
+        rango = f'entre {minimo} y {maximo}' if maximo is not None else f'>= {minimo}'
+        raise ValueError(f'"{campo}" debe estar {rango}')
+    return valor
+
+
+def _compilar_tolerancia(definicion):
+    fraccion = _numero(definicion, 'porcentaje', 0, 100) / 100
+    
+    def aplicar(ajuste, actuales, inactivas):
+        ajuste['inactivas_toleradas'] = min(inactivas, int(actuales * fraccion))
+    return aplicar
+
+
+def _compilar_tope(definicion):
+    maximo = _numero(definicion, 'maximo')
+    if not isinstance(maximo, int):
+        raise ValueError('"maximo" debe ser un entero')
+    
+    def aplicar(ajuste, actuales, inactivas):
+        if ajuste['tope_pedido'] is None or maximo < ajuste['tope_pedido']:
+            ajuste['tope_pedido'] = maximo
+    return aplicar
+
+
+# Tipo de regla -> compilador (definición -> función que ajusta)
+TIPOS = {
+    'tolerancia_inactivas': _compilar_tolerancia,
+    'tope_pedido': _compilar_tope
+}
+
+
+def _ids(definicion, campo):
+    """Lista opcional de ids como frozenset (None = todos)"""
+    valores = definicion.get(campo)
+    if valores is None:
+        return None
+    if not isinstance(valores, list) or not all(isinstance(v, int) and not isinstance(v, bool) for v in valores):
+        raise ValueError(f'"{campo}" debe ser una lista de ids enteros')
+    return frozenset(valores)
+
+
+class Regla:
+    """Regla compilada con sus contadores de evaluación"""
+    
+    __slots__ = (
+        'id', 'tipo', 'clientes', 'productos', 'meses', 'orden', 'aplicar',
+        'evaluaciones', 'fuera_de_temporada', 'tiempo_ns'
+    )
+    
+    def __init__(self, definicion, orden):
+        if not isinstance(definicion, dict):
+            raise ValueError('cada regla debe ser un objeto')
+        
+        tipo = definicion.get('tipo')
+        if tipo not in TIPOS:
+            raise ValueError(f'tipo desconocido: {tipo!r} (válidos: {", ".join(TIPOS)})')
+        
+        meses = definicion.get('meses')
+        if meses is not None and (
+            not isinstance(meses, list) or not all(isinstance(m, int) and 1 <= m <= 12 for m in meses)
+        ):
+            raise ValueError('"meses" debe ser una lista de números del 1 al 12')
+        
+        self.id = str(definicion.get('id') or f'regla_{orden + 1}')
+        self.tipo = tipo
+        self.clientes = _ids(definicion, 'clientes')
+        self.productos = _ids(definicion, 'productos')
+        self.meses = frozenset(meses) if meses else None
+        self.orden = orden
+        self.aplicar = TIPOS[tipo](definicion)
+        
+        self.evaluaciones = 0
+        self.fuera_de_temporada = 0
+        self.tiempo_ns = 0
+    
+    def especificidad(self):
+        """0 global, 1 por producto, 2 por cliente, 3 por cliente y producto"""
+        return (2 if self.clientes is not None else 0) + (1 if self.productos is not None else 0)
+    
+    def aplica_a(self, cliente_id, producto_id):
+        return (
+            (self.clientes is None or cliente_id in self.clientes) and
+            (self.productos is None or producto_id in self.productos)
+        )
+
+
+# ============================================================
+# CONJUNTO DE REGLAS
+# ============================================================
+
+class ConjuntoReglas:
+    """Reglas compiladas e indexadas por cliente y por producto"""
+    
+    ARCHIVO = 'reglas.json'
+    
+    def __init__(self, definiciones=()):
+        self.reglas = []
+        self.errores = []
+        for orden, definicion in enumerate(definiciones):
+            try:
+                self.reglas.append(Regla(definicion, orden))
+            except ValueError as e:
+                self.errores.append((orden + 1, str(e)))
+        
+        # Índices: una regla con clientes va al de clientes (aunque también
+        # filtre productos); con solo productos, al de productos
+        self._globales = []
+        self._por_cliente = {}
+        self._por_producto = {}
+        for regla in self.reglas:
+            if regla.clientes is not None:
+                for cliente_id in regla.clientes:
+                    self._por_cliente.setdefault(cliente_id, []).append(regla)
+            elif regla.productos is not None:
+                for producto_id in regla.productos:
+                    self._por_producto.setdefault(producto_id, []).append(regla)
+            else:
+                self._globales.append(regla)
+        
+        # Con reglas por temporada el resultado cambia con el mes
+        self.por_temporada = any(regla.meses is not None for regla in self.reglas)
+        
+        # (cliente, producto) -> reglas que aplican, ya ordenadas
+        self._aplicables = {}
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def cargar(cls, data_path):
+        """Lee y compila data_path/reglas.json (sin archivo no hay reglas)"""
+        ruta = os.path.join(data_path, cls.ARCHIVO)
+        if not os.path.exists(ruta):
+            return cls()
+        
+        try:
+            with open(ruta, 'r', encoding='utf-8') as f:
+                contenido = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"❌ Error leyendo {cls.ARCHIVO}: {e}")
+            return cls()
+        
+        definiciones = contenido.get('reglas', []) if isinstance(contenido, dict) else contenido
+        if not isinstance(definiciones, list):
+            print(f"❌ {cls.ARCHIVO}: se esperaba una lista de reglas")
+            return cls()
+        
+        conjunto = cls(definiciones)
+        print(f"   ✓ Reglas configurables: {len(conjunto.reglas)}")
+        if conjunto.errores:
+            print(f"⚠️  {cls.ARCHIVO}: {len(conjunto.errores)} reglas inválidas omitidas")
+            for posicion, mensaje in conjunto.errores:
+                print(f"     → regla {posicion}: {mensaje}")
+        return conjunto
+    
+    def __len__(self):
+        return len(self.reglas)
+    
+    def aplicables(self, cliente_id, producto_id):
+        """Reglas que aplican a un cliente-producto, en orden de evaluación"""
+        clave = (cliente_id, producto_id)
+        reglas = self._aplicables.get(clave)
+        if reglas is None:
+            candidatas = (
+                self._globales +
+                self._por_producto.get(producto_id, []) +
+                self._por_cliente.get(cliente_id, [])
+            )
+            reglas = tuple(sorted(
+                (r for r in candidatas if r.aplica_a(cliente_id, producto_id)),
+                key=lambda r: (r.especificidad(), r.orden)
+            ))
+            self._aplicables[clave] = reglas
+        return reglas
+    
+    def ajustar(self, cliente_id, producto_id, actuales, inactivas, fecha=None):
+        """
+        Evalúa las reglas de un cliente-producto.
+        Devuelve None si ninguna aplica, o un dict con:
+        - aplicadas: ids de las reglas evaluadas
+        - inactivas_toleradas: inactivas que se suman al uso permitido
+        - tope_pedido: máximo por pedido (None sin tope)
+        """
+        reglas = self.aplicables(cliente_id, producto_id)
+        if not reglas:
+            return None
+        
+        mes = (fecha or date.today()).month
+        ajuste = {'aplicadas': [], 'inactivas_toleradas': 0, 'tope_pedido': None}
+        tiempos = []
+        for regla in reglas:
+            if regla.meses is not None and mes not in regla.meses:
+                tiempos.append((regla, None))
+                continue
+            inicio = perf_counter_ns()
+            regla.aplicar(ajuste, actuales, inactivas)
+            tiempos.append((regla, perf_counter_ns() - inicio))
+            ajuste['aplicadas'].append(regla.id)
+        
+        with self._lock:
+            for regla, tiempo in tiempos:
+                if tiempo is None:
+                    regla.fuera_de_temporada += 1
+                else:
+                    regla.evaluaciones += 1
+                    regla.tiempo_ns += tiempo
+        
+        return ajuste if ajuste['aplicadas'] else None
+    
+    def obtener_metricas(self):
+        """Contadores y tiempos por regla, de la más costosa a la menos"""
+        with self._lock:
+            metricas = [
+                {
+                    'id': regla.id,
+                    'tipo': regla.tipo,
+                    'clientes': sorted(regla.clientes) if regla.clientes is not None else None,
+                    'productos': sorted(regla.productos) if regla.productos is not None else None,
+                    'meses': sorted(regla.meses) if regla.meses is not None else None,
+                    'evaluaciones': regla.evaluaciones,
+                    'fuera_de_temporada': regla.fuera_de_temporada,
+                    'tiempo_total_ms': round(regla.tiempo_ns / 1e6, 3),
+                    'tiempo_promedio_us': round(regla.tiempo_ns / regla.evaluaciones / 1e3, 3) if regla.evaluaciones else 0
+                }
+                for regla in self.reglas
+            ]
+        metricas.sort(key=lambda m: m['tiempo_total_ms'], reverse=True)
+        return {
+            'total_reglas': len(self.reglas),
+            'reglas_invalidas': len(self.errores),
+            'reglas': metricas
+        }
@@ -0,0 +1,86 @@
+"""
+SecuenciaIds - Ids de pedido únicos entre procesos y reinicios
+==============================================================
+Varios workers comparten un archivo SQLite con el próximo id libre.
+Cada proceso reserva un bloque de ids de una vez (BEGIN IMMEDIATE: la
+reserva es atómica entre procesos) y los entrega desde memoria; solo
+vuelve al archivo cuando agota el bloque.
+
+- Los ids nunca se repiten entre procesos ni entre reinicios; dentro de
+  un proceso son crecientes y entre procesos quedan cerca (a lo más un
+  bloque de distancia).
+- Los ids de un bloque que no se llegan a usar (al apagar) se pierden:
+  quedan huecos, nunca repetidos.
+- Va en su propio archivo: las reservas ocurren mientras el almacén
+  tiene abierta su transacción de escritura y, en la misma base,
+  esperarían por ella.
+"""
+
+import sqlite3
+import threading
+
+
+ESQUEMA = 'CREATE TABLE IF NOT EXISTS secuencias (nombre TEXT PRIMARY KEY, siguiente INTEGER NOT NULL)'
+
+
+class SecuenciaIds:
+    """Secuencia de ids compartida, reservada por bloques"""
+    
+    def __init__(self, ruta, nombre='pedidos', bloque=100):
+        self.ruta = ruta
+        self.nombre = nombre
+        self.bloque = bloque
+        self.bloques_reservados = 0
+        
+        # Bloque actual en memoria: ids [_siguiente, _limite)
+        self._siguiente = 0
+        self._limite = 0
+        self._minimo = 1
+        self._lock = threading.Lock()
+        
+        # Solo se usa con _lock tomado: una conexión basta para todos los hilos
+        self._conexion = sqlite3.connect(ruta, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conexion.execute('PRAGMA journal_mode=WAL')
+        self._conexion.execute(ESQUEMA)
+        print(f"🔢 Secuencia de ids compartida: {ruta} (bloques de {bloque})")
+    
+    def asegurar_minimo(self, minimo):
+        """Los ids que se entreguen desde ahora serán >= minimo"""
+        with self._lock:
+            self._minimo = max(self._minimo, minimo)
+            if self._siguiente < self._minimo:
+                self._limite = 0  # el bloque actual queda por debajo: se descarta
+    
+    def siguiente(self):
+        """Próximo id (reserva un bloque nuevo si se agotó el actual)"""
+        with self._lock:
+            if self._siguiente >= self._limite:
+                self._reservar()
+            pedido_id = self._siguiente
+            self._siguiente += 1
+            return pedido_id
+    
+    def _reservar(self):
+        conexion = self._conexion
+        conexion.execute('BEGIN IMMEDIATE')
+        try:
+            fila = conexion.execute(
+                'SELECT siguiente FROM secuencias WHERE nombre = ?', (self.nombre,)
+            ).fetchone()
+            inicio = max(fila[0] if fila else 1, self._minimo)
+            conexion.execute(
+                'INSERT OR REPLACE INTO secuencias (nombre, siguiente) VALUES (?, ?)',
+                (self.nombre, inicio + self.bloque)
+            )
+        except BaseException:
+            conexion.execute('ROLLBACK')
+            raise
+        conexion.execute('COMMIT')
+        
+        self._siguiente = inicio
+        self._limite = inicio + self.bloque
+        self.bloques_reservados += 1
+    
+    def cerrar(self):
+        with self._lock:
+            self._conexion.close()
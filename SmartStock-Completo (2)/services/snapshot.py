@@ -0,0 +1,172 @@
+"""
+Snapshot - Caché binaria de las tablas cargadas
+===============================================
+Guarda las tablas ya parseadas en un archivo columnar junto a data/.
+Si los CSV no cambiaron (mismo mtime y tamaño), el siguiente arranque
+mapea el archivo con mmap en lugar de volver a parsear los CSV.
+
+Formato del archivo:
+    MAGIC | largo del encabezado (8 bytes) | encabezado JSON | columnas
+Cada columna entera es un bloque de int64 nativos; cada columna de texto
+es un bloque UTF-8 más un bloque int64 con los offsets de cada valor.
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+MAGIC = b'SSNAP1\n'
+VERSION_FORMATO = 1
+
+_LARGO = struct.Struct('<Q')
+
+
+def huella_fuentes(data_path, archivos):
+    """Devuelve {archivo: [mtime_ns, tamaño]} de los CSV fuente"""
+    huella = {}
+    for archivo in archivos:
+        try:
+            st = os.stat(os.path.join(data_path, archivo))
+            huella[archivo] = [st.st_mtime_ns, st.st_size]
+        except OSError:
+            huella[archivo] = None
+    return huella
+
+
+def _alinear(n):
+    return (n + 7) & ~7
+
+
+def guardar_snapshot(ruta, huella, tablas, extras=None):
+    """
+    Escribe el snapshot de forma atómica (archivo temporal + replace).
+    tablas: {nombre: (modelo, registros)}
+    extras: datos JSON adicionales que se guardan en el encabezado
+    Lanza OverflowError si un entero no cabe en 64 bits.
+    """
+    bloques = []
+    desplazamiento = 0
+    encabezado_tablas = {}
+
+    for nombre, (modelo, registros) in tablas.items():
+        columnas = {}
+        for campo, tipo in modelo.CAMPOS.items():
+            valores = [getattr(r, campo) for r in registros]
+            if tipo is int:
+                datos = array('q', valores).tobytes()
+                columnas[campo] = {'tipo': 'int', 'offset': desplazamiento, 'bytes': len(datos)}
+                bloques.append(datos)
+                desplazamiento += _alinear(len(datos))
+            else:
+                codificados = [v.encode('utf-8') for v in valores]
+                offsets = array('q', [0])
+                for v in codificados:
+                    offsets.append(offsets[-1] + len(v))
+                texto = b''.join(codificados)
+                datos_offsets = offsets.tobytes()
+                columnas[campo] = {
+                    'tipo': 'str',
+                    'offset': desplazamiento,
+                    'bytes': len(texto),
+                    'offset_indices': desplazamiento + _alinear(len(texto)),
+                    'bytes_indices': len(datos_offsets)
+                }
+                bloques.append(texto)
+                desplazamiento += _alinear(len(texto))
+                bloques.append(datos_offsets)
+                desplazamiento += _alinear(len(datos_offsets))
+
+        encabezado_tablas[nombre] = {'filas': len(registros), 'columnas': columnas}
+
+    encabezado = json.dumps({
+        'version': VERSION_FORMATO,
+        'byteorder': sys.byteorder,
+        'fuentes': huella,
+        'tablas': encabezado_tablas,
+        'extras': extras or {}
+    }).encode('utf-8')
+
+    inicio_datos = _alinear(len(MAGIC) + _LARGO.size + len(encabezado))
+
+    temporal = f'{ruta}.{os.getpid()}.tmp'
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    with open(temporal, 'wb') as f:
+        f.write(MAGIC)
+        f.write(_LARGO.pack(len(encabezado)))
+        f.write(encabezado)
+        f.write(b'\0' * (inicio_datos - f.tell()))
+        for datos in bloques:
+            f.write(datos)
+            f.write(b'\0' * (_alinear(len(datos)) - len(datos)))
+    os.replace(temporal, ruta)
+
+
+def cargar_snapshot(ruta, huella, modelos):
+    """
+    Carga el snapshot si corresponde a la huella actual de los CSV.
+    modelos: {nombre: modelo}
+    Devuelve ({nombre: registros}, extras) o None si no es válido.
+    """
+    try:
+        f = open(ruta, 'rb')
+    except OSError:
+        return None
+
+    with f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        try:
+            return _leer_mapeado(mm, huella, modelos)
+        except (ValueError, KeyError, TypeError, struct.error):
+            # Snapshot corrupto o de otra versión: se ignora y se reparsea
+            return None
+        finally:
+            mm.close()
+
+
+def _leer_mapeado(mm, huella, modelos):
+    """Construye los registros leyendo las columnas directo del mapa de memoria"""
+    if mm[:len(MAGIC)] != MAGIC:
+        return None
+
+    largo, = _LARGO.unpack_from(mm, len(MAGIC))
+    inicio = len(MAGIC) + _LARGO.size
+    encabezado = json.loads(mm[inicio:inicio + largo].decode('utf-8'))
+
+    if (encabezado['version'] != VERSION_FORMATO
+            or encabezado['byteorder'] != sys.byteorder
+            or encabezado['fuentes'] != huella):
+        return None
+
+    inicio_datos = _alinear(inicio + largo)
+    vista = memoryview(mm)
+    tablas = {}
+
+    try:
+        for nombre, modelo in modelos.items():
+            info = encabezado['tablas'][nombre]
+            filas = info['filas']
+            columnas = []
+            for campo in modelo.CAMPOS:
+                col = info['columnas'][campo]
+                desde = inicio_datos + col['offset']
+                if col['tipo'] == 'int':
+                    # Vista int64 sin copiar sobre el archivo mapeado
+                    columnas.append(vista[desde:desde + col['bytes']].cast('q').tolist())
+                else:
+                    texto = mm[desde:desde + col['bytes']]
+                    desde_idx = inicio_datos + col['offset_indices']
+                    offsets = vista[desde_idx:desde_idx + col['bytes_indices']].cast('q').tolist()
+                    columnas.append([
+                        texto[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(filas)
+                    ])
+            tablas[nombre] = [modelo(*valores) for valores in zip(*columnas)] if columnas else []
+    finally:
+        vista.release()
+
+    return tablas, encabezado.get('extras', {})
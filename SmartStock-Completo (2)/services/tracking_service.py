@@ -3,6 +3,7 @@ TrackingService - Servicio de seguimiento de envíos
 ====================================================
 """
 
+from contextlib import contextmanager
 from datetime import datetime
 
 
@@ -11,6 +12,9 @@ class TrackingService:
     
     ESTADOS = ['solicitado', 'aprobado', 'en_preparacion', 'en_camino', 'entregado']
     
+    # Estado -> posición en ESTADOS (sin ESTADOS.index() en cada cambio)
+    POSICION = {estado: posicion for posicion, estado in enumerate(ESTADOS)}
+    
     ESTADOS_INFO = {
         'solicitado': {
             'orden': 0,
@@ -57,8 +61,10 @@ class TrackingService:
         'entregado': 'Entregado al cliente'
     }
     
-    def __init__(self, pedidos_service):
+    def __init__(self, pedidos_service, eventos=None):
         self.pedidos = pedidos_service
+        # BusEventos opcional: recibe cada cambio de estado aplicado
+        self.eventos = eventos
     
     def buscar_por_tracking(self, tracking):
         """Busca un pedido por su número de tracking"""
@@ -80,9 +86,9 @@ class TrackingService:
     
     def _calcular_progreso(self, estado):
         """Calcula el porcentaje de progreso"""
-        if estado not in self.ESTADOS:
+        if estado not in self.POSICION:
             return 0
-        idx = self.ESTADOS.index(estado)
+        idx = self.POSICION[estado]
         return ((idx + 1) / len(self.ESTADOS)) * 100
     
     def actualizar_estado(self, pedido_id, nuevo_estado, comentario=None, ubicacion=None):
@@ -92,15 +98,98 @@ class TrackingService:
         if not pedido:
             return {'success': False, 'error': 'Pedido no encontrado'}
         
-        if nuevo_estado not in self.ESTADOS:
+        if nuevo_estado not in self.POSICION:
             return {'success': False, 'error': f'Estado inválido: {nuevo_estado}'}
         
-        estado_actual = pedido.get('estado_envio', 'solicitado')
-        idx_actual = self.ESTADOS.index(estado_actual)
-        idx_nuevo = self.ESTADOS.index(nuevo_estado)
+        # Comprobar, aplicar y mover de cubeta sin otro cambio de estado en
+        # medio (con almacén compartido, tampoco de otro proceso: se compara
+        # con el estado guardado)
+        with self.pedidos.lock_estados, self._transaccion([]) as aplicados:
+            self.pedidos.refrescar()
+            estado_anterior = pedido.get('estado_envio', 'solicitado')
+            error = self._aplicar(pedido, nuevo_estado, comentario, ubicacion, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), aplicados)
+            evento = None if error else self._evento(pedido, estado_anterior)
+        if error:
+            return {'success': False, 'error': error}
+        
+        self._publicar([evento])
+        return {
+            'success': True,
+            'mensaje': f'Estado actualizado a: {self.ESTADOS_INFO[nuevo_estado]["nombre"]}',
+            'pedido': pedido
+        }
+    
+    def actualizar_lote(self, cambios, comentario=None, ubicacion=None):
+        """
+        Aplica muchos cambios de estado [(pedido_id, nuevo_estado), ...]
+        con una sola fecha para todo el lote. Cada cambio se valida por
+        separado (solo hacia adelante) y, si un pedido se repite, contra
+        el estado que dejó el cambio anterior. Los cambios aplicados se
+        persisten en una sola transacción del almacén; si no se pueden
+        guardar, ninguno queda aplicado.
+        Devuelve un resultado por cambio, en el mismo orden.
+        """
+        fecha = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        resultados = []
+        eventos = []
+        
+        with self.pedidos.lock_estados, self._transaccion([]) as aplicados:
+            self.pedidos.refrescar()
+            for pedido_id, nuevo_estado in cambios:
+                pedido = self.pedidos.obtener_pedido(pedido_id)
+                if not pedido:
+                    error = 'Pedido no encontrado'
+                elif nuevo_estado not in self.POSICION:
+                    error = f'Estado inválido: {nuevo_estado}'
+                else:
+                    estado_anterior = pedido.get('estado_envio', 'solicitado')
+                    error = self._aplicar(pedido, nuevo_estado, comentario, ubicacion, fecha, aplicados)
+                
+                if error:
+                    resultados.append({'pedido_id': pedido_id, 'success': False, 'error': error})
+                else:
+                    resultados.append({
+                        'pedido_id': pedido_id,
+                        'success': True,
+                        'tracking': pedido['tracking'],
+                        'estado_anterior': estado_anterior,
+                        'estado': nuevo_estado
+                    })
+                    eventos.append(self._evento(pedido, estado_anterior))
         
-        if idx_nuevo <= idx_actual:
-            return {'success': False, 'error': 'No se puede retroceder el estado de envío'}
+        # Se publica después de persistir el lote
+        self._publicar(eventos)
+        aplicados = sum(1 for r in resultados if r['success'])
+        print(f"📦 Lote de estados: {aplicados} de {len(resultados)} cambios aplicados")
+        return resultados
+    
+    @contextmanager
+    def _transaccion(self, aplicados):
+        """
+        Transacción del almacén para cambios de estado. Si no se puede
+        guardar, los cambios ya hechos en memoria (los que _aplicar anotó
+        en `aplicados`) se revierten, del último al primero. Se usa con
+        lock_estados tomado.
+        """
+        try:
+            with self.pedidos.transaccion():
+                yield aplicados
+        except Exception:
+            for pedido, estado_anterior, ubicacion_anterior in reversed(aplicados):
+                self.pedidos.deshacer_cambio_estado(pedido, estado_anterior, ubicacion_anterior)
+            raise
+    
+    def _aplicar(self, pedido, nuevo_estado, comentario, ubicacion, fecha, aplicados):
+        """
+        Cambia el estado de envío de un pedido, agrega la entrada al
+        historial y lo registra (cubeta y almacén). Devuelve None, o el
+        error si el cambio retrocede. El llamador debe tener tomado
+        lock_estados; el cambio se anota en `aplicados` para deshacerlo.
+        """
+        estado_actual = pedido.get('estado_envio', 'solicitado')
+        if self.POSICION[nuevo_estado] <= self.POSICION[estado_actual]:
+            return 'No se puede retroceder el estado de envío'
+        aplicados.append((pedido, estado_actual, pedido.get('ubicacion_actual')))
         
         # Actualizar estado
         pedido['estado_envio'] = nuevo_estado
@@ -109,16 +198,40 @@ class TrackingService:
         # Agregar al historial
         pedido['historial_envio'].append({
             'estado': nuevo_estado,
-            'fecha': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'fecha': fecha,
             'comentario': comentario or self.ESTADOS_INFO[nuevo_estado]['descripcion']
         })
-        
+        self.pedidos.registrar_cambio_estado(pedido, estado_actual)
+        return None
+    
+    def estado_actual(self, pedido):
+        """Evento con el estado actual del pedido (primer mensaje de una suscripción)"""
+        with self.pedidos.lock_estados:
+            return self._evento(pedido, None)
+    
+    def _evento(self, pedido, estado_anterior):
+        """Foto del cambio de estado; se arma con lock_estados tomado"""
+        estado = pedido.get('estado_envio', 'solicitado')
+        ultimo = pedido['historial_envio'][-1] if pedido.get('historial_envio') else {}
         return {
-            'success': True,
-            'mensaje': f'Estado actualizado a: {self.ESTADOS_INFO[nuevo_estado]["nombre"]}',
-            'pedido': pedido
+            'pedido_id': pedido['id'],
+            'tracking': pedido['tracking'],
+            'cliente_id': pedido['cliente_id'],
+            'producto_id': pedido['producto_id'],
+            'estado_anterior': estado_anterior,
+            'estado': estado,
+            'ubicacion': pedido.get('ubicacion_actual', self.UBICACIONES.get(estado, '')),
+            'fecha': ultimo.get('fecha'),
+            'comentario': ultimo.get('comentario'),
+            'progreso': self._calcular_progreso(estado)
         }
     
+    def _publicar(self, eventos):
+        if self.eventos is None:
+            return
+        for evento in eventos:
+            self.eventos.publicar(evento['tracking'], evento)
+    
     def obtener_estados_info(self):
         """Obtiene información de todos los estados"""
         return self.ESTADOS_INFO
@@ -131,7 +244,7 @@ class TrackingService:
             return {'error': 'Pedido no encontrado'}
         
         estado_actual = pedido.get('estado_envio', 'solicitado')
-        idx_actual = self.ESTADOS.index(estado_actual)
+        idx_actual = self.POSICION.get(estado_actual, 0)
         
         timeline = []
         for i, estado in enumerate(self.ESTADOS):
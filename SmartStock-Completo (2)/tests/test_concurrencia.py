@@ -0,0 +1,213 @@
+"""
+Pruebas de concurrencia: muchos pedidos a la vez contra poco stock
+==================================================================
+N hilos confirman pedidos del mismo producto; lo asignado nunca puede
+superar el stock inicial y el stock final nunca queda negativo. Con
+SQLite se simulan dos workers (cada uno con sus propios servicios en
+memoria) sobre la misma base. Los pedidos de productos distintos no se
+esperan entre sí (los locks son por registro).
+    
+    python -m unittest discover tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+PROYECTO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROYECTO)
+
+from services.almacen_sqlite import AlmacenSQLite
+from services.data_service import DataService
+from services.motor_reglas import MotorReglas
+from services.pedidos_service import PedidosService
+from services.secuencia import SecuenciaIds
+
+
+PRODUCTO = 2
+# Clientes con contrato del producto 2 (y espacio de sobra en el contrato)
+CLIENTES = (28, 27, 2, 1, 10, 5)
+STOCK = 50
+HILOS = 8
+PEDIDOS_POR_HILO = 20
+CANTIDAD = 7
+# Un contrato (cliente_id, producto_id) con espacio por cada otro producto
+CONTRATOS_DISJUNTOS = ((3, 6), (1, 5), (16, 1), (12, 8), (12, 3), (16, 4), (11, 7), (4, 9))
+
+
+def _servicios(almacen=None, secuencia=None, stock=STOCK):
+    data = DataService(data_path=os.path.join(PROYECTO, 'data'), usar_snapshot=False)
+    data.restaurar_valores('productos', PRODUCTO, stock_current=stock)
+    motor = MotorReglas(data)
+    return data, PedidosService(data, motor, almacen=almacen, secuencia=secuencia)
+
+
+def _en_paralelo(tareas):
+    """Corre las tareas en hilos que arrancan juntos; devuelve sus resultados"""
+    barrera = threading.Barrier(len(tareas))
+    resultados = [None] * len(tareas)
+    errores = []
+    
+    def correr(posicion, tarea):
+        barrera.wait()
+        try:
+            resultados[posicion] = tarea()
+        except Exception as e:
+            errores.append(e)
+    
+    hilos = [threading.Thread(target=correr, args=(i, tarea)) for i, tarea in enumerate(tareas)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    if errores:
+        raise errores[0]
+    return resultados
+
+
+def _confirmar_muchos(pedidos, hilo):
+    """Confirma PEDIDOS_POR_HILO pedidos uno a uno; devuelve las tarjetas asignadas"""
+    asignado = 0
+    for i in range(PEDIDOS_POR_HILO):
+        cliente_id = CLIENTES[(hilo + i) % len(CLIENTES)]
+        resultado = pedidos.confirmar_pedido(cliente_id, PRODUCTO, CANTIDAD)
+        if resultado['success']:
+            asignado += resultado['pedido']['cantidad_aprobada']
+    return asignado
+
+
+class TestSinSobreventa(unittest.TestCase):
+    
+    def assertSinSobreventa(self, asignado, stock_final):
+        self.assertGreater(asignado, 0)
+        self.assertLessEqual(asignado, STOCK)
+        self.assertGreaterEqual(stock_final, 0)
+        self.assertEqual(stock_final, STOCK - asignado)
+    
+    def test_confirmaciones_concurrentes(self):
+        data, pedidos = _servicios()
+        
+        asignado = sum(_en_paralelo([
+            lambda hilo=hilo: _confirmar_muchos(pedidos, hilo) for hilo in range(HILOS)
+        ]))
+        
+        self.assertSinSobreventa(asignado, data.obtener_producto(PRODUCTO).stock_current)
+        self.assertEqual(asignado, sum(p['cantidad_aprobada'] for p in pedidos.obtener_historial()))
+    
+    def test_lotes_concurrentes(self):
+        data, pedidos = _servicios()
+        lote = [(cliente_id, PRODUCTO, CANTIDAD) for cliente_id in CLIENTES]
+        
+        def confirmar_lotes():
+            return sum(
+                r['pedido']['cantidad_aprobada']
+                for _ in range(PEDIDOS_POR_HILO // len(CLIENTES) + 1)
+                for r in pedidos.confirmar_lote(lote) if r['success']
+            )
+        
+        asignado = sum(_en_paralelo([confirmar_lotes] * HILOS))
+        
+        self.assertSinSobreventa(asignado, data.obtener_producto(PRODUCTO).stock_current)
+    
+    def test_productos_distintos_en_paralelo(self):
+        data, pedidos = _servicios()
+        stock_inicial = {p: data.obtener_producto(p).stock_current for _, p in CONTRATOS_DISJUNTOS}
+        # Todos los hilos tienen que estar a la vez dentro de su bloqueo:
+        # si se serializaran en un lock común, la barrera vencería
+        barrera = threading.Barrier(len(CONTRATOS_DISJUNTOS), timeout=5)
+        
+        def confirmar(cliente_id, producto_id):
+            with data.bloquear(contratos=[(cliente_id, producto_id)], productos=[producto_id]):
+                barrera.wait()
+                return pedidos.confirmar_pedido(cliente_id, producto_id, CANTIDAD)
+        
+        resultados = _en_paralelo([
+            lambda contrato=contrato: confirmar(*contrato) for contrato in CONTRATOS_DISJUNTOS
+        ])
+        
+        self.assertTrue(all(r['success'] for r in resultados))
+        for producto_id, stock in stock_inicial.items():
+            self.assertEqual(data.obtener_producto(producto_id).stock_current, stock - CANTIDAD)
+    
+    def test_producto_bloqueado_no_frena_a_otros(self):
+        data, pedidos = _servicios()
+        resultados = {}
+        
+        def confirmar(nombre, cliente_id, producto_id):
+            resultados[nombre] = pedidos.confirmar_pedido(cliente_id, producto_id, CANTIDAD)
+        
+        otro = threading.Thread(target=confirmar, args=('otro',) + CONTRATOS_DISJUNTOS[0])
+        mismo = threading.Thread(target=confirmar, args=('mismo', CLIENTES[0], PRODUCTO))
+        with data.bloquear(productos=[PRODUCTO]):
+            otro.start()
+            mismo.start()
+            otro.join(5)
+            # El pedido de otro producto termina con el producto 2 tomado...
+            self.assertFalse(otro.is_alive())
+            self.assertTrue(resultados['otro']['success'])
+            # ...y el del producto 2 espera a que se suelte
+            mismo.join(0.2)
+            self.assertTrue(mismo.is_alive())
+        mismo.join(5)
+        self.assertTrue(resultados['mismo']['success'])
+    
+    def test_workers_sobre_sqlite(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio, True)
+        ruta = os.path.join(directorio, 'smartstock.db')
+        ruta_ids = os.path.join(directorio, 'smartstock.ids.db')
+        
+        # El primer worker crea la base con el stock reducido; el segundo lo restaura de ahí
+        workers = [
+            _servicios(AlmacenSQLite(ruta), SecuenciaIds(ruta_ids)),
+            _servicios(AlmacenSQLite(ruta), SecuenciaIds(ruta_ids), stock=10 ** 6)
+        ]
+        
+        asignado = sum(_en_paralelo([
+            lambda hilo=hilo: _confirmar_muchos(workers[hilo % 2][1], hilo) for hilo in range(HILOS)
+        ]))
+        
+        almacen = workers[0][1].almacen
+        with almacen.transaccion() as tx:
+            stock_guardado = tx.execute('SELECT stock_current FROM productos WHERE id = ?', (PRODUCTO,)).fetchone()[0]
+            tarjetas_guardadas = tx.execute('SELECT SUM(cantidad_aprobada) FROM pedidos').fetchone()[0]
+        self.assertSinSobreventa(asignado, stock_guardado)
+        self.assertEqual(asignado, tarjetas_guardadas)
+        
+        # Cada worker ve el stock y los pedidos del otro
+        for data, pedidos in workers:
+            pedidos.refrescar()
+            self.assertEqual(data.obtener_producto(PRODUCTO).stock_current, stock_guardado)
+            self.assertEqual(asignado, sum(p['cantidad_aprobada'] for p in pedidos.obtener_historial()))
+    
+    def test_stock_insuficiente_al_guardar(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio, True)
+        data, pedidos = _servicios(AlmacenSQLite(os.path.join(directorio, 'smartstock.db')))
+        
+        # Otro proceso se llevó el stock y la memoria no lo sabe (sin sincronizar)
+        pedidos._sincronizar = lambda contratos, productos: None
+        contratos = 'SELECT SUM(card_current_amount) FROM contratos WHERE product_id = ?'
+        with pedidos.almacen.transaccion() as tx:
+            tx.execute('UPDATE productos SET stock_current = 1 WHERE id = ?', (PRODUCTO,))
+            tarjetas = tx.execute(contratos, (PRODUCTO,)).fetchone()[0]
+        
+        resultado = pedidos.confirmar_pedido(CLIENTES[0], PRODUCTO, CANTIDAD)
+        self.assertFalse(resultado['success'])
+        self.assertEqual(resultado['resultado']['razon'], 'sin_stock')
+        
+        lote = pedidos.confirmar_lote([(cliente_id, PRODUCTO, CANTIDAD) for cliente_id in CLIENTES[:2]])
+        self.assertEqual([r['resultado']['razon'] for r in lote], ['sin_stock', 'sin_stock'])
+        
+        with pedidos.almacen.transaccion() as tx:
+            self.assertEqual(tx.execute('SELECT stock_current FROM productos WHERE id = ?', (PRODUCTO,)).fetchone()[0], 1)
+            self.assertEqual(tx.execute('SELECT COUNT(*) FROM pedidos').fetchone()[0], 0)
+            self.assertEqual(tx.execute(contratos, (PRODUCTO,)).fetchone()[0], tarjetas)
+        self.assertEqual(pedidos.obtener_historial(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
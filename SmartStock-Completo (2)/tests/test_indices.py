@@ -0,0 +1,126 @@
+"""
+Pruebas de los índices ordenados y la paginación por cursor
+===========================================================
+Cada índice se compara contra un recorrido por fuerza bruta después de
+mover filas: el orden y las páginas tienen que coincidir, y un cursor
+tiene que volver a dar la misma clave.
+    
+    python -m unittest discover tests
+"""
+
+import contextlib
+import io
+import os
+import random
+import sys
+import unittest
+
+PROYECTO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROYECTO)
+
+from services.data_service import DataService
+from services.indice_acaparamiento import IndiceAcaparamiento
+from services.listados import IndiceListado, codificar_cursor, consultar, decodificar_cursor, iterar_paginas
+
+
+ESTADOS = ('aprobado', 'en_camino', 'entregado')
+
+
+class TestCursor(unittest.TestCase):
+    
+    def test_ida_y_vuelta(self):
+        for clave in (0, 41, 2 ** 62, 'SS-20261017-0001', [3, 'ñ']):
+            self.assertEqual(decodificar_cursor(codificar_cursor(clave)), clave)
+        self.assertIsNone(codificar_cursor(None))
+    
+    def test_cursor_invalido(self):
+        for cursor in ('%%%', codificar_cursor('abc')[:-2]):
+            with self.assertRaises(ValueError):
+                decodificar_cursor(cursor)
+
+
+class TestIndiceListado(unittest.TestCase):
+    
+    def setUp(self):
+        azar = random.Random(3)
+        self.filas = {clave: {'id': clave, 'estado': azar.choice(ESTADOS)} for clave in range(1, 200)}
+        self.indice = IndiceListado(['estado'])
+        for clave, fila in self.filas.items():
+            self.indice.agregar(clave, fila)
+        
+        # Cambios de estado: cada fila cambia de lista
+        for clave in azar.sample(sorted(self.filas), 80):
+            fila = self.filas[clave]
+            nuevo = azar.choice(ESTADOS)
+            self.indice.mover(clave, 'estado', fila['estado'], nuevo)
+            fila['estado'] = nuevo
+    
+    def _paginas(self, filtros, tamano, descendente=False):
+        def listar(cursor, limite):
+            return consultar(sorted(self.filas), self.indice, filtros, self.filas.get,
+                             cursor=cursor, limite=limite, descendente=descendente)
+        return [fila['id'] for fila in iterar_paginas(listar, tamano)]
+    
+    def test_filtros_contra_fuerza_bruta(self):
+        for estados in (('en_camino',), ('aprobado', 'entregado')):
+            esperado = [clave for clave in sorted(self.filas) if self.filas[clave]['estado'] in estados]
+            for tamano in (1, 7, 500):
+                self.assertEqual(self._paginas({'estado': estados}, tamano), esperado)
+                self.assertEqual(self._paginas({'estado': estados}, tamano, descendente=True), esperado[::-1])
+            self.assertEqual(sum(self.indice.contar('estado', e) for e in estados), len(esperado))
+    
+    def test_filas_nuevas_entre_paginas(self):
+        filas, siguiente = consultar(sorted(self.filas), self.indice, {}, self.filas.get, limite=10)
+        self.assertEqual([f['id'] for f in filas], list(range(1, 11)))
+        
+        # Una fila nueva no corre la página siguiente
+        self.filas[500] = {'id': 500, 'estado': 'aprobado'}
+        self.indice.agregar(500, self.filas[500])
+        filas, _ = consultar(sorted(self.filas), self.indice, {}, self.filas.get,
+                             cursor=decodificar_cursor(codificar_cursor(siguiente)), limite=10)
+        self.assertEqual([f['id'] for f in filas], list(range(11, 21)))
+
+
+class TestIndiceAcaparamiento(unittest.TestCase):
+    
+    def setUp(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.data = DataService(data_path=os.path.join(PROYECTO, 'data'), usar_snapshot=False)
+        self.indice = IndiceAcaparamiento(self.data)
+    
+    def _fuerza_bruta(self, umbral):
+        filas = []
+        for fila, contrato in enumerate(self.data.obtener_todos_contratos()):
+            if contrato.card_current_amount <= 0:
+                continue
+            porcentaje = contrato.card_inactive_amount / contrato.card_current_amount * 100
+            if porcentaje > umbral:
+                filas.append((-round(porcentaje, 1), fila))
+        return [(fila, -negativo) for negativo, fila in sorted(filas)]
+    
+    def _consultar(self, umbral, desplazamiento=0, limite=None):
+        total, tramo = self.indice.consultar(umbral, desplazamiento, limite)
+        contratos = self.data.obtener_todos_contratos()
+        filas = {id(contrato): fila for fila, contrato in enumerate(contratos)}
+        return total, [(filas[id(registro)], porcentaje) for registro, porcentaje in tramo]
+    
+    def test_cambios_de_contratos(self):
+        azar = random.Random(11)
+        contratos = self.data.obtener_todos_contratos()
+        self._consultar(0)  # construye el índice antes de los cambios
+        
+        for _ in range(5):
+            # Tarjetas actuales nuevas (0 saca al contrato del índice)
+            for contrato in azar.sample(contratos, 20):
+                self.data.restaurar_valores('contratos', contrato.clave(),
+                                            card_current_amount=azar.choice([0, 1, contrato.card_inactive_amount * 2, 10 ** 6]))
+            contratos = self.data.obtener_todos_contratos()
+            
+            for umbral in (0, 50, 100):
+                esperado = self._fuerza_bruta(umbral)
+                self.assertEqual(self._consultar(umbral), (len(esperado), esperado))
+                self.assertEqual(self._consultar(umbral, 5, 10), (len(esperado), esperado[5:15]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+"""
+Pruebas de la bitácora de pedidos (SMARTSTOCK_JOURNAL)
+======================================================
+Después de reiniciar, la reproducción de snapshot + bitácora deja el
+mismo stock, contratos y pedidos que había en memoria: aunque un pedido
+esté en ambos archivos, aunque la última línea quede a medio escribir y
+aunque una recarga de CSV en caliente haya cambiado los valores.
+    
+    python -m unittest discover tests
+"""
+
+import contextlib
+import csv
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+PROYECTO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROYECTO)
+
+from services.data_service import DataService
+from services.journal import JournalPedidos
+from services.motor_reglas import MotorReglas
+from services.pedidos_service import PedidosService
+
+
+CLIENTE = 1
+PRODUCTO = 5
+CONTRATO_FILA = 2  # id en contratos_clientes.csv del contrato (1, 5)
+CANTIDAD = 7
+
+
+class TestJournal(unittest.TestCase):
+    
+    def setUp(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio, True)
+        self.datos = os.path.join(directorio, 'data')
+        self.bitacora = os.path.join(directorio, 'journal')
+        shutil.copytree(os.path.join(PROYECTO, 'data'), self.datos)
+    
+    def _servicios(self):
+        """DataService + PedidosService restaurados desde la bitácora"""
+        with contextlib.redirect_stdout(io.StringIO()):
+            data = DataService(data_path=self.datos, usar_snapshot=False)
+            pedidos = PedidosService(data, MotorReglas(data), almacen=JournalPedidos(self.bitacora))
+        return data, pedidos
+    
+    def _confirmar(self, pedidos, veces=1):
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(veces):
+                self.assertTrue(pedidos.confirmar_pedido(CLIENTE, PRODUCTO, CANTIDAD)['success'])
+    
+    def _estado(self, data, pedidos):
+        return (
+            data.obtener_producto(PRODUCTO).stock_current,
+            data.obtener_contrato(CLIENTE, PRODUCTO).card_current_amount,
+            [p['id'] for p in pedidos.obtener_historial()]
+        )
+    
+    def _editar_csv(self, archivo, fila_id, campo, valor):
+        ruta = os.path.join(self.datos, archivo)
+        with open(ruta, newline='') as f:
+            filas = list(csv.DictReader(f))
+        for fila in filas:
+            if fila['id'] == str(fila_id):
+                fila[campo] = str(valor)
+        with open(ruta, 'w', newline='') as f:
+            escritor = csv.DictWriter(f, fieldnames=list(filas[0]))
+            escritor.writeheader()
+            escritor.writerows(filas)
+        # Otro mtime aunque el cambio caiga en el mismo instante
+        st = os.stat(ruta)
+        os.utime(ruta, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    
+    def test_reinicio_igual_a_memoria(self):
+        data, pedidos = self._servicios()
+        self._confirmar(pedidos, 3)
+        self.assertEqual(self._estado(*self._servicios()), self._estado(data, pedidos))
+    
+    def test_reproduccion_idempotente(self):
+        data, pedidos = self._servicios()
+        self._confirmar(pedidos, 2)
+        estado = self._estado(data, pedidos)
+        
+        # Corte a mitad de una compactación: los pedidos quedan en el
+        # snapshot y también en la bitácora
+        shutil.copy(os.path.join(self.bitacora, JournalPedidos.ARCHIVO_JOURNAL),
+                    os.path.join(self.bitacora, JournalPedidos.ARCHIVO_SNAPSHOT))
+        self.assertEqual(self._estado(*self._servicios()), estado)
+    
+    def test_ultima_linea_incompleta(self):
+        data, pedidos = self._servicios()
+        self._confirmar(pedidos, 2)
+        estado = self._estado(data, pedidos)
+        
+        with open(os.path.join(self.bitacora, JournalPedidos.ARCHIVO_JOURNAL), 'ab') as f:
+            f.write(b'{"t":"p","pedido":{"id":99')
+        data, pedidos = self._servicios()
+        self.assertEqual(self._estado(data, pedidos), estado)
+        
+        # La línea rota se descartó: lo que se escribe después se reproduce bien
+        self._confirmar(pedidos)
+        self.assertEqual(self._estado(*self._servicios()), self._estado(data, pedidos))
+    
+    def test_recarga_en_caliente(self):
+        data, pedidos = self._servicios()
+        self._confirmar(pedidos)
+        
+        self._editar_csv('contratos_clientes.csv', CONTRATO_FILA, 'card_current_amount', 40000)
+        self._editar_csv('productos.csv', PRODUCTO, 'stock_current', 50000)
+        with contextlib.redirect_stdout(io.StringIO()):
+            data.recargar_cambios()
+        self._confirmar(pedidos)
+        
+        estado = self._estado(data, pedidos)
+        self.assertEqual(estado[:2], (50000 - CANTIDAD, 40000 + CANTIDAD))
+        self.assertEqual(self._estado(*self._servicios()), estado)
+        
+        # Si el CSV se vuelve a editar con el servidor detenido, manda el CSV
+        self._editar_csv('productos.csv', PRODUCTO, 'stock_current', 900)
+        data, pedidos = self._servicios()
+        self.assertEqual(data.obtener_producto(PRODUCTO).stock_current, 900 - 2 * CANTIDAD)
+
+
+if __name__ == '__main__':
+    unittest.main()
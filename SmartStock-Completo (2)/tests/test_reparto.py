@@ -0,0 +1,56 @@
+"""
+Pruebas del reparto proporcional de stock (_repartir)
+=====================================================
+El reparto nunca da a nadie más de lo que pidió, suma exactamente
+min(stock, demanda total) y las unidades que sobran al redondear van a
+los residuos mayores (con empate, al primero).
+    
+    python -m unittest discover tests
+"""
+
+import os
+import random
+import sys
+import unittest
+
+PROYECTO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROYECTO)
+
+from services.motor_reglas import _repartir
+
+
+class TestRepartir(unittest.TestCase):
+    
+    def test_sobrante_al_residuo_mayor(self):
+        # 10 entre tres iguales: 3 cada uno y la unidad que sobra al primero
+        self.assertEqual(_repartir(10, [10, 10, 10], [1, 1, 1]), [4, 3, 3])
+        # 7 con pesos 2:1 -> 4.67 y 2.33: la unidad va a quien tiene .67
+        self.assertEqual(_repartir(7, [100, 100], [2, 1]), [5, 2])
+    
+    def test_sin_stock(self):
+        self.assertEqual(_repartir(0, [5, 3], [1, 1]), [0, 0])
+    
+    def test_demanda_menor_que_su_parte(self):
+        # El que pide 1 recibe 1 y lo que deja se reparte entre los demás
+        self.assertEqual(_repartir(10, [1, 20, 20], [1, 1, 1]), [1, 5, 4])
+        self.assertEqual(_repartir(5, [0, 9], [1, 1]), [0, 5])
+    
+    def test_stock_de_sobra(self):
+        self.assertEqual(_repartir(100, [3, 4], [1, 1]), [3, 4])
+    
+    def test_invariantes(self):
+        azar = random.Random(7)
+        for _ in range(500):
+            n = azar.randint(1, 6)
+            demandas = [azar.randint(0, 30) for _ in range(n)]
+            pesos = [azar.randint(1, 5) for _ in range(n)]
+            stock = azar.randint(0, 100)
+            
+            partes = _repartir(stock, demandas, pesos)
+            self.assertEqual(sum(partes), min(stock, sum(demandas)))
+            for parte, demanda in zip(partes, demandas):
+                self.assertTrue(0 <= parte <= demanda)
+
+
+if __name__ == '__main__':
+    unittest.main()
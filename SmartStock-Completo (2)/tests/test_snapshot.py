@@ -0,0 +1,96 @@
+"""
+Pruebas del snapshot binario de las tablas
+==========================================
+Lo que se guarda se lee igual; un cambio de mtime o tamaño en los CSV,
+un archivo corrupto o un entero fuera de 64 bits dejan sin snapshot
+(se vuelve a parsear el CSV).
+    
+    python -m unittest discover tests
+"""
+
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+PROYECTO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROYECTO)
+
+from services.data_service import DataService
+from services.modelos import Producto
+from services.snapshot import cargar_snapshot, guardar_snapshot, huella_fuentes
+
+
+PRODUCTOS = [
+    Producto(1, 'Libros', 70342, 14002),
+    Producto(2, 'Bebé ñandú', 0, 50),
+    Producto(3, '', -4, 2 ** 63 - 1)
+]
+
+
+class TestSnapshot(unittest.TestCase):
+    
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directorio, True)
+        self.ruta = os.path.join(self.directorio, 'tablas.snapshot')
+        self.huella = {'productos.csv': [1700000000000000000, 420]}
+    
+    def test_ida_y_vuelta(self):
+        guardar_snapshot(self.ruta, self.huella, {'productos': (Producto, PRODUCTOS)}, extras={'errores': [1]})
+        tablas, extras = cargar_snapshot(self.ruta, self.huella, {'productos': Producto})
+        
+        self.assertEqual([p.valores() for p in tablas['productos']], [p.valores() for p in PRODUCTOS])
+        self.assertEqual(extras, {'errores': [1]})
+    
+    def test_huella_distinta(self):
+        guardar_snapshot(self.ruta, self.huella, {'productos': (Producto, PRODUCTOS)})
+        mtime, tamano = self.huella['productos.csv']
+        for huella in ({'productos.csv': [mtime + 1, tamano]}, {'productos.csv': [mtime, tamano + 1]}):
+            self.assertIsNone(cargar_snapshot(self.ruta, huella, {'productos': Producto}))
+    
+    def test_archivo_corrupto(self):
+        guardar_snapshot(self.ruta, self.huella, {'productos': (Producto, PRODUCTOS)})
+        with open(self.ruta, 'r+b') as f:
+            f.truncate(40)
+        self.assertIsNone(cargar_snapshot(self.ruta, self.huella, {'productos': Producto}))
+        self.assertIsNone(cargar_snapshot(os.path.join(self.directorio, 'no-existe'), self.huella, {'productos': Producto}))
+    
+    def test_entero_fuera_de_rango(self):
+        with self.assertRaises(OverflowError):
+            guardar_snapshot(self.ruta, self.huella, {'productos': (Producto, [Producto(2 ** 70, 'x', 1, 1)])})
+    
+    def test_data_service(self):
+        datos = os.path.join(self.directorio, 'data')
+        shutil.copytree(os.path.join(PROYECTO, 'data'), datos)
+        
+        with contextlib.redirect_stdout(io.StringIO()):
+            desde_csv = DataService(data_path=datos)
+        self.assertTrue(os.path.exists(os.path.join(datos, DataService.RUTA_SNAPSHOT)))
+        
+        salida = io.StringIO()
+        with contextlib.redirect_stdout(salida):
+            desde_snapshot = DataService(data_path=datos)
+        self.assertIn('desde snapshot', salida.getvalue())
+        for nombre in DataService.TABLAS:
+            self.assertEqual(
+                [r.valores() for r in getattr(desde_snapshot, nombre)],
+                [r.valores() for r in getattr(desde_csv, nombre)]
+            )
+        
+        # Con otro tamaño del CSV se vuelve a parsear
+        with open(os.path.join(datos, 'productos.csv'), 'a') as f:
+            f.write('\n')
+        self.assertNotEqual(huella_fuentes(datos, ['productos.csv'])['productos.csv'],
+                            desde_csv._huella_archivos['productos.csv'])
+        salida = io.StringIO()
+        with contextlib.redirect_stdout(salida):
+            DataService(data_path=datos)
+        self.assertNotIn('desde snapshot', salida.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()